@@ -1,6 +1,6 @@
 import pandas as pd
 from datetime import datetime
-from context import cnx
+from context import cnx, bulk, matcher
 from sqlalchemy.orm import sessionmaker
 import re
 
@@ -18,18 +18,21 @@ companies_query = '''
     SPC_GEO
 )
 
+# exec roles at the geo's companies only
 execs_query = '''
     select
           r.company_id
         , r.role_title
         , r.linkedin_role_description
-        , p.linkedin_summary
-    from roles r 
-    left join persons p on p.person_id = r.person_id
+    from roles r
     left join score_v2.role_flags rf on rf.role_id = r.role_id
     where rf.seniority = 'exec'
-    and r.company_id is not null
-'''
+    and r.company_id in (
+        select company_id from score_v2.company_locations where spc_geo = '{}'
+    )
+'''.format(
+    SPC_GEO
+)
 delete_sweetspot_query = '''
     DO
     $$
@@ -51,17 +54,18 @@ delete_sweetspot_query = '''
 ss_exec_pattern = re.compile(
     r'\bai\b|\bAI\b|artificial intelligence|\bml\b|\bML\b|machine learning|deep learning|neural network|computer vision|natural language processing|\bnlp\b|\bNLP\b'
 )
+exec_matcher = matcher.compile_matcher({'has_sweetspot_exec': ss_exec_pattern})
+
 ai_io_pattern = re.compile(r'\.ai|\.io')
 ai_pattern = re.compile(r'.*AI\b|\bai\b')
 
 
-if __name__ == '__main__':
+def run(conn):
     print(
         '[{}] Starting company_sweetspot_flags_{}.py'.format(
             datetime.now(), SPC_GEO.lower()
         )
     )
-    conn = cnx.Cnx
 
     # Pull data
     print('[{}] Pulling companies...'.format(datetime.now()))
@@ -84,31 +88,20 @@ if __name__ == '__main__':
     # check company_name for 'AI' or 'ai'
     companies['has_ai_name'] = companies['company_name'].str.contains(ai_pattern)
 
-    # has_sweetspot_exec
+    # has_sweetspot_exec: the title or description of any of the company's exec
+    # roles matches ss_exec_pattern
     execs = raw_execs.copy()
-    execs_filled = execs.fillna('')
-    company_execs = (
-        execs_filled.groupby('company_id')
-        .agg(
-            {
-                'role_title': lambda x: ' '.join(x),
-                'linkedin_role_description': lambda x: ' '.join(x),
-                'linkedin_summary': lambda x: ' '.join(x),
-            }
-        )
-        .reset_index()
+    exec_texts = pd.concat(
+        [execs['role_title'], execs['linkedin_role_description']], ignore_index=True
     )
-
-    company_execs['has_sweetspot_exec'] = company_execs['role_title'].str.contains(
-        ss_exec_pattern
-    ) | company_execs['linkedin_role_description'].str.contains(ss_exec_pattern)
-
-    companies_with_execs = companies.merge(
-        company_execs[['company_id', 'has_sweetspot_exec']], on='company_id', how='left'
+    exec_companies = pd.concat([execs['company_id']] * 2, ignore_index=True)
+    is_sweetspot_text = (
+        matcher.match_flags(exec_texts, exec_matcher)['has_sweetspot_exec'] == True
     )
+    companies_with_execs = companies.copy()
     companies_with_execs['has_sweetspot_exec'] = companies_with_execs[
-        'has_sweetspot_exec'
-    ].fillna(False)
+        'company_id'
+    ].isin(exec_companies[is_sweetspot_text])
     print('[{}] Done creating intermediate sweetspot flags.'.format(datetime.now()))
 
     # creat final sweetspot flag
@@ -143,11 +136,15 @@ if __name__ == '__main__':
     ]
     to_write['spc_geo'] = SPC_GEO
     to_write['generated_at'] = datetime.now()
-    to_write.to_sql(
+    bulk.copy_to_sql(
+        to_write,
         'company_sweetspot_flags',
         conn,
         if_exists='append',
-        index=False,
         schema='score_v2',
     )
     print('[{}] Done writing to db.'.format(datetime.now()))
+
+
+if __name__ == '__main__':
+    run(cnx.Cnx)
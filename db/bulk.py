@@ -0,0 +1,535 @@
+import csv
+import io
+import json
+import struct
+import time
+from datetime import date, datetime, timedelta, timezone
+
+import pandas as pd
+from sqlalchemy import inspect, text, types
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.dialects import postgresql
+
+# Bulk writes via COPY FROM STDIN. DataFrame.to_sql still creates (or replaces)
+# the table with the types it infers from the whole frame, but the rows are
+# streamed with COPY instead of INSERTs, in the same transaction.
+
+COPY_CHUNKSIZE = 200000
+
+PG_EPOCH = datetime(2000, 1, 1)
+PG_EPOCH_TZ = datetime(2000, 1, 1, tzinfo=timezone.utc)
+PG_EPOCH_DATE = date(2000, 1, 1)
+
+PGCOPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PGCOPY_TRAILER = struct.pack('!h', -1)
+NULL_FIELD = struct.pack('!i', -1)
+
+CSV_NULL = '\\N'
+
+
+def is_json_type(sql_type):
+    return isinstance(sql_type, (postgresql.JSONB, postgresql.JSON, types.JSON))
+
+
+def copy_statement(table, conn, keys, options):
+    preparer = conn.dialect.identifier_preparer
+    return 'COPY {} ({}) FROM STDIN WITH ({})'.format(
+        preparer.format_table(table.table),
+        ', '.join(preparer.quote(key) for key in keys),
+        options,
+    )
+
+
+def csv_value(value, sql_type):
+    if value is None:
+        return None
+    if is_json_type(sql_type):
+        return json.dumps(value)
+    return value
+
+
+def copy_csv(table, conn, keys, data_iter):
+    # NULLs are written as \N so empty strings stay empty strings
+    sql_types = [table.table.c[key].type for key in keys]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    n_rows = 0
+    for row in data_iter:
+        writer.writerow(
+            [
+                CSV_NULL if value is None else csv_value(value, sql_type)
+                for value, sql_type in zip(row, sql_types)
+            ]
+        )
+        n_rows += 1
+    buf.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            copy_statement(table, conn, keys, "FORMAT csv, NULL '{}'".format(CSV_NULL)),
+            buf,
+        )
+    finally:
+        cursor.close()
+    return n_rows
+
+
+def encode_bool(value):
+    return struct.pack('!i?', 1, bool(value))
+
+
+def integral(value):
+    # Postgres rejects a fractional value for an integer column, so don't let
+    # int() truncate one
+    as_int = int(value)
+    if as_int != value:
+        raise ValueError(
+            'Cannot write non-integral {!r} to an integer column'.format(value)
+        )
+    return as_int
+
+
+def encode_int2(value):
+    return struct.pack('!ih', 2, integral(value))
+
+
+def encode_int4(value):
+    return struct.pack('!ii', 4, integral(value))
+
+
+def encode_int8(value):
+    return struct.pack('!iq', 8, integral(value))
+
+
+def encode_float4(value):
+    return struct.pack('!if', 4, float(value))
+
+
+def encode_float8(value):
+    return struct.pack('!id', 8, float(value))
+
+
+def encode_text(value):
+    data = str(value).encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+def encode_timestamp(value):
+    micros = (value.replace(tzinfo=None) - PG_EPOCH) // timedelta(microseconds=1)
+    return struct.pack('!iq', 8, micros)
+
+
+def encode_timestamptz(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    micros = (value - PG_EPOCH_TZ) // timedelta(microseconds=1)
+    return struct.pack('!iq', 8, micros)
+
+
+def encode_date(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return struct.pack('!ii', 4, (value - PG_EPOCH_DATE).days)
+
+
+def encode_json(value):
+    data = json.dumps(value).encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+def encode_jsonb(value):
+    # jsonb binary format is a version byte followed by the json text
+    data = b'\x01' + json.dumps(value).encode('utf-8')
+    return struct.pack('!i', len(data)) + data
+
+
+def is_text_only_type(sql_type):
+    # numeric has no binary encoder here, it's sent as text instead
+    return isinstance(sql_type, types.Numeric) and not isinstance(
+        sql_type, types.Float
+    )
+
+
+def binary_encoder(sql_type):
+    if isinstance(sql_type, postgresql.JSONB):
+        return encode_jsonb
+    if is_json_type(sql_type):
+        return encode_json
+    if isinstance(sql_type, types.Boolean):
+        return encode_bool
+    if isinstance(sql_type, types.SmallInteger):
+        return encode_int2
+    if isinstance(sql_type, types.BigInteger):
+        return encode_int8
+    if isinstance(sql_type, types.Integer):
+        return encode_int4
+    if isinstance(sql_type, types.REAL):
+        return encode_float4
+    if isinstance(sql_type, types.Float):
+        if sql_type.precision is not None and sql_type.precision <= 24:
+            return encode_float4
+        return encode_float8
+    if isinstance(sql_type, types.DateTime):
+        return encode_timestamptz if sql_type.timezone else encode_timestamp
+    if isinstance(sql_type, types.Date):
+        return encode_date
+    if isinstance(sql_type, types.String):
+        return encode_text
+    raise ValueError(
+        "No binary COPY encoder for {!r}, use format='csv'".format(sql_type)
+    )
+
+
+def copy_binary(table, conn, keys, data_iter):
+    # a binary COPY can't mix in text fields, so rows with a numeric column
+    # are copied as csv
+    if any(is_text_only_type(table.table.c[key].type) for key in keys):
+        return copy_csv(table, conn, keys, data_iter)
+    encoders = [binary_encoder(table.table.c[key].type) for key in keys]
+    field_count = struct.pack('!h', len(keys))
+    buf = io.BytesIO()
+    buf.write(PGCOPY_HEADER)
+    n_rows = 0
+    for row in data_iter:
+        buf.write(
+            field_count
+            + b''.join(
+                NULL_FIELD if value is None else encode(value)
+                for value, encode in zip(row, encoders)
+            )
+        )
+        n_rows += 1
+    buf.write(PGCOPY_TRAILER)
+    buf.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(copy_statement(table, conn, keys, 'FORMAT binary'), buf)
+    finally:
+        cursor.close()
+    return n_rows
+
+
+copy_methods = {'csv': copy_csv, 'binary': copy_binary}
+
+
+def table_types(conn, name, schema=None):
+    inspector = inspect(conn)
+    if not inspector.has_table(name, schema=schema):
+        return None
+    return {
+        column['name']: column['type']
+        for column in inspector.get_columns(name, schema=schema)
+    }
+
+
+def copy_to_sql(
+    df,
+    name,
+    conn,
+    schema=None,
+    if_exists='fail',
+    dtype=None,
+    format='binary',
+    chunksize=COPY_CHUNKSIZE,
+):
+    '''
+    Drop-in for df.to_sql(name, conn, schema, if_exists, index=False, dtype)
+    that writes the rows with COPY. Returns the number of rows written.
+    '''
+    if format not in copy_methods:
+        raise ValueError(
+            'format must be one of {}, got {!r}'.format(list(copy_methods), format)
+        )
+    if if_exists == 'append':
+        # encode for the existing columns, not for what this frame's values infer
+        existing_types = table_types(conn, name, schema=schema)
+        if existing_types is not None:
+            dtype = {
+                **(dtype or {}),
+                **{
+                    column: existing_types[column]
+                    for column in df.columns
+                    if column in existing_types
+                },
+            }
+    df.to_sql(
+        name,
+        conn,
+        schema=schema,
+        if_exists=if_exists,
+        index=False,
+        dtype=dtype,
+        chunksize=chunksize,
+        method=copy_methods[format],
+    )
+    return len(df)
+
+
+# Replacing a table in place (if_exists='replace') drops the live table and
+# leaves it missing or locked for the whole write. swap_to_sql loads and
+# indexes a staging table instead, then renames it into place in one short
+# transaction.
+
+STAGING_SUFFIX = '__staging'
+OLD_SUFFIX = '__old'
+SWAP_LOCK_TIMEOUT = '2s'
+SWAP_RETRIES = 5
+
+
+def qualified_name(conn, name, schema=None):
+    preparer = conn.dialect.identifier_preparer
+    if schema is None:
+        return preparer.quote(name)
+    return '{}.{}'.format(preparer.quote_schema(schema), preparer.quote(name))
+
+
+def index_name(name, columns):
+    return '{}_{}_idx'.format(name, '_'.join(columns))
+
+
+def add_index(conn, name, columns, schema=None):
+    # index an existing table on columns, unless it already is
+    preparer = conn.dialect.identifier_preparer
+    with conn.begin() as connection:
+        connection.execute(
+            text(
+                'CREATE INDEX IF NOT EXISTS {} ON {} ({})'.format(
+                    preparer.quote(index_name(name, columns)),
+                    qualified_name(conn, name, schema),
+                    ', '.join(preparer.quote(column) for column in columns),
+                )
+            )
+        )
+
+
+def swap_in(conn, name, schema=None, indexes=()):
+    '''
+    Index and analyze the loaded `schema.name__staging`, then swap it in for
+    `schema.name`.
+    '''
+    staging_name = name + STAGING_SUFFIX
+    old_name = name + OLD_SUFFIX
+    preparer = conn.dialect.identifier_preparer
+
+    def qualified(table_name):
+        return qualified_name(conn, table_name, schema)
+
+    with conn.begin() as connection:
+        for columns in indexes:
+            connection.execute(
+                text(
+                    'CREATE INDEX {} ON {} ({})'.format(
+                        preparer.quote(index_name(staging_name, columns)),
+                        qualified(staging_name),
+                        ', '.join(preparer.quote(column) for column in columns),
+                    )
+                )
+            )
+        connection.execute(text('ANALYZE {}'.format(qualified(staging_name))))
+
+    # readers of the live table hold the lock the rename needs, so give up
+    # after a short wait rather than queueing new readers behind us, and retry
+    for attempt in range(1, SWAP_RETRIES + 1):
+        try:
+            with conn.begin() as connection:
+                connection.execute(
+                    text("SET LOCAL lock_timeout = '{}'".format(SWAP_LOCK_TIMEOUT))
+                )
+                connection.execute(
+                    text(
+                        'ALTER TABLE IF EXISTS {} RENAME TO {}'.format(
+                            qualified(name), preparer.quote(old_name)
+                        )
+                    )
+                )
+                connection.execute(
+                    text(
+                        'ALTER TABLE {} RENAME TO {}'.format(
+                            qualified(staging_name), preparer.quote(name)
+                        )
+                    )
+                )
+                connection.execute(
+                    text('DROP TABLE IF EXISTS {}'.format(qualified(old_name)))
+                )
+                for columns in indexes:
+                    connection.execute(
+                        text(
+                            'ALTER INDEX {} RENAME TO {}'.format(
+                                qualified(index_name(staging_name, columns)),
+                                preparer.quote(index_name(name, columns)),
+                            )
+                        )
+                    )
+            break
+        except OperationalError as e:
+            if 'lock timeout' not in str(e) or attempt == SWAP_RETRIES:
+                raise
+            print(
+                '[{}] Lock timeout swapping in {}, retrying ({}/{})'.format(
+                    datetime.now(), name, attempt, SWAP_RETRIES
+                )
+            )
+            time.sleep(attempt)
+
+
+def drop_leftovers(conn, name, schema=None):
+    # leftovers from a failed run are safe to drop, nothing reads them
+    with conn.begin() as connection:
+        for table_name in [name + STAGING_SUFFIX, name + OLD_SUFFIX]:
+            connection.execute(
+                text(
+                    'DROP TABLE IF EXISTS {}'.format(
+                        qualified_name(conn, table_name, schema)
+                    )
+                )
+            )
+
+
+def frames_of(df, name):
+    # df as an iterable of DataFrames, checked before anything is written
+    if isinstance(df, pd.DataFrame):
+        return [df]
+    if df is None or isinstance(df, (str, bytes)) or not hasattr(df, '__iter__'):
+        raise TypeError(
+            'Rows for {} must be a DataFrame or an iterable of them, not {}'.format(
+                name, type(df).__name__
+            )
+        )
+    return df
+
+
+def swap_to_sql(
+    df,
+    name,
+    conn,
+    schema=None,
+    dtype=None,
+    indexes=(),
+    format='binary',
+    chunksize=COPY_CHUNKSIZE,
+):
+    '''
+    Replace `schema.name` with the rows of df via a staging table. df can
+    also be an iterable of DataFrames (e.g. from stream.read_sql_chunks), which
+    are written one at a time. `indexes` is a list of column lists to index,
+    built before the swap. Returns the number of rows written.
+    '''
+    frames = frames_of(df, name)
+    staging_name = name + STAGING_SUFFIX
+    drop_leftovers(conn, name, schema=schema)
+
+    n_rows, n_frames = 0, 0
+    for frame in frames:
+        n_rows += copy_to_sql(
+            frame,
+            staging_name,
+            conn,
+            schema=schema,
+            if_exists='fail' if n_frames == 0 else 'append',
+            dtype=dtype,
+            format=format,
+            chunksize=chunksize,
+        )
+        n_frames += 1
+    if n_frames == 0:
+        raise ValueError('No frames to write to {}'.format(name))
+    swap_in(conn, name, schema=schema, indexes=indexes)
+    return n_rows
+
+
+def swap_query(query, name, conn, schema=None, params=None, indexes=()):
+    '''
+    Replace `schema.name` with the rows of a query run server-side, via the
+    same staging table as swap_to_sql. The query uses pyformat params, e.g.
+    %(name)s. Returns the number of rows written.
+    '''
+    drop_leftovers(conn, name, schema=schema)
+    with conn.begin() as connection:
+        result = connection.exec_driver_sql(
+            'CREATE TABLE {} AS {}'.format(
+                qualified_name(conn, name + STAGING_SUFFIX, schema), query
+            ),
+            params or {},
+        )
+        n_rows = result.rowcount
+    swap_in(conn, name, schema=schema, indexes=indexes)
+    return n_rows
+
+
+# Incremental stages rewrite only the rows that changed. upsert_to_sql loads
+# them into a copy of the live table, then deletes the live rows with those
+# keys and inserts the new ones in one transaction.
+
+UPSERT_SUFFIX = '__upsert'
+
+
+def upsert_to_sql(
+    df,
+    name,
+    conn,
+    key,
+    schema=None,
+    delete_keys=None,
+    format='binary',
+    chunksize=COPY_CHUNKSIZE,
+):
+    '''
+    Upsert the rows of df (or an iterable of DataFrames) into the existing
+    `schema.name`, keyed by the `key` column. Rows with a key in `delete_keys`
+    are deleted in the same transaction. Returns the number of rows written.
+    '''
+    frames = frames_of(df, name)
+    upsert_name = name + UPSERT_SUFFIX
+    preparer = conn.dialect.identifier_preparer
+    target = qualified_name(conn, name, schema)
+    upsert = qualified_name(conn, upsert_name, schema)
+
+    with conn.begin() as connection:
+        connection.execute(text('DROP TABLE IF EXISTS {}'.format(upsert)))
+        connection.execute(text('CREATE TABLE {} (LIKE {})'.format(upsert, target)))
+
+    n_rows = 0
+    try:
+        for frame in frames:
+            n_rows += copy_to_sql(
+                frame,
+                upsert_name,
+                conn,
+                schema=schema,
+                if_exists='append',
+                format=format,
+                chunksize=chunksize,
+            )
+    except Exception:
+        # the live table hasn't been touched, only the copy needs cleaning up
+        with conn.begin() as connection:
+            connection.execute(text('DROP TABLE IF EXISTS {}'.format(upsert)))
+        raise
+
+    with conn.begin() as connection:
+        connection.execute(text('ANALYZE {}'.format(upsert)))
+        connection.execute(
+            text(
+                'DELETE FROM {target} USING {upsert} '
+                'WHERE {target}.{key} = {upsert}.{key}'.format(
+                    target=target, upsert=upsert, key=preparer.quote(key)
+                )
+            )
+        )
+        if delete_keys is not None and len(delete_keys):
+            connection.execute(
+                text(
+                    'DELETE FROM {} WHERE {} = ANY(:delete_keys)'.format(
+                        target, preparer.quote(key)
+                    )
+                ),
+                {'delete_keys': pd.Series(delete_keys).tolist()},
+            )
+        connection.execute(
+            text('INSERT INTO {} SELECT * FROM {}'.format(target, upsert))
+        )
+        connection.execute(text('DROP TABLE {}'.format(upsert)))
+    return n_rows
@@ -0,0 +1,375 @@
+import os
+import re
+from datetime import datetime
+
+import pandas as pd
+
+import db.stream as stream
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.fs as fs
+    import pyarrow.parquet as pq
+except ImportError:
+    # only the stages reading through snapshots need pyarrow
+    pa = None
+
+# Local Parquet copies of the large source tables. Each table is a directory of
+# part files. A full refresh writes the whole table, sorted by its key, as one
+# part. Later refreshes only pull the rows that changed since, and write them as
+# a new part, so a refresh costs what it pulls rather than a rewrite of the
+# table. Readers take each row from the newest part that has its key. Once there
+# are more than MAX_PARTS parts they are compacted back into one, which does
+# rewrite the table.
+#
+# Tables with last_scraped_at are refreshed by it. Tables without it keep a hash
+# of each row as Postgres prints it. A refresh compares those with the hashes of
+# the live rows, which is a scan of the table in Postgres but only pulls a key
+# and a hash per row. It then pulls the rows that are new or changed, and writes
+# a tombstone, a row with only its key, for each row that was deleted.
+#
+# Stages read the parts memory-mapped, with only the columns and rows they ask
+# for. pyarrow skips the row groups a filter rules out from the parts' column
+# statistics.
+#
+# Tables refreshed by last_scraped_at don't see deleted rows until a full
+# refresh.
+
+# table -> (key, the column rows are refreshed by, or None to compare row hashes)
+TABLES = {
+    'roles': ('role_id', 'last_scraped_at'),
+    'persons': ('person_id', 'last_scraped_at'),
+    'educations': ('education_id', None),
+    'companies': ('company_id', None),
+    'schools': ('school_id', None),
+}
+
+# the row hash column of tables without a refresh column. Tombstones have none.
+ROW_HASH = '_row_hash'
+
+# parts a table can have before they're compacted into one
+MAX_PARTS = 8
+
+SNAPSHOT_DIR = os.getenv(
+    'HS_SNAPSHOT_DIR',
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '_snapshots')),
+)
+
+PART = re.compile(r'^part-(\d+)\.parquet$')
+
+columns_query = '''
+    select attname as column_name, format_type(atttypid, atttypmod) as data_type
+    from pg_attribute
+    where attrelid = to_regclass(%(table)s)
+    and attnum > 0
+    and not attisdropped
+    order by attnum
+'''
+
+# the first 64 bits of the md5 of the row as text
+row_hash_column = "('x' || left(md5(t::text), 16))::bit(64)::bigint as {}".format(
+    ROW_HASH
+)
+
+full_query = '''
+    select {columns} from {table} t order by {key}
+'''
+
+# by last_scraped_at with >= so that rows scraped in the same batch as the
+# latest one in the snapshot, but committed after it was read, aren't missed.
+# The ones the snapshot already has are dropped before they're written.
+changed_query = '''
+    select {columns} from {table} t where {mark} >= %(mark)s order by {key}
+'''
+
+row_hashes_query = '''
+    select {key}, {row_hash} from {table} t
+'''
+
+rows_by_key_query = '''
+    select {columns} from {table} t where {key} = any(%(keys)s) order by {key}
+'''
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError('Snapshots need pyarrow')
+
+
+def table_dir(table):
+    return os.path.join(SNAPSHOT_DIR, table)
+
+
+def parts(table):
+    # the paths of the table's parts, oldest first
+    if not os.path.isdir(table_dir(table)):
+        return []
+    names = sorted(name for name in os.listdir(table_dir(table)) if PART.match(name))
+    return [os.path.join(table_dir(table), name) for name in names]
+
+
+def exists(table):
+    return len(parts(table)) > 0
+
+
+def part_dataset(paths):
+    # the parts are memory-mapped rather than read into buffers
+    return ds.dataset(
+        paths, format='parquet', filesystem=fs.LocalFileSystem(use_mmap=True)
+    )
+
+
+def data_columns(table):
+    # the table's columns, without the row hash
+    paths = parts(table)
+    if not paths:
+        raise FileNotFoundError('No {} snapshot in {}'.format(table, SNAPSHOT_DIR))
+    names = pq.read_schema(paths[-1]).names
+    return [name for name in names if name != ROW_HASH]
+
+
+def arrow_type(data_type):
+    # the Arrow type a Postgres column is kept as, anything else is kept as text
+    if data_type in ('bigint', 'integer', 'smallint'):
+        return pa.int64()
+    if data_type in ('double precision', 'real') or data_type.startswith('numeric'):
+        return pa.float64()
+    if data_type == 'boolean':
+        return pa.bool_()
+    if data_type == 'timestamp without time zone':
+        return pa.timestamp('us')
+    if data_type == 'timestamp with time zone':
+        return pa.timestamp('us', tz='UTC')
+    if data_type == 'date':
+        return pa.date32()
+    return pa.string()
+
+
+def table_schema(conn, table):
+    # the select list and Arrow schema of the table as it is in Postgres, so
+    # every chunk is stored with the same types
+    columns = pd.read_sql_query(columns_query, conn, params={'table': table})
+    if columns.empty:
+        raise ValueError('No table {} to snapshot'.format(table))
+    select, fields = [], []
+    for name, data_type in zip(columns['column_name'], columns['data_type']):
+        field = pa.field(name, arrow_type(data_type))
+        if field.type == pa.string():
+            select.append('{0}::text as {0}'.format(name))
+        else:
+            select.append(name)
+        fields.append(field)
+    if TABLES[table][1] is None:
+        select.append(row_hash_column)
+        fields.append(pa.field(ROW_HASH, pa.int64()))
+    return ', '.join(select), pa.schema(fields)
+
+
+def arrow_chunks(query, conn, schema, params=None):
+    for chunk in stream.read_sql_chunks(query, conn, params=params):
+        yield pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+
+
+def write_part(table, chunks, schema):
+    # writes the chunks as the table's newest part, returning its path and how
+    # many rows it has. The part is written under a staging name that readers
+    # don't list, and renamed once it is complete.
+    os.makedirs(table_dir(table), exist_ok=True)
+    existing = parts(table)
+    version = (
+        int(PART.match(os.path.basename(existing[-1])).group(1)) + 1 if existing else 0
+    )
+    path = os.path.join(table_dir(table), 'part-{:06d}.parquet'.format(version))
+    staging = path + '.staging'
+    n_rows = 0
+    with pq.ParquetWriter(staging, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(chunk)
+            n_rows += chunk.num_rows
+    os.replace(staging, path)
+    return path, n_rows
+
+
+def drop_parts_before(table, path):
+    # once path holds every row, the older parts are only duplicates
+    for old in parts(table):
+        if old < path:
+            os.remove(old)
+
+
+def live_scans(table, filters=None):
+    # a (dataset, filter) pair per part, oldest first, that reads the part's rows
+    # no newer part has a version of, matching filters. The key is read for
+    # every part but the oldest, to leave its rows out of the older parts.
+    # Tombstones only hide the older rows with their key.
+    key, mark = TABLES[table]
+    expression = None if filters is None else pq.filters_to_expression(filters)
+    if mark is None:
+        not_deleted = ds.field(ROW_HASH).is_valid()
+        expression = (
+            not_deleted if expression is None else expression & not_deleted
+        )
+    scans = []
+    newer_keys = None
+    paths = parts(table)
+    if not paths:
+        raise FileNotFoundError('No {} snapshot in {}'.format(table, SNAPSHOT_DIR))
+    for i, path in enumerate(reversed(paths)):
+        dataset = part_dataset(path)
+        live = expression
+        if newer_keys is not None:
+            not_replaced = ~ds.field(key).isin(newer_keys)
+            live = not_replaced if live is None else live & not_replaced
+        scans.append((dataset, live))
+        if i < len(paths) - 1:
+            part_keys = dataset.to_table(columns=[key])[key].combine_chunks()
+            newer_keys = (
+                part_keys
+                if newer_keys is None
+                else pa.concat_arrays([newer_keys, part_keys])
+            )
+    return scans[::-1]
+
+
+def read_table(table, columns=None, filters=None):
+    # the live rows as one Arrow table, sorted by key
+    key = TABLES[table][0]
+    scan_columns = None if columns is None else list(dict.fromkeys(columns + [key]))
+    rows = pa.concat_tables(
+        [
+            dataset.to_table(columns=scan_columns, filter=live)
+            for dataset, live in live_scans(table, filters=filters)
+        ]
+    ).sort_by(key)
+    return rows if columns is None else rows.select(columns)
+
+
+def compact(table):
+    # rewrites the live rows of every part as one part
+    require_pyarrow()
+    rows = read_table(table)
+    path, n_rows = write_part(table, [rows], rows.schema)
+    drop_parts_before(table, path)
+    return n_rows
+
+
+def tombstones(keys, schema, key):
+    # a row with only its key for each deleted row
+    return pa.table(
+        [
+            keys if field.name == key else pa.nulls(len(keys), field.type)
+            for field in schema
+        ],
+        schema=schema,
+    )
+
+
+def refresh_by_hash(conn, table, select, schema):
+    # pulls the rows whose hash differs from the snapshot's, and tombstones the
+    # ones that are gone
+    key = TABLES[table][0]
+    query = row_hashes_query.format(key=key, row_hash=row_hash_column, table=table)
+    live_hashes = pd.concat(
+        stream.read_sql_chunks(query, conn), ignore_index=True
+    ).astype({key: 'int64', ROW_HASH: 'int64'})
+    kept = read_table(table, columns=[key, ROW_HASH]).to_pandas()
+    compared = live_hashes.merge(
+        kept, on=key, how='outer', suffixes=('', '_kept'), indicator=True
+    )
+    is_changed = (compared['_merge'] == 'left_only') | (
+        (compared['_merge'] == 'both')
+        & (compared[ROW_HASH] != compared[ROW_HASH + '_kept'])
+    )
+    changed_keys = compared.loc[is_changed, key].astype('int64').to_numpy()
+    deleted_keys = compared.loc[compared['_merge'] == 'right_only', key]
+    if not len(changed_keys) and deleted_keys.empty:
+        return 0
+
+    query = rows_by_key_query.format(columns=select, table=table, key=key)
+    chunks = []
+    for start in range(0, len(changed_keys), stream.READ_CHUNKSIZE):
+        keys = changed_keys[start : start + stream.READ_CHUNKSIZE].tolist()
+        chunks.extend(arrow_chunks(query, conn, schema, params={'keys': keys}))
+    if not deleted_keys.empty:
+        chunks.append(
+            tombstones(pa.array(deleted_keys.astype('int64')), schema, key)
+        )
+    write_part(table, chunks, schema)
+    return len(changed_keys) + len(deleted_keys)
+
+
+def refresh_by_mark(conn, table, select, schema, latest):
+    # pulls the rows scraped since the latest in the snapshot, less the ones it
+    # already has
+    key, mark = TABLES[table]
+    query = changed_query.format(columns=select, table=table, mark=mark, key=key)
+    kept = read_table(table, columns=[key, mark], filters=[(mark, '>=', latest)])
+    changed = []
+    for chunk in arrow_chunks(query, conn, schema, params={'mark': latest}):
+        chunk = chunk.join(kept, keys=[key, mark], join_type='left anti')
+        if chunk.num_rows:
+            changed.append(chunk.sort_by(key).select(schema.names))
+    if not changed:
+        return 0
+    _, n_rows = write_part(table, changed, schema)
+    return n_rows
+
+
+def refresh(conn, table, full=False):
+    # brings the table's snapshot up to date, and returns how many of its rows
+    # changed. A snapshot is rebuilt if the table's columns have changed.
+    require_pyarrow()
+    key, mark = TABLES[table]
+    select, schema = table_schema(conn, table)
+    paths = parts(table)
+    is_current = not full and paths and pq.read_schema(paths[-1]) == schema
+    latest = None
+    if is_current and mark is not None:
+        latest = pc.max(part_dataset(paths).to_table(columns=[mark])[mark]).as_py()
+    if not is_current or (mark is not None and latest is None):
+        query = full_query.format(columns=select, table=table, key=key)
+        path, n_rows = write_part(table, arrow_chunks(query, conn, schema), schema)
+        drop_parts_before(table, path)
+        return n_rows
+
+    # the changed rows are kept as a new part, which replaces their old versions
+    if mark is None:
+        n_rows = refresh_by_hash(conn, table, select, schema)
+    else:
+        n_rows = refresh_by_mark(conn, table, select, schema, latest)
+    if len(parts(table)) > MAX_PARTS:
+        compact(table)
+    return n_rows
+
+
+def refresh_all(conn, tables=None, full=False):
+    for table in tables or TABLES:
+        print('[{}] Refreshing the {} snapshot'.format(datetime.now(), table))
+        n_rows = refresh(conn, table, full=full)
+        print('[{}] Changed {} rows: {}'.format(datetime.now(), table, n_rows))
+
+
+def read(table, columns=None, filters=None):
+    # the snapshot as a DataFrame sorted by key, with only the columns and the
+    # rows matching filters, in pyarrow's [(column, op, value), ...] form.
+    # Timestamps come back in nanoseconds, as they would from read_sql.
+    require_pyarrow()
+    columns = columns or data_columns(table)
+    return read_table(table, columns=columns, filters=filters).to_pandas(
+        coerce_temporal_nanoseconds=True
+    )
+
+
+def read_chunks(table, columns=None, filters=None, chunksize=stream.READ_CHUNKSIZE):
+    # read in DataFrame chunks of at most chunksize rows, as
+    # stream.read_sql_chunks would. The chunks come part by part, so they are
+    # only in key order within each part.
+    require_pyarrow()
+    columns = columns or data_columns(table)
+    for dataset, live in live_scans(table, filters=filters):
+        batches = dataset.to_batches(columns=columns, filter=live, batch_size=chunksize)
+        for batch in batches:
+            if batch.num_rows:
+                yield batch.to_pandas(coerce_temporal_nanoseconds=True)
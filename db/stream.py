@@ -0,0 +1,23 @@
+import pandas as pd
+
+# Chunked reads. stream_results makes SQLAlchemy run the query on a named
+# (server-side) psycopg2 cursor, so only `chunksize` rows are held client
+# side at a time instead of the whole result set.
+
+READ_CHUNKSIZE = 100000
+
+
+def read_sql_chunks(query, conn, chunksize=READ_CHUNKSIZE, dtype=None, params=None):
+    '''
+    Like pd.read_sql_query(query, conn, chunksize=chunksize), but on a
+    server-side cursor. `dtype` is applied to every chunk so the column types
+    don't depend on which values happen to land in a chunk.
+    '''
+    with conn.connect() as connection:
+        connection = connection.execution_options(
+            stream_results=True, max_row_buffer=chunksize
+        )
+        for chunk in pd.read_sql_query(
+            query, connection, chunksize=chunksize, dtype=dtype, params=params
+        ):
+            yield chunk
@@ -0,0 +1,49 @@
+from sqlalchemy import text
+
+# High-water marks for the incremental stages, one row per stage.
+
+WATERMARKS_SCHEMA = 'score_v2'
+WATERMARKS_TABLE = 'stage_watermarks'
+
+create_watermarks_query = '''
+    CREATE TABLE IF NOT EXISTS {}.{} (
+        stage text PRIMARY KEY
+        , high_water_mark timestamp
+        , updated_at timestamp
+    )
+'''.format(
+    WATERMARKS_SCHEMA, WATERMARKS_TABLE
+)
+
+get_watermark_query = '''
+    SELECT high_water_mark FROM {}.{} WHERE stage = :stage
+'''.format(
+    WATERMARKS_SCHEMA, WATERMARKS_TABLE
+)
+
+set_watermark_query = '''
+    INSERT INTO {}.{} (stage, high_water_mark, updated_at)
+    VALUES (:stage, :high_water_mark, now())
+    ON CONFLICT (stage) DO UPDATE
+    SET high_water_mark = excluded.high_water_mark
+        , updated_at = excluded.updated_at
+'''.format(
+    WATERMARKS_SCHEMA, WATERMARKS_TABLE
+)
+
+def get_watermark(conn, stage):
+    # None if the stage has never completed a run
+    with conn.begin() as connection:
+        connection.execute(text(create_watermarks_query))
+        return connection.execute(
+            text(get_watermark_query), {'stage': stage}
+        ).scalar()
+
+
+def set_watermark(conn, stage, high_water_mark):
+    with conn.begin() as connection:
+        connection.execute(text(create_watermarks_query))
+        connection.execute(
+            text(set_watermark_query),
+            {'stage': stage, 'high_water_mark': high_water_mark},
+        )
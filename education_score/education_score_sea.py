@@ -1,6 +1,6 @@
 import pandas as pd
 from datetime import datetime
-from context import cnx
+from context import cnx, bulk, scores, tiers
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
@@ -31,6 +31,23 @@ educations_query = """
     SPC_GEO
 )
 
+# same as above, for when the education flags are handed over in memory
+educations_handoff_query = """
+    select
+         e.degree_name
+        , e.education_id
+        , s."name" as school_name
+    from educations e
+    left join schools s on s.school_id = e.school_id
+    where e.person_id in (
+        select distinct person_id
+        from score_v2.person_locations
+        where spc_geo = '{}'
+        )
+""".format(
+    SPC_GEO
+)
+
 delete_education_score_query = """
     DO
     $$
@@ -50,45 +67,35 @@ delete_education_score_query = """
 )
 
 
-def calc_education_score(row):
-    if row["is_irrelevant"]:
-        return 0
-
-    education_score = 0
-    if row["is_tier_school"]:
-        education_score += 1
-
-    if row["is_phd"] or row["is_masters"]:
-        education_score *= 2
-
-    return education_score
-
-
-if __name__ == "__main__":
+def run(conn, education_flags=None, raw_educations=None):
     print("[{}] Starting education_score_{}.py".format(datetime.now(), SPC_GEO))
-    conn = cnx.Cnx
-
-    # pull educations with flags and school names
-    print("[{}] Pulling educations".format(datetime.now()))
-    raw_educations = pd.read_sql_query(educations_query, conn)
-    print(
-        "[{}] Done pulling educations. Pulled: {}".format(
-            datetime.now(), len(raw_educations)
+
+    # pull educations with flags and school names, unless already pulled
+    if raw_educations is None:
+        print("[{}] Pulling educations".format(datetime.now()))
+        if education_flags is None:
+            raw_educations = pd.read_sql_query(educations_query, conn)
+        else:
+            raw_educations = pd.read_sql_query(educations_handoff_query, conn).merge(
+                education_flags, on="education_id", how="left"
+            )
+        print(
+            "[{}] Done pulling educations. Pulled: {}".format(
+                datetime.now(), len(raw_educations)
+            )
         )
-    )
     educations = raw_educations.copy()
 
     print("[{}] Cleaning data".format(datetime.now()))
 
-    # check if school_name is in tier list
-    school_df = pd.read_csv(SCHOOL_LIST_PATH)
-    school_list = school_df["school_name"].str.lower().tolist()
-    educations["is_tier_school"] = (
-        educations["school_name"].str.lower().isin(school_list)
+    # check if school_name is in tier list, allowing for variants of the name
+    school_index = tiers.load_index(SCHOOL_LIST_PATH, "school_name")
+    educations["is_tier_school"] = tiers.is_tier(
+        educations["school_name"], school_index
     )
 
     print("[{}] Calculating education score".format(datetime.now()))
-    educations["education_score"] = educations.apply(calc_education_score, axis=1)
+    educations["education_score"] = scores.calc_education_scores(educations)
 
     # write to db
     print("[{}] Deleting old {} education scores".format(datetime.now(), SPC_GEO))
@@ -106,7 +113,13 @@ if __name__ == "__main__":
     to_write = educations[["education_id", "education_score"]]
     to_write["generated_at"] = datetime.now()
     to_write["spc_geo"] = SPC_GEO
-    write_res = to_write.to_sql(
-        "education_scores", conn, if_exists="append", index=False, schema="score_v2"
+    write_res = bulk.copy_to_sql(
+        to_write, "education_scores", conn, if_exists="append", schema="score_v2"
     )
     print("[{}] Done writing to db".format(datetime.now()))
+
+    return educations[["education_id", "education_score"]]
+
+
+if __name__ == "__main__":
+    run(cnx.Cnx)
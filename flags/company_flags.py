@@ -1,8 +1,10 @@
+import argparse
 import pandas as pd
 from datetime import datetime
 import re
-from context import cnx
+from context import cnx, bulk, stream, matcher
 import warnings
+from sqlalchemy import Boolean
 
 # FLAG PATTERNS
 irrelevant_name_regex = re.compile(
@@ -17,14 +19,16 @@ irrelevant_industry_regex = re.compile(
 
 ## nonprofit podcast
 
+company_name_matcher = matcher.compile_matcher({'irrelevant': irrelevant_name_regex})
+company_domain_matcher = matcher.compile_matcher(
+    {'irrelevant': irrelevant_domain_regex}
+)
+company_industry_matcher = matcher.compile_matcher(
+    {'irrelevant': irrelevant_industry_regex}, cache_name='company_industry'
+)
 
-if __name__ == '__main__':
-    cnx = cnx.Cnx
-    warnings.filterwarnings(action='ignore', category=UserWarning)
 
-    # pull all companies
-    print('[{}] Pulling companies'.format(datetime.now()))
-    raw_companies_query = '''
+raw_companies_query = '''
     with founder_roles as (
         select
             company_id
@@ -42,29 +46,154 @@ if __name__ == '__main__':
         , has_irrelevant_founder
     from companies c
     left join founder_roles fr on fr.company_id = c.company_id;
-        '''
-    raw_companies = pd.read_sql_query(raw_companies_query, cnx)
-    print(
-        '[{}] Done pulling companies. Pulled: {}'.format(
-            datetime.now(), len(raw_companies)
-        )
+    '''
+
+# the same flags as flag_companies, computed in Postgres. The matches are filled
+# in by in_db_query.
+in_db_flags_query = '''
+    with founder_roles as (
+        select
+            company_id
+            , bool_or(is_irrelevant_role) as has_irrelevant_founder
+        from score_v2.role_flags rf
+        left join roles r on r.role_id = rf.role_id
+        where (rf.is_founder = TRUE or rf.is_csuite = TRUE)
+        group by 1
     )
+    select
+        company_id
+        , company_name
+        , company_primary_url
+        , company_industry
+        , has_irrelevant_founder
+        -- as pandas' |, which is false when its left side is null and treats a
+        -- null right side as false
+        , case
+            when name_irrelevant is null then false
+            else name_irrelevant or coalesce(domain_irrelevant, false)
+        end
+            or coalesce(industry_irrelevant, false)
+            or coalesce(has_irrelevant_founder, false) as is_irrelevant
+        , %(generated_at)s as generated_at
+    from (
+        select
+            c.company_id
+            , name as company_name
+            , primary_url as company_primary_url
+            , industry as company_industry
+            , has_irrelevant_founder
+            , {name_matches}
+            , {domain_matches}
+            , {industry_matches}
+        from companies c
+        left join founder_roles fr on fr.company_id = c.company_id
+    ) matches
+    '''
 
-    # create flags
-    print('[{}] Creating flags'.format(datetime.now()))
+
+company_flag_cols = ['company_id', 'is_irrelevant']
+
+
+def flag_companies(raw_companies):
     companies = raw_companies.copy()
+    name_flags = matcher.match_flags(companies['company_name'], company_name_matcher)
+    domain_flags = matcher.match_flags(
+        companies['company_primary_url'], company_domain_matcher
+    )
+    industry_flags = matcher.match_flags(
+        companies['company_industry'], company_industry_matcher
+    )
     companies['is_irrelevant'] = (
-        companies['company_name'].str.contains(irrelevant_name_regex)
-        | companies['company_primary_url'].str.contains(irrelevant_domain_regex)
-        | companies['company_industry'].str.contains(irrelevant_industry_regex)
+        name_flags['irrelevant']
+        | domain_flags['irrelevant']
+        | industry_flags['irrelevant']
         | companies['has_irrelevant_founder']
     )
-    print('[{}] Done creating flags'.format(datetime.now()))
+    return companies
 
-    # write to db
-    print('[{}] Writing to db'.format(datetime.now()))
-    companies['generated_at'] = datetime.now()
-    write_res = companies.to_sql(
-        'company_flags', cnx, if_exists='replace', index=False, schema='score_v2'
+
+def in_db_query(generated_at):
+    name_matches, name_params = matcher.sql_matches(
+        'name', company_name_matcher, 'name'
+    )
+    domain_matches, domain_params = matcher.sql_matches(
+        'primary_url', company_domain_matcher, 'domain'
+    )
+    industry_matches, industry_params = matcher.sql_matches(
+        'industry', company_industry_matcher, 'industry'
+    )
+    query = in_db_flags_query.format(
+        name_matches=name_matches,
+        domain_matches=domain_matches,
+        industry_matches=industry_matches,
+    )
+    params = {**name_params, **domain_params, **industry_params}
+    return query, {**params, 'generated_at': generated_at}
+
+
+def run_in_db(conn):
+    # the text never leaves the db
+    print('[{}] Flagging companies in the db'.format(datetime.now()))
+    query, params = in_db_query(datetime.now())
+    write_res = bulk.swap_query(
+        query,
+        'company_flags',
+        conn,
+        schema='score_v2',
+        params=params,
+        indexes=[['company_id']],
+    )
+    print('[{}] Done writing to db, rows: {}'.format(datetime.now(), write_res))
+    return None
+
+
+def run(conn, in_db=False):
+    warnings.filterwarnings(action='ignore', category=UserWarning)
+    if in_db:
+        return run_in_db(conn)
+
+    # stream companies in chunks, flag each chunk and write it to the staging table
+    generated_at = datetime.now()
+    company_flags = []
+
+    def flagged_chunks():
+        n_pulled = 0
+        for raw_companies in stream.read_sql_chunks(raw_companies_query, conn):
+            # the flags of this chunk's texts cached by earlier runs
+            matcher.load_cache(
+                conn, company_industry_matcher, raw_companies['company_industry']
+            )
+            companies = flag_companies(raw_companies)
+            companies['generated_at'] = generated_at
+            company_flags.append(companies[company_flag_cols])
+            n_pulled += len(raw_companies)
+            print('[{}] Flagged companies: {}'.format(datetime.now(), n_pulled))
+            yield companies
+
+    print('[{}] Pulling, flagging and writing companies'.format(datetime.now()))
+    write_res = bulk.swap_to_sql(
+        flagged_chunks(),
+        'company_flags',
+        conn,
+        schema='score_v2',
+        # a chunk can have no founders at all, don't let it infer text
+        dtype={'has_irrelevant_founder': Boolean},
+        indexes=[['company_id']],
+    )
+    print('[{}] Done writing to db, rows: {}'.format(datetime.now(), write_res))
+    n_cached = matcher.save_cache(conn, company_industry_matcher)
+    print('[{}] Cached new industries: {}'.format(datetime.now(), n_cached))
+
+    return pd.concat(company_flags, ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flag companies.')
+    parser.add_argument(
+        '--in-db',
+        action='store_true',
+        help='flag the companies in Postgres instead of pulling them',
     )
-    print('[{}] Done writing to db'.format(datetime.now()))
+    args = parser.parse_args()
+
+    run(cnx.Cnx, in_db=args.in_db)
@@ -4,3 +4,8 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import db.cnx as cnx
+import db.bulk as bulk
+import db.stream as stream
+import db.watermarks as watermarks
+import flags.matcher as matcher
+import db.snapshot as snapshot
@@ -1,47 +1,158 @@
+import argparse
 import pandas as pd
 from datetime import datetime
 import re
-from context import cnx
+from context import cnx, bulk, stream, matcher, snapshot
 import warnings
+from sqlalchemy import Boolean
 
 # FLAG PATTERNS
 phd_regex = re.compile(r'ph\.?d\.?|doctorate', re.IGNORECASE)
 masters_regex = re.compile(r'\bm\.?s\.?\b|master|\bmba\b', re.IGNORECASE)
 irrelevant_regex = re.compile(r'online|bootcamp|certificat|diploma', re.IGNORECASE)
 
-if __name__ == '__main__':
-    cnx = cnx.Cnx
-    warnings.filterwarnings(action='ignore', category=UserWarning)
+degree_name_matcher = matcher.compile_matcher(
+    {'phd': phd_regex, 'masters': masters_regex, 'irrelevant': irrelevant_regex},
+    cache_name='degree_name',
+)
+
+education_flag_cols = ['education_id', 'is_phd', 'is_masters', 'is_irrelevant']
+
+raw_education_cols = ['education_id', 'degree_name']
 
-    # pull all educations
-    print('[{}] Pulling educations'.format(datetime.now()))
-    raw_educations_query = '''
-        select 
+raw_educations_query = '''
+    select 
+        education_id
+        , degree_name
+    from educations;
+    '''
+
+# the same flags as flag_educations, computed in Postgres. The matches are
+# filled in by in_db_query.
+in_db_flags_query = '''
+    select
+        education_id
+        , degree_name
+        , degree_phd as is_phd
+        , degree_masters as is_masters
+        , degree_irrelevant as is_irrelevant
+        , %(generated_at)s as generated_at
+    from (
+        select
             education_id
             , degree_name
-        from educations;
-        '''
-    raw_educations = pd.read_sql_query(raw_educations_query, cnx)
-    print(
-        '[{}] Done pulling educations. Pulled: {}'.format(
-            datetime.now(), len(raw_educations)
-        )
-    )
+            , {degree_matches}
+        from educations
+    ) matches
+    '''
 
-    # create flags
-    print('[{}] Creating flags'.format(datetime.now()))
+
+def flag_educations(raw_educations):
     educations = raw_educations.copy()
-    educations['is_phd'] = educations['degree_name'].str.contains(phd_regex)
-    educations['is_masters'] = educations['degree_name'].str.contains(masters_regex)
-    educations['is_irrelevant'] = educations['degree_name'].str.contains(
-        irrelevant_regex
+    degree_flags = matcher.match_flags(educations['degree_name'], degree_name_matcher)
+    educations['is_phd'] = degree_flags['phd']
+    educations['is_masters'] = degree_flags['masters']
+    educations['is_irrelevant'] = degree_flags['irrelevant']
+    return educations
+
+
+def in_db_query(generated_at):
+    degree_matches, params = matcher.sql_matches(
+        'degree_name', degree_name_matcher, 'degree'
     )
-    print('[{}] Done creating flags'.format(datetime.now()))
+    query = in_db_flags_query.format(degree_matches=degree_matches)
+    return query, {**params, 'generated_at': generated_at}
+
 
-    # write to db
-    print('[{}] Writing to db'.format(datetime.now()))
-    educations['generated_at'] = datetime.now()
-    write_res = educations.to_sql(
-        'education_flags', cnx, if_exists='replace', index=False, schema='score_v2'
+def run_in_db(conn):
+    # the text never leaves the db
+    print('[{}] Flagging educations in the db'.format(datetime.now()))
+    query, params = in_db_query(datetime.now())
+    write_res = bulk.swap_query(
+        query,
+        'education_flags',
+        conn,
+        schema='score_v2',
+        params=params,
+        indexes=[['education_id']],
     )
-    print('[{}] Done writing to db'.format(datetime.now()))
+    print('[{}] Done writing to db, rows: {}'.format(datetime.now(), write_res))
+    # downstream stages read the flags back from score_v2.education_flags
+    return None
+
+
+def run(conn, full=False, in_db=False, use_snapshot=False, refresh_snapshot=True):
+    warnings.filterwarnings(action='ignore', category=UserWarning)
+    if in_db:
+        return run_in_db(conn)
+    if use_snapshot:
+        # educations have no last_scraped_at, so the refresh compares row
+        # hashes to find edited and deleted educations. run_pipeline refreshes
+        # every snapshot before the stages run.
+        if refresh_snapshot:
+            n_pulled = snapshot.refresh(conn, 'educations', full=full)
+            print(
+                '[{}] Educations pulled into the snapshot: {}'.format(
+                    datetime.now(), n_pulled
+                )
+            )
+        raw_educations_chunks = snapshot.read_chunks(
+            'educations', columns=raw_education_cols
+        )
+    else:
+        raw_educations_chunks = stream.read_sql_chunks(raw_educations_query, conn)
+
+    # stream educations in chunks, flag each chunk and write it to the staging table
+    generated_at = datetime.now()
+    education_flags = []
+
+    def flagged_chunks():
+        n_pulled = 0
+        for raw_educations in raw_educations_chunks:
+            # the flags of this chunk's texts cached by earlier runs
+            matcher.load_cache(conn, degree_name_matcher, raw_educations['degree_name'])
+            educations = flag_educations(raw_educations)
+            educations['generated_at'] = generated_at
+            # hand the flags (without the degree text) to downstream stages
+            education_flags.append(educations[education_flag_cols])
+            n_pulled += len(raw_educations)
+            print('[{}] Flagged educations: {}'.format(datetime.now(), n_pulled))
+            yield educations
+
+    print('[{}] Pulling, flagging and writing educations'.format(datetime.now()))
+    write_res = bulk.swap_to_sql(
+        flagged_chunks(),
+        'education_flags',
+        conn,
+        schema='score_v2',
+        # a chunk can have only null degree names, don't let it infer text
+        dtype={'is_phd': Boolean, 'is_masters': Boolean, 'is_irrelevant': Boolean},
+        indexes=[['education_id']],
+    )
+    print('[{}] Done writing to db, rows: {}'.format(datetime.now(), write_res))
+    n_cached = matcher.save_cache(conn, degree_name_matcher)
+    print('[{}] Cached new degree names: {}'.format(datetime.now(), n_cached))
+
+    return pd.concat(education_flags, ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flag educations.')
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='with --snapshot, rebuild the snapshot instead of refreshing it',
+    )
+    parser.add_argument(
+        '--in-db',
+        action='store_true',
+        help='flag the educations in Postgres instead of pulling them',
+    )
+    parser.add_argument(
+        '--snapshot',
+        action='store_true',
+        help='refresh the local educations snapshot and read the educations from it',
+    )
+    args = parser.parse_args()
+
+    run(cnx.Cnx, full=args.full, in_db=args.in_db, use_snapshot=args.snapshot)
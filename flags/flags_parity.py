@@ -0,0 +1,83 @@
+import sys
+import pandas as pd
+from context import cnx, stream
+from datetime import datetime
+import warnings
+
+import company_flags
+import education_flags
+import role_flags
+
+# Checks that the in-db flag mode (Postgres regexes translated from the python
+# ones) gives the same flags as flagging the pulled rows in pandas.
+
+checks = {
+    'role_flags': (
+        role_flags.raw_roles_query,
+        role_flags.flag_roles,
+        role_flags.in_db_query,
+        'role_id',
+        ['is_founder', 'is_csuite', 'is_stealth', 'is_irrelevant_role', 'seniority'],
+    ),
+    'education_flags': (
+        education_flags.raw_educations_query,
+        education_flags.flag_educations,
+        education_flags.in_db_query,
+        'education_id',
+        ['is_phd', 'is_masters', 'is_irrelevant'],
+    ),
+    'company_flags': (
+        company_flags.raw_companies_query,
+        company_flags.flag_companies,
+        company_flags.in_db_query,
+        'company_id',
+        ['is_irrelevant'],
+    ),
+}
+
+
+def mismatches(expected, actual, key, flag_cols):
+    merged = expected.merge(actual, on=key, how='outer', suffixes=('', '_in_db'))
+    differs = pd.Series(False, index=merged.index)
+    for col in flag_cols:
+        a, b = merged[col], merged[col + '_in_db']
+        same = (a.isna() & b.isna()) | (a.notna() & b.notna() & (a == b))
+        differs |= ~same
+    return merged[differs]
+
+
+def run(conn):
+    warnings.filterwarnings(action='ignore', category=UserWarning)
+    n_mismatches = 0
+    for table, (raw_query, flag, in_db_query, key, flag_cols) in checks.items():
+        print('[{}] Checking {}'.format(datetime.now(), table))
+        expected = pd.concat(
+            [
+                flag(raw)[[key] + flag_cols]
+                for raw in stream.read_sql_chunks(raw_query, conn)
+            ],
+            ignore_index=True,
+        )
+        query, params = in_db_query(datetime.now())
+        actual = pd.concat(
+            [
+                chunk[[key] + flag_cols]
+                for chunk in stream.read_sql_chunks(query, conn, params=params)
+            ],
+            ignore_index=True,
+        )
+
+        table_mismatches = mismatches(expected, actual, key, flag_cols)
+        if len(table_mismatches):
+            print(table_mismatches.head(10).to_string())
+        n_mismatches += len(table_mismatches)
+        print(
+            '[{}] Checked: {}, mismatches: {}'.format(
+                datetime.now(), len(expected), len(table_mismatches)
+            )
+        )
+    return n_mismatches
+
+
+if __name__ == '__main__':
+    sys.exit(1 if run(cnx.Cnx) else 0)
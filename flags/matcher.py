@@ -0,0 +1,309 @@
+import hashlib
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+import db.bulk as bulk
+
+# Matches a text column's flag patterns without a regex call per row. The column
+# is joined into one newline-separated text that each pattern scans with its own
+# finditer, so the work is one pass over the text per pattern, and the matches
+# are mapped back to their rows by offset. Case-insensitive patterns scan a
+# lower-cased copy of the text without re.IGNORECASE, which the re engine is
+# several times slower with.
+#
+# A matcher can also cache the flags of every text it has seen, and the cache can
+# be kept in score_v2 between runs. It's keyed by a hash of the patterns, so
+# changing any of them starts a fresh cache. Each chunk only loads the cached
+# flags of its own texts, and a run only appends the texts it scanned.
+
+Matcher = namedtuple(
+    'Matcher', ['patterns', 'scans', 'version', 'cache_name', 'cache', 'unsaved']
+)
+Scan = namedtuple('Scan', ['regex', 'folded', 'joinable'])
+
+SEPARATOR = '\n'
+
+CACHE_SCHEMA = 'score_v2'
+
+load_cache_query = '''
+    select * from {}.{} where version = %(version)s and value = any(%(values)s)
+'''
+
+# every row of a cache is from the same patterns
+cache_version_query = '''
+    select version from {}.{} limit 1
+'''
+
+CACHE_INDEX = ['version', 'value']
+
+# anchors and lookarounds see the separator or the neighbouring rows in the joined
+# text, patterns with them are matched row by row
+ROW_BOUND = re.compile(r'\^|\$|\\[AZ]|\(\?[=!<]')
+# inline flags can turn case sensitivity back on part way through a pattern, and
+# group names are case sensitive
+NOT_FOLDABLE = re.compile(r'\(\?(P|[aiLmsux-]+[:)])')
+# escapes that mean the same whatever the case of the text
+FOLDABLE_ESCAPES = set('bBdDsSwW')
+
+# Python escapes that are spelled differently in a Postgres ARE (\\b is a
+# backspace there), and the ones that are the same
+POSIX_ESCAPES = {'b': r'\y', 'B': r'\Y'}
+POSIX_SAME_ESCAPES = set('dDsSwWAZ')
+# named groups, comments and inline flags have no ARE equivalent
+NOT_POSIX = re.compile(r'\(\?(P|#|[aiLmsux-]+[:)])')
+
+
+def folded_source(source):
+    # the pattern lower-cased for matching lower-cased text, or None if it can't
+    # be done safely
+    if not source.isascii() or NOT_FOLDABLE.search(source):
+        return None
+    folded, i = [], 0
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            escaped = source[i + 1 : i + 2]
+            if escaped.isalnum() and escaped not in FOLDABLE_ESCAPES:
+                return None
+            folded.append(char + escaped)
+            i += 2
+            continue
+        folded.append(char.lower())
+        i += 1
+    return ''.join(folded)
+
+
+def patterns_version(patterns):
+    key = repr([(name, p.pattern, p.flags) for name, p in patterns.items()])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def compile_matcher(patterns, cache_name=None):
+    # patterns is a dict of flag name -> compiled regex. With a cache_name, the
+    # flags of every distinct text are kept for the next call, and the ones not
+    # saved yet can be saved to score_v2.flag_cache_<cache_name>.
+    patterns = {name: re.compile(pattern) for name, pattern in patterns.items()}
+    scans = []
+    for pattern in patterns.values():
+        source = None
+        if pattern.flags & re.IGNORECASE:
+            source = folded_source(pattern.pattern)
+        if source is None:
+            regex = pattern
+        else:
+            regex = re.compile(source, pattern.flags & ~re.IGNORECASE)
+        joinable = not ROW_BOUND.search(pattern.pattern)
+        scans.append(Scan(regex, source is not None, joinable))
+    return Matcher(
+        patterns,
+        scans,
+        patterns_version(patterns),
+        cache_name,
+        None if cache_name is None else {},
+        None if cache_name is None else [],
+    )
+
+
+def fold_text(strings, joined):
+    # the joined text lower-cased, and the rows left as they are. Lower-casing
+    # non-ascii text doesn't always agree with re.IGNORECASE, or keep its length.
+    if joined.isascii():
+        return joined.lower(), []
+    is_ascii = np.array([string.isascii() for string in strings], dtype=bool)
+    lowered = SEPARATOR.join(
+        string.lower() if row_is_ascii else string
+        for string, row_is_ascii in zip(strings, is_ascii)
+    )
+    return lowered, np.flatnonzero(~is_ascii)
+
+
+def scan_flags(strings, matcher):
+    # one row of flags for each of the strings
+    found = np.zeros((len(strings), len(matcher.patterns)), dtype=bool)
+    if not len(strings):
+        return found
+
+    lengths = np.array([len(string) for string in strings], dtype=np.int64)
+    starts = np.zeros(len(strings), dtype=np.int64)
+    starts[1:] = np.cumsum(lengths + len(SEPARATOR))[:-1]
+    ends = starts + lengths
+    joined = SEPARATOR.join(strings)
+    lowered = None
+
+    for col, (pattern, scan) in enumerate(
+        zip(matcher.patterns.values(), matcher.scans)
+    ):
+        if not scan.joinable:
+            found[:, col] = [bool(pattern.search(string)) for string in strings]
+            continue
+
+        text, recheck = joined, set()
+        if scan.folded:
+            if lowered is None:
+                lowered, unfolded = fold_text(strings, joined)
+            text = lowered
+            recheck.update(unfolded)
+
+        spans = np.array(
+            [match.span() for match in scan.regex.finditer(text)], dtype=np.int64
+        ).reshape(-1, 2)
+        rows = np.searchsorted(starts, spans[:, 0], side='right') - 1
+        within_row = spans[:, 1] <= ends[rows]
+        found[rows[within_row], col] = True
+
+        # a match running on past its row's end can hide matches in the rows it
+        # ran into, those are matched on their own
+        last_rows = np.searchsorted(starts, spans[:, 1] - 1, side='right') - 1
+        for first_row, last_row in zip(rows[~within_row], last_rows[~within_row]):
+            recheck.update(range(first_row, max(first_row, last_row) + 1))
+        for row in recheck:
+            found[row, col] = bool(pattern.search(strings[row]))
+    return found
+
+
+def match_flags(texts, matcher):
+    # one column per pattern, as texts.str.contains(pattern) would give: null
+    # texts are None in every column. Each distinct text is only matched once,
+    # and not at all if the matcher has it cached.
+    codes, uniques = pd.factorize(texts.to_numpy(dtype=object))
+    if matcher.cache is None:
+        unique_flags = scan_flags(uniques, matcher)
+    else:
+        unique_flags = np.zeros((len(uniques), len(matcher.patterns)), dtype=bool)
+        cached = [matcher.cache.get(value) for value in uniques]
+        is_cached = np.array([flags is not None for flags in cached], dtype=bool)
+        if is_cached.any():
+            unique_flags[is_cached] = [flags for flags in cached if flags is not None]
+        missing = np.flatnonzero(~is_cached)
+        unique_flags[missing] = scan_flags(uniques[missing], matcher)
+        matcher.cache.update(zip(uniques[missing], unique_flags[missing]))
+        matcher.unsaved.extend(uniques[missing])
+
+    is_null = codes == -1
+    found = np.zeros((len(codes), len(matcher.patterns)), dtype=bool)
+    found[~is_null] = unique_flags[codes[~is_null]]
+    flags = pd.DataFrame(found, index=texts.index, columns=list(matcher.patterns))
+    if is_null.any():
+        flags = flags.astype(object)
+        flags.loc[is_null] = None
+    return flags
+
+
+def posix_pattern(pattern):
+    # the pattern as a Postgres ARE, for ~ (or ~* if it ignores case)
+    source = pattern.pattern
+    if NOT_POSIX.search(source) or pattern.flags & (
+        re.VERBOSE | re.MULTILINE | re.DOTALL
+    ):
+        raise ValueError('No Postgres equivalent for {!r}'.format(source))
+    translated, i, in_class = [], 0, False
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            escaped = source[i + 1 : i + 2]
+            if not in_class and escaped in POSIX_ESCAPES:
+                translated.append(POSIX_ESCAPES[escaped])
+            elif escaped.isalnum() and escaped not in POSIX_SAME_ESCAPES:
+                raise ValueError('No Postgres equivalent for {!r}'.format(source))
+            else:
+                translated.append(char + escaped)
+            i += 2
+            continue
+        if in_class:
+            in_class = char != ']' or source[i - 1] in '[^'
+        elif char == '[':
+            in_class = True
+        translated.append(char)
+        i += 1
+    return ''.join(translated)
+
+
+def sql_matches(column, matcher, prefix):
+    # select-list expressions matching a column against each of the matcher's
+    # patterns in Postgres, named <prefix>_<flag>, and the query params for them
+    expressions, params = [], {}
+    for name, pattern in matcher.patterns.items():
+        param = '{}_{}'.format(prefix, name)
+        operator = '~*' if pattern.flags & re.IGNORECASE else '~'
+        expressions.append('{} {} %({})s as {}'.format(column, operator, param, param))
+        params[param] = posix_pattern(pattern)
+    return '\n        , '.join(expressions), params
+
+
+def cache_table(matcher):
+    return 'flag_cache_{}'.format(matcher.cache_name)
+
+
+def cache_columns(matcher):
+    return ['version', 'value'] + list(matcher.patterns)
+
+
+def cache_version(conn, matcher):
+    # the version of the patterns the saved flags are from, None if there aren't
+    # any, or they're for other flags
+    table = cache_table(matcher)
+    types = bulk.table_types(conn, table, schema=CACHE_SCHEMA)
+    if types is None or list(types) != cache_columns(matcher):
+        return None
+    versions = pd.read_sql_query(cache_version_query.format(CACHE_SCHEMA, table), conn)
+    return versions['version'].iloc[0] if len(versions) else None
+
+
+def load_cache(conn, matcher, texts):
+    # the flags earlier runs with the same patterns cached for any of the texts
+    # the matcher doesn't have yet
+    values = [
+        value
+        for value in pd.unique(texts.dropna().to_numpy(dtype=object))
+        if value not in matcher.cache and '\x00' not in value
+    ]
+    if not values or cache_version(conn, matcher) != matcher.version:
+        return 0
+    # caches saved before they were indexed get the index on their first load
+    bulk.add_index(conn, cache_table(matcher), CACHE_INDEX, schema=CACHE_SCHEMA)
+    cached = pd.read_sql_query(
+        load_cache_query.format(CACHE_SCHEMA, cache_table(matcher)),
+        conn,
+        params={'version': matcher.version, 'values': values},
+    )
+    if cached.empty:
+        return 0
+    matcher.cache.update(
+        zip(cached['value'], cached[list(matcher.patterns)].to_numpy(dtype=bool))
+    )
+    return len(cached)
+
+
+def save_cache(conn, matcher):
+    # appends the flags of the texts scanned since the last save. A cache from
+    # older patterns is replaced.
+    values = [value for value in matcher.unsaved if '\x00' not in value]
+    del matcher.unsaved[:]
+    if not values:
+        return 0
+    cached = pd.DataFrame(
+        np.array([matcher.cache[value] for value in values], dtype=bool).reshape(
+            -1, len(matcher.patterns)
+        ),
+        columns=list(matcher.patterns),
+    )
+    cached.insert(0, 'value', values)
+    cached.insert(0, 'version', matcher.version)
+    if cache_version(conn, matcher) == matcher.version:
+        return bulk.copy_to_sql(
+            cached,
+            cache_table(matcher),
+            conn,
+            schema=CACHE_SCHEMA,
+            if_exists='append',
+        )
+    return bulk.swap_to_sql(
+        cached,
+        cache_table(matcher),
+        conn,
+        schema=CACHE_SCHEMA,
+        indexes=[CACHE_INDEX],
+    )
@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from context import cnx
+from context import cnx, bulk, stream
 
 # pull all people with their educations
 educations_query = '''
@@ -15,15 +15,18 @@ educations_query = '''
     left join score_v2.education_flags ef on ef.education_id = e.education_id
 '''
 
-if __name__ == '__main__':
-    print('[{}] Starting...'.format(datetime.now()))
-    # Create the connection
-    conn = cnx.Cnx
-    # pull all people with their educations
-    raw_educations = pd.read_sql_query(educations_query, conn)
+# same as above, for when the education flags are handed over in memory
+educations_handoff_query = '''
+    select 
+        p.person_id
+        , e.education_id
+        , e.degree_end
+    from persons p
+    left join educations e on e.person_id = p.person_id
+'''
 
-    educations = raw_educations.copy()
 
+def undergrad_flags(educations):
     # 'currently undergrad' is if the degree_end is between 2023 and 2026, and is not a masters or phd
     educations['currently_undergrad'] = np.where(
         (educations['degree_end'] >= datetime(2023, 1, 1))
@@ -34,17 +37,53 @@ if __name__ == '__main__':
         False,
     )
 
-    persons = (
+    return (
         educations.groupby('person_id')
         .agg({'currently_undergrad': 'any'})
         .reset_index()
     )
 
+
+def run(conn, education_flags=None):
+    print('[{}] Starting...'.format(datetime.now()))
+    # stream all people with their educations, aggregating each chunk. A
+    # person's educations can span chunks, so the partial flags are combined
+    # at the end.
+    partial_persons = []
+    if education_flags is None:
+        chunks = stream.read_sql_chunks(educations_query, conn)
+    else:
+        chunks = (
+            chunk.merge(
+                education_flags[['education_id', 'is_masters', 'is_phd']],
+                on='education_id',
+                how='left',
+            )
+            for chunk in stream.read_sql_chunks(
+                educations_handoff_query, conn, dtype={'education_id': 'float64'}
+            )
+        )
+    for raw_educations in chunks:
+        partial_persons.append(undergrad_flags(raw_educations.copy()))
+
+    persons = (
+        pd.concat(partial_persons, ignore_index=True)
+        .groupby('person_id')
+        .agg({'currently_undergrad': 'any'})
+        .reset_index()
+    )
+
     # write to db
     print('[{}] Writing to db...'.format(datetime.now()))
     to_write = persons[['person_id', 'currently_undergrad']]
     to_write['generated_at'] = datetime.now()
-    to_write.to_sql(
-        'person_flags', conn, if_exists='replace', index=False, schema='score_v2'
+    bulk.swap_to_sql(
+        to_write, 'person_flags', conn, schema='score_v2', indexes=[['person_id']]
     )
     print('[{}] Done!'.format(datetime.now()))
+
+    return to_write
+
+
+if __name__ == '__main__':
+    run(cnx.Cnx)
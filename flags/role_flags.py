@@ -1,8 +1,11 @@
+import argparse
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import re
-from context import cnx
+from context import cnx, bulk, stream, watermarks, matcher, snapshot
 import warnings
+from sqlalchemy import Boolean, inspect
 
 # FLAG PATTERNS
 founder_regex = re.compile(r'founder|cofounder|founding', re.IGNORECASE)
@@ -28,67 +31,285 @@ junior_regex = re.compile(r'student|intern|scholar|junior|\bjr\b', re.IGNORECASE
 senior_regex = re.compile(
     r'senior|\bsr\b|\bsnr\b|lead|director|head|president|manager', re.IGNORECASE
 )
+product_regex = re.compile(r'product', re.IGNORECASE)
+
+
+# the patterns matched against each text column
+role_title_matcher = matcher.compile_matcher(
+    {
+        'founder': founder_regex,
+        'csuite': csuite_regex,
+        'stealth': stealth_regex,
+        'irrelevant': irrelevant_role_title_regex,
+        'junior': junior_regex,
+        'senior': senior_regex,
+        'product': product_regex,
+    },
+    cache_name='role_title',
+)
+role_description_matcher = matcher.compile_matcher(
+    {'irrelevant': irrelevant_role_description_regex}
+)
 
 
 # FUNCTIONS
-def get_title_seniority(row):
-    if row['is_founder'] or row['is_csuite']:
-        return 'exec'
+def get_title_seniority(roles, title_flags):
+    # exec takes precedence over junior, junior over senior
+    is_exec = roles['is_founder'] | roles['is_csuite']
+    is_junior = title_flags['junior'].eq(True)
+    is_senior = title_flags['senior'].eq(True) & ~title_flags['product'].eq(True)
+    return np.select(
+        [is_exec, is_junior, is_senior], ['exec', 'junior', 'senior'], default='other'
+    )
 
-    if row['role_title']:
-        if re.search(junior_regex, row['role_title']):
-            return 'junior'
-        elif re.search(senior_regex, row['role_title']) and not re.search(
-            'product', row['role_title'], re.IGNORECASE
-        ):
-            return 'senior'
-    return 'other'
 
+role_flag_cols = [
+    'role_id',
+    'is_founder',
+    'is_csuite',
+    'is_stealth',
+    'is_irrelevant_role',
+    'seniority',
+]
 
-if __name__ == '__main__':
-    print('[{}] Starting role_flags.py'.format(datetime.now()))
+WATERMARK_STAGE = 'role_flags'
 
-    cnx = cnx.Cnx
-    warnings.filterwarnings(action='ignore', category=UserWarning)
+raw_role_cols = [
+    'role_id',
+    'role_title',
+    'linkedin_role_description',
+    'last_scraped_at',
+]
+
+raw_roles_query = '''
+    select 
+        role_id
+        , role_title
+        , linkedin_role_description
+        , last_scraped_at
+    from roles;
+    '''
+
+# roles scraped since the last run. >= so that roles scraped in the same batch
+# as the high-water mark, but committed after the last run read, aren't missed
+changed_roles_query = '''
+    select 
+        role_id
+        , role_title
+        , linkedin_role_description
+        , last_scraped_at
+    from roles
+    where last_scraped_at >= %(high_water_mark)s;
+    '''
 
-    # pull all roles
-    print('[{}] Pulling roles'.format(datetime.now()))
-    raw_roles_query = '''
-        select 
+latest_scrape_query = '''
+    select max(last_scraped_at) as last_scraped_at from roles
+    '''
+
+# the same flags as flag_roles, computed in Postgres. The matches are filled in
+# by in_db_query.
+in_db_flags_query = '''
+    select
+        role_id
+        , role_title
+        , linkedin_role_description
+        , title_founder and not title_irrelevant as is_founder
+        , title_csuite and not title_irrelevant as is_csuite
+        , title_stealth as is_stealth
+        -- as pandas' |, which is false when its left side is null and treats a
+        -- null right side as false
+        , case
+            when title_irrelevant is null then false
+            else title_irrelevant or coalesce(description_irrelevant, false)
+        end as is_irrelevant_role
+        , case
+            when (title_founder or title_csuite) and not title_irrelevant then 'exec'
+            when title_junior then 'junior'
+            when title_senior and not title_product then 'senior'
+            else 'other'
+        end as seniority
+        , %(generated_at)s as generated_at
+    from (
+        select
             role_id
             , role_title
             , linkedin_role_description
-        from roles;
-        '''
-    raw_roles = pd.read_sql_query(raw_roles_query, cnx)
-    print('[{}] Done pulling roles. Pulled: {}'.format(datetime.now(), len(raw_roles)))
+            , {title_matches}
+            , {description_matches}
+        from roles
+    ) matches
+    '''
+
 
-    # create flags
-    print('[{}] Creating flags'.format(datetime.now()))
+def flag_roles(raw_roles):
     roles = raw_roles.copy()
-    roles['is_founder'] = roles['role_title'].str.contains(founder_regex) & ~roles[
-        'role_title'
-    ].str.contains(irrelevant_role_title_regex)
-    roles['is_csuite'] = roles['role_title'].str.contains(csuite_regex) & ~roles[
-        'role_title'
-    ].str.contains(irrelevant_role_title_regex)
-    roles['is_stealth'] = roles['role_title'].str.contains(stealth_regex)
-    roles['is_irrelevant_role'] = roles['role_title'].str.contains(
-        irrelevant_role_title_regex
-    ) | roles['linkedin_role_description'].str.contains(
-        irrelevant_role_description_regex
+    title_flags = matcher.match_flags(roles['role_title'], role_title_matcher)
+    description_flags = matcher.match_flags(
+        roles['linkedin_role_description'], role_description_matcher
+    )
+    roles['is_founder'] = title_flags['founder'] & ~title_flags['irrelevant']
+    roles['is_csuite'] = title_flags['csuite'] & ~title_flags['irrelevant']
+    roles['is_stealth'] = title_flags['stealth']
+    roles['is_irrelevant_role'] = (
+        title_flags['irrelevant'] | description_flags['irrelevant']
     )
-    print('[{}] Done creating flags'.format(datetime.now()))
 
     # infer seniority
-    print('[{}] Inferring seniority'.format(datetime.now()))
-    roles['seniority'] = roles.apply(get_title_seniority, axis=1)
-    print('[{}] Done inferring seniority'.format(datetime.now()))
-
-    # write to db
-    print('[{}] Writing to db'.format(datetime.now()))
-    roles['generated_at'] = datetime.now()
-    write_res = roles.to_sql(
-        'role_flags', cnx, if_exists='replace', index=False, schema='score_v2'
+    roles['seniority'] = get_title_seniority(roles, title_flags)
+    return roles
+
+
+def in_db_query(generated_at):
+    title_matches, title_params = matcher.sql_matches(
+        'role_title', role_title_matcher, 'title'
+    )
+    description_matches, description_params = matcher.sql_matches(
+        'linkedin_role_description', role_description_matcher, 'description'
+    )
+    query = in_db_flags_query.format(
+        title_matches=title_matches, description_matches=description_matches
+    )
+    return query, {**title_params, **description_params, 'generated_at': generated_at}
+
+
+def run_in_db(conn):
+    # rebuilds the whole table, the text never leaves the db
+    print('[{}] Flagging all roles in the db'.format(datetime.now()))
+    new_high_water_mark = pd.read_sql_query(latest_scrape_query, conn).iloc[0, 0]
+    query, params = in_db_query(datetime.now())
+    write_res = bulk.swap_query(
+        query,
+        'role_flags',
+        conn,
+        schema='score_v2',
+        params=params,
+        indexes=[['role_id']],
     )
     print('[{}] Done writing to db, rows: {}'.format(datetime.now(), write_res))
+
+    if pd.notna(new_high_water_mark):
+        watermarks.set_watermark(
+            conn, WATERMARK_STAGE, new_high_water_mark.to_pydatetime()
+        )
+        print('[{}] High-water mark: {}'.format(datetime.now(), new_high_water_mark))
+    # downstream stages read the flags back from score_v2.role_flags
+    return None
+
+
+def run(conn, full=False, in_db=False, use_snapshot=False, refresh_snapshot=True):
+    print('[{}] Starting role_flags.py'.format(datetime.now()))
+    warnings.filterwarnings(action='ignore', category=UserWarning)
+    if in_db:
+        return run_in_db(conn)
+
+    high_water_mark = None
+    if not full and inspect(conn).has_table('role_flags', schema='score_v2'):
+        high_water_mark = watermarks.get_watermark(conn, WATERMARK_STAGE)
+    if high_water_mark is None:
+        print('[{}] Flagging all roles'.format(datetime.now()))
+        if use_snapshot:
+            if refresh_snapshot:
+                n_pulled = snapshot.refresh(conn, 'roles', full=full)
+                print(
+                    '[{}] Roles pulled into the snapshot: {}'.format(
+                        datetime.now(), n_pulled
+                    )
+                )
+            raw_roles_chunks = snapshot.read_chunks('roles', columns=raw_role_cols)
+        else:
+            raw_roles_chunks = stream.read_sql_chunks(raw_roles_query, conn)
+    else:
+        print(
+            '[{}] Flagging roles scraped since {}'.format(
+                datetime.now(), high_water_mark
+            )
+        )
+        # the changed roles are read straight from Postgres even with
+        # use_snapshot. Pulling them into the snapshot first would only read
+        # them twice.
+        raw_roles_chunks = stream.read_sql_chunks(
+            changed_roles_query, conn, params={'high_water_mark': high_water_mark}
+        )
+
+    # stream roles in chunks, flag each chunk and write it to the staging table
+    generated_at = datetime.now()
+    role_flags = []
+    last_scraped_at = []
+
+    def flagged_chunks():
+        n_pulled = 0
+        for raw_roles in raw_roles_chunks:
+            # an incremental run with no newly scraped roles reads one empty
+            # chunk, with nothing to flag or write
+            if raw_roles.empty:
+                continue
+            last_scraped_at.append(raw_roles['last_scraped_at'].max())
+            # the flags of this chunk's texts cached by earlier runs
+            matcher.load_cache(conn, role_title_matcher, raw_roles['role_title'])
+            roles = flag_roles(raw_roles.drop(columns='last_scraped_at'))
+            roles['generated_at'] = generated_at
+            # hand the flags (without the role text) to downstream stages
+            role_flags.append(roles[role_flag_cols])
+            n_pulled += len(raw_roles)
+            print('[{}] Flagged roles: {}'.format(datetime.now(), n_pulled))
+            yield roles
+
+    print('[{}] Pulling, flagging and writing roles'.format(datetime.now()))
+    if high_water_mark is None:
+        write_res = bulk.swap_to_sql(
+            flagged_chunks(),
+            'role_flags',
+            conn,
+            schema='score_v2',
+            # a chunk can have only null role texts, don't let it infer text
+            dtype={
+                'is_founder': Boolean,
+                'is_csuite': Boolean,
+                'is_stealth': Boolean,
+                'is_irrelevant_role': Boolean,
+            },
+            indexes=[['role_id']],
+        )
+    else:
+        write_res = bulk.upsert_to_sql(
+            flagged_chunks(), 'role_flags', conn, key='role_id', schema='score_v2'
+        )
+    print('[{}] Done writing to db, rows: {}'.format(datetime.now(), write_res))
+    n_cached = matcher.save_cache(conn, role_title_matcher)
+    print('[{}] Cached new role titles: {}'.format(datetime.now(), n_cached))
+
+    # only move the high-water mark forward once the flags are written
+    new_high_water_mark = pd.Series(last_scraped_at).max()
+    if pd.notna(new_high_water_mark):
+        watermarks.set_watermark(
+            conn, WATERMARK_STAGE, new_high_water_mark.to_pydatetime()
+        )
+        print('[{}] High-water mark: {}'.format(datetime.now(), new_high_water_mark))
+
+    if high_water_mark is not None:
+        # only the changed roles were flagged, downstream stages read the
+        # full set back from score_v2.role_flags
+        return None
+    return pd.concat(role_flags, ignore_index=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Flag roles.')
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='re-flag every role instead of the roles scraped since the last run',
+    )
+    parser.add_argument(
+        '--in-db',
+        action='store_true',
+        help='flag every role in Postgres instead of pulling them',
+    )
+    parser.add_argument(
+        '--snapshot',
+        action='store_true',
+        help='refresh the roles snapshot and read from it when flagging every role',
+    )
+    args = parser.parse_args()
+
+    run(cnx.Cnx, full=args.full, in_db=args.in_db, use_snapshot=args.snapshot)
@@ -0,0 +1,12 @@
+#!/bin/bash
+if [ $# -eq 0 ]
+  then
+    echo 'No arguments supplied'
+    exit 1
+fi
+echo '[CONSOLE] running with arguments: ' $@
+echo '[CONSOLE] activating sandbox.'
+eval "$(conda shell.bash hook)"
+conda activate spc-sandbox
+echo '[CONSOLE] executing run_pipeline.py'
+python pipeline/run_pipeline.py $@
\ No newline at end of file
@@ -3,7 +3,9 @@ import numpy as np
 import sys
 
 from datetime import datetime
-from context import cnx
+from context import cnx, bulk, notes
+import sqlalchemy
+from sqlalchemy import text
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
@@ -76,6 +78,24 @@ person_score_query = """
     SPC_GEO
 )
 
+# same as above, for when the person scores are handed over in memory without
+# the founder roles
+founder_roles_query = """
+    select
+        r.person_id
+        , r.company_id
+        , p.linkedin_url
+        , p.last_scraped_at
+        , p.full_name
+    from roles r
+    left join persons p on p.person_id = r.person_id
+    left join score_v2.role_flags rf on rf.role_id = r.role_id
+    where r.company_id in (select distinct company_id from score_v2.company_locations where spc_geo = '{}')
+    and rf.is_founder = TRUE
+""".format(
+    SPC_GEO
+)
+
 delete_haystack_score_query_prod = """
     DO
     $$
@@ -112,6 +132,14 @@ delete_haystack_score_query_test = """
     SPC_GEO
 )
 
+# tables written before the founders were kept get the column, so rows can be
+# appended
+add_founders_column_query = """
+    ALTER TABLE IF EXISTS score_v2.{} ADD COLUMN IF NOT EXISTS founders jsonb
+"""
+
+founders_dtype = {"founders": sqlalchemy.dialects.postgresql.JSONB}
+
 company_metadata_query = """
     select
         company_id
@@ -121,70 +149,13 @@ company_metadata_query = """
 """
 
 
-def create_note_string(row):
-    note = """Founder Summaries: {founder_summaries}
-
-Founder LinkedIn URLs: {linkedin_urls}
-
-------
-
-Haystack Score: {hs_score:.2f}
-Haystack Breakdown:
-    Mean Founder Score: {founder_score:.2f}
-    Is Sweetspot Company: {sweetspot_company}
-    Is Traffic Priority: {traffic_priority}
-
-Haystack Company ID: {haystack_id}
-Date Generated: {date_generated}
-"""
-
-    founder_summaries = ""
-    full_name_list = row["full_name"] if row["full_name"] is not np.nan else [None]
-    summary_list = row["description"] if row["description"] is not np.nan else [None]
-    linkedin_url_list = (
-        row["linkedin_url"] if row["linkedin_url"] is not np.nan else [None]
-    )
-    for full_name, summary in zip(full_name_list, summary_list):
-        if full_name:
-            founder_summaries += "\n  {}".format(full_name)
-        if summary:
-            founder_summaries += ": {} ".format(summary)
-    linkedin_urls = ""
-    for li_url in linkedin_url_list:
-        if li_url:
-            linkedin_urls += "\n  {}".format(li_url)
-    traffic_prio_string = (
-        str(row["is_traffic_priority"])
-        if pd.notna(row["is_traffic_priority"])
-        else "No data"
-    )
-
-    note = note.format(
-        founder_summaries=founder_summaries,
-        linkedin_urls=linkedin_urls,
-        hs_score=row["hs_score_v2"],
-        founder_score=row["founder_score_mean"],
-        sweetspot_company=str(row["is_sweetspot_company"]),
-        traffic_priority=traffic_prio_string,
-        haystack_id=str(row["company_id"]),
-        date_generated=CURRENT_DATE_WITH_DASH,
-    )
-
-    return note
-
-
-if __name__ == "__main__":
-    print("[{}] Starting hs_score_{}.py...".format(datetime.now(), SPC_GEO.lower()))
-    conn = cnx.Cnx
-    if len(sys.argv) < 2:
-        print("Provide experiment name.")
-        sys.exit(1)
-
-    experiment_name = sys.argv[1]
+def add_founders_column(conn, table):
+    with conn.begin() as connection:
+        connection.execute(text(add_founders_column_query.format(table)))
 
-    if experiment_name == "prod":
-        print("**NOTICE** Running usual prod script.")
 
+def score_companies(conn, person_scores=None, founder_roles=None):
+    # each company's haystack score, and the deduped founders it was scored from
     # get company list
     print("[{}] Getting company list...".format(datetime.now()))
     raw_hs_company = pd.read_sql_query(hs_company_query, conn)
@@ -199,7 +170,12 @@ if __name__ == "__main__":
     print("[{}] Getting flags and intermediate scores...".format(datetime.now()))
     sweetspot_flags = pd.read_sql_query(sweetspot_query, conn)
     traffic_flags = pd.read_sql_query(traffic_flags_query, conn)
-    person_scores = pd.read_sql_query(person_score_query, conn)
+    if person_scores is None:
+        person_scores = pd.read_sql_query(person_score_query, conn)
+    else:
+        if founder_roles is None:
+            founder_roles = pd.read_sql_query(founder_roles_query, conn)
+        person_scores = person_scores.merge(founder_roles, on="person_id")
     print("[{}] Fetched flags and intermediate scores".format(datetime.now()))
 
     # calculate mean founder scores
@@ -268,35 +244,24 @@ if __name__ == "__main__":
         company_df["hs_score_v2"],
     )
     print("[{}] Calculated Haystack score".format(datetime.now()))
+    return company_df, person_scores_deduped
 
-    # create metadata columns
 
-    print("[{}] Creating notes...".format(datetime.now()))
-    person_scores_deduped["description"] = person_scores_deduped["description"].replace(
-        np.nan, None
-    )
+def run(conn, experiment_name, person_scores=None, founder_roles=None):
+    print("[{}] Starting hs_score_{}.py...".format(datetime.now(), SPC_GEO.lower()))
 
-    all_person_metadata = (
-        person_scores_deduped.groupby(
-            [
-                "company_id",
-            ],
-            dropna=False,
-        )
-        .agg(
-            {
-                "linkedin_url": lambda x: list(x),
-                "description": lambda x: list(x),
-                "full_name": lambda x: list(x),
-            }
-        )
-        .reset_index()
-    )
-    company_with_metadata = company_df.merge(
-        all_person_metadata, how="left", on="company_id"
+    if experiment_name == "prod":
+        print("**NOTICE** Running usual prod script.")
+
+    company_df, person_scores_deduped = score_companies(
+        conn, person_scores, founder_roles
     )
-    company_with_metadata["notes"] = company_with_metadata.apply(
-        create_note_string, axis=1
+
+    # keep each company's founders, for the notes hs_uploads renders
+    print("[{}] Collecting founders...".format(datetime.now()))
+    company_with_metadata = company_df.copy()
+    company_with_metadata["founders"] = company_with_metadata["company_id"].map(
+        notes.founder_records(person_scores_deduped)
     )
 
     company_with_metadata = company_with_metadata.dropna(subset="hs_score_v2")
@@ -333,6 +298,7 @@ if __name__ == "__main__":
         finally:
             session.close()
         print("[{}] Writing to db...".format(datetime.now()))
+        add_founders_column(conn, "haystack_scores")
         to_write = company_with_metadata[
             [
                 "company_id",
@@ -341,13 +307,18 @@ if __name__ == "__main__":
                 "is_traffic_priority",
                 "is_irrelevant_hs",
                 "founder_score_mean",
-                "notes",
+                "founders",
             ]
         ]
         to_write["generated_at"] = datetime.now()
         to_write["spc_geo"] = SPC_GEO
-        to_write.to_sql(
-            "haystack_scores", conn, if_exists="append", index=False, schema="score_v2"
+        bulk.copy_to_sql(
+            to_write,
+            "haystack_scores",
+            conn,
+            if_exists="append",
+            schema="score_v2",
+            dtype=founders_dtype,
         )
         print("[{}] Wrote to db".format(datetime.now()))
 
@@ -368,6 +339,7 @@ if __name__ == "__main__":
         finally:
             session.close()
         print("[{}] Writing to db...".format(datetime.now()))
+        add_founders_column(conn, "haystack_scores_test")
         to_write = company_with_metadata[
             [
                 "company_id",
@@ -376,23 +348,25 @@ if __name__ == "__main__":
                 "is_traffic_priority",
                 "is_irrelevant_hs",
                 "founder_score_mean",
-                "notes",
+                "founders",
             ]
         ]
         to_write["generated_at"] = datetime.now()
         to_write["spc_geo"] = SPC_GEO
-        to_write.to_sql(
+        bulk.copy_to_sql(
+            to_write,
             "haystack_scores_test",
             conn,
             if_exists="append",
-            index=False,
             schema="score_v2",
+            dtype=founders_dtype,
         )
         print("[{}] Wrote to db".format(datetime.now()))
 
     else:
         # write to experiment table
         print("[{}] Writing to db...".format(datetime.now()))
+        add_founders_column(conn, "haystack_scores_experiment")
         to_write = company_with_metadata[
             [
                 "company_id",
@@ -401,17 +375,26 @@ if __name__ == "__main__":
                 "is_traffic_priority",
                 "is_irrelevant_hs",
                 "founder_score_mean",
-                "notes",
+                "founders",
             ]
         ]
         to_write["generated_at"] = datetime.now()
         to_write["spc_geo"] = SPC_GEO
         to_write["experiment_name"] = experiment_name
-        to_write.to_sql(
+        bulk.copy_to_sql(
+            to_write,
             "haystack_scores_experiment",
             conn,
             if_exists="append",
-            index=False,
             schema="score_v2",
+            dtype=founders_dtype,
         )
         print("[{}] Wrote to db".format(datetime.now()))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Provide experiment name.")
+        sys.exit(1)
+
+    run(cnx.Cnx, sys.argv[1])
@@ -1,6 +1,6 @@
 import pandas as pd
 from datetime import datetime, timedelta
-from context import cnx
+from context import cnx, bulk, notes
 import numpy as np
 import sys
 from dotenv import load_dotenv
@@ -46,19 +46,14 @@ past_upload_query = """
     score_v2.company_upload_tracker
 """
 
+
 # SCRIPT
-if __name__ == "__main__":
+def run(conn, experiment_name):
     print("[{}] Running hs_uploads_{}.py...".format(datetime.now(), SPC_GEO.lower()))
 
-    if len(sys.argv) < 2:
-        print("Provide experiment name.")
-        sys.exit(1)
-
-    experiment_name = sys.argv[1]
-
     if experiment_name != "prod":
         print("Not prod run, exiting.")
-        sys.exit(0)
+        return
 
     print("[{}] Current date: {}".format(datetime.now(), CURRENT_DATE_STRING))
     print(
@@ -66,7 +61,6 @@ if __name__ == "__main__":
             datetime.now(), WEEK_START_DATE_WITH_DASH_STRING
         )
     )
-    conn = cnx.Cnx
 
     # pull data
     print("[{}] Getting data...".format(datetime.now()))
@@ -106,7 +100,12 @@ if __name__ == "__main__":
     # if there are no rows, return early
     if len(affinity_upload) == 0:
         print("[{}] No rows to process. Exiting.".format(datetime.now()))
-        exit()
+        return
+
+    # render the notes of only the uploaded companies, from their score breakdown
+    affinity_upload["notes"] = notes.hs_notes(
+        affinity_upload, affinity_upload["generated_at"].dt.strftime("%Y-%m-%d")
+    )
 
     affinity_upload_final = affinity_upload[
         ["company_name", "primary_url", "notes", "company_id"]
@@ -142,14 +141,22 @@ if __name__ == "__main__":
         axis=1,
     )
 
-    upload_tracking = upload_tracking.drop("is_irrelevant_hs", axis=1)
+    upload_tracking = upload_tracking.drop(["is_irrelevant_hs", "founders"], axis=1)
 
-    write_res = upload_tracking.to_sql(
+    write_res = bulk.copy_to_sql(
+        upload_tracking,
         "company_upload_tracker",
         conn,
         if_exists="append",
-        index=False,
         schema="score_v2",
     )
 
     print("[{}] Done!".format(datetime.now()))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Provide experiment name.")
+        sys.exit(1)
+
+    run(cnx.Cnx, sys.argv[1])
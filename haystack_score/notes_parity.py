@@ -0,0 +1,164 @@
+import sys
+import numpy as np
+import pandas as pd
+from context import cnx, notes
+from datetime import datetime
+
+import hs_score_anz
+import hs_score_isr
+import hs_score_sea
+
+# Checks that notes.hs_notes renders the same notes as the per-row
+# create_note_string it replaced. Each geo's companies are scored by the hs_score
+# stage itself. The old renderer gets them with the founder lists the stage used
+# to build, NaNs and all, and notes.hs_notes with the founders the stage keeps.
+
+HS_SCORE_STAGES = [hs_score_anz, hs_score_isr, hs_score_sea]
+
+
+# the renderer as it was in hs_score_*, with the date it wrote passed in
+def create_note_string(row, date_generated):
+    note = """Founder Summaries: {founder_summaries}
+
+Founder LinkedIn URLs: {linkedin_urls}
+
+------
+
+Haystack Score: {hs_score:.2f}
+Haystack Breakdown:
+    Mean Founder Score: {founder_score:.2f}
+    Is Sweetspot Company: {sweetspot_company}
+    Is Traffic Priority: {traffic_priority}
+
+Haystack Company ID: {haystack_id}
+Date Generated: {date_generated}
+"""
+
+    founder_summaries = ""
+    full_name_list = row["full_name"] if row["full_name"] is not np.nan else [None]
+    summary_list = row["description"] if row["description"] is not np.nan else [None]
+    linkedin_url_list = (
+        row["linkedin_url"] if row["linkedin_url"] is not np.nan else [None]
+    )
+    for full_name, summary in zip(full_name_list, summary_list):
+        if full_name:
+            founder_summaries += "\n  {}".format(full_name)
+        if summary:
+            founder_summaries += ": {} ".format(summary)
+    linkedin_urls = ""
+    for li_url in linkedin_url_list:
+        if li_url:
+            linkedin_urls += "\n  {}".format(li_url)
+    traffic_prio_string = (
+        str(row["is_traffic_priority"])
+        if pd.notna(row["is_traffic_priority"])
+        else "No data"
+    )
+
+    note = note.format(
+        founder_summaries=founder_summaries,
+        linkedin_urls=linkedin_urls,
+        hs_score=row["hs_score_v2"],
+        founder_score=row["founder_score_mean"],
+        sweetspot_company=str(row["is_sweetspot_company"]),
+        traffic_priority=traffic_prio_string,
+        haystack_id=str(row["company_id"]),
+        date_generated=date_generated,
+    )
+
+    return note
+
+
+# the founder lists hs_score_* rendered its notes from, before it kept founders
+def company_metadata(company_df, person_scores_deduped):
+    person_scores_deduped = person_scores_deduped.copy()
+    person_scores_deduped["description"] = person_scores_deduped["description"].replace(
+        np.nan, None
+    )
+
+    all_person_metadata = (
+        person_scores_deduped.groupby(
+            [
+                "company_id",
+            ],
+            dropna=False,
+        )
+        .agg(
+            {
+                "linkedin_url": lambda x: list(x),
+                "description": lambda x: list(x),
+                "full_name": lambda x: list(x),
+            }
+        )
+        .reset_index()
+    )
+    return company_df.merge(all_person_metadata, how="left", on="company_id")
+
+
+def null_founder_fields(companies):
+    # the old renderer printed a NaN name or url as "nan". The founders list
+    # stores it as null, which is left out of the note like None, so the old
+    # renderer is given None for it too.
+    for col in ["full_name", "description", "linkedin_url"]:
+        companies[col] = [
+            (
+                [None if pd.isna(value) else value for value in values]
+                if isinstance(values, list)
+                else values
+            )
+            for values in companies[col]
+        ]
+    return companies
+
+
+def company_frames(stage, conn):
+    # the frame the stage used to render its notes from, and the one it keeps
+    company_df, person_scores_deduped = stage.score_companies(conn)
+    old_style = null_founder_fields(
+        company_metadata(company_df, person_scores_deduped)
+    )
+    companies = company_df.copy()
+    companies["founders"] = companies["company_id"].map(
+        notes.founder_records(person_scores_deduped)
+    )
+    return old_style, companies
+
+
+def report(name, frame, expected, actual):
+    differs = np.flatnonzero(expected.to_numpy() != actual.to_numpy())
+    for i in differs[:3]:
+        print("[{}] {} mismatch:\n{}".format(datetime.now(), name, frame.iloc[i]))
+        print("--- old ---\n{}--- new ---\n{}".format(expected.iloc[i], actual.iloc[i]))
+    print(
+        "[{}] Checked {}: {}, mismatches: {}".format(
+            datetime.now(), name, len(frame), len(differs)
+        )
+    )
+    return len(differs)
+
+
+def run(conn):
+    print("[{}] Checking haystack note rendering parity".format(datetime.now()))
+    n_mismatches = 0
+    for stage in HS_SCORE_STAGES:
+        old_style, companies = company_frames(stage, conn)
+        date_generated = stage.CURRENT_DATE_WITH_DASH
+        expected = pd.Series(
+            [
+                create_note_string(row, date_generated)
+                for _, row in old_style.iterrows()
+            ],
+            index=companies.index,
+            dtype=object,
+        )
+        n_mismatches += report(
+            "{} haystack notes".format(stage.SPC_GEO),
+            companies,
+            expected,
+            notes.hs_notes(companies, date_generated),
+        )
+    return n_mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run(cnx.Cnx) else 0)
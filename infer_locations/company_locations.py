@@ -1,6 +1,8 @@
+import argparse
 import pandas as pd
-from context import cnx
+from context import cnx, bulk, stream, watermarks
 from datetime import datetime
+from sqlalchemy import BigInteger, DateTime
 
 person_locations_query = '''
     select
@@ -9,6 +11,7 @@ person_locations_query = '''
         , l.inferred_country_code_alpha3
         , l.inferred_city
         , r.last_scraped_at
+        , r.role_id
     from roles r
         left join score_v2.person_locations l on l.person_id = r.person_id
         left join score_v2.role_flags rf on rf.role_id = r.role_id
@@ -18,28 +21,163 @@ person_locations_query = '''
         and r.company_id is not null
         '''
 
-if __name__ == '__main__':
-    # pull data
+# same as above, for the given companies only
+changed_person_locations_query = (
+    person_locations_query
+    + '''
+        and r.company_id = any(%(company_ids)s)
+        '''
+)
+
+# companies with a role scraped, a founder who moved, or a role re-flagged since
+# the last run, or that lost the founder they were located by. Roles are scraped
+# in batches, so their mark is inclusive.
+changed_companies_query = '''
+    select distinct r.company_id
+    from roles r
+        left join score_v2.person_locations l on l.person_id = r.person_id
+        left join score_v2.role_flags rf on rf.role_id = r.role_id
+    where r.company_id is not null
+        and (
+            r.last_scraped_at >= %(roles)s
+            or l.location_changed_at > %(person_locations)s
+            or rf.generated_at > %(role_flags)s
+        )
+    union
+    -- a founder role that moved to another company leaves nothing changed behind,
+    -- so also re-locate companies whose stored founder role was scraped since, or
+    -- is gone
+    select cl.company_id
+    from roles r
+        join score_v2.company_locations cl on cl.role_id = r.role_id
+    where r.last_scraped_at >= %(roles)s
+    union
+    select cl.company_id
+    from score_v2.company_locations cl
+    where not exists (select 1 from roles r where r.role_id = cl.role_id)
+    '''
+
+latest_changes_query = '''
+    select
+        (select max(last_scraped_at) from roles) as roles
+        , (select max(location_changed_at) from score_v2.person_locations) as person_locations
+        , (select max(generated_at) from score_v2.role_flags) as role_flags
+    '''
+
+company_location_cols = [
+    'company_id',
+    'spc_geo',
+    'inferred_country_code_alpha3',
+    'inferred_city',
+    'last_scraped_at',
+    'role_id',
+]
+
+# so a run that reads no founders still writes typed columns
+company_location_dtypes = {
+    'company_id': BigInteger,
+    'last_scraped_at': DateTime,
+    'role_id': BigInteger,
+}
+
+watermark_stages = {
+    'roles': 'company_locations.roles',
+    'person_locations': 'company_locations.person_locations',
+    'role_flags': 'company_locations.role_flags',
+}
+
+
+def run(conn, full=False):
     print('[{}] Starting...'.format(datetime.now()))
-    conn = cnx.Cnx
-    raw_person_locations = pd.read_sql_query(person_locations_query, conn)
-    print(
-        '[{}] Done pulling data. Pulled: {}'.format(
-            datetime.now(), len(raw_person_locations)
+    marks = None
+    stored_types = bulk.table_types(conn, 'company_locations', schema='score_v2')
+    # locations stored before founder role ids were kept need a full run
+    if not full and stored_types and 'role_id' in stored_types:
+        marks = {
+            source: watermarks.get_watermark(conn, stage)
+            for source, stage in watermark_stages.items()
+        }
+        if any(mark is None for mark in marks.values()):
+            marks = None
+    new_marks = pd.read_sql_query(latest_changes_query, conn).iloc[0]
+
+    if marks is None:
+        print('[{}] Locating all companies'.format(datetime.now()))
+        chunks = stream.read_sql_chunks(person_locations_query, conn)
+    else:
+        changed_companies = pd.read_sql_query(
+            changed_companies_query, conn, params=marks
+        )['company_id']
+        print(
+            '[{}] Locating {} companies with changed founders'.format(
+                datetime.now(), len(changed_companies)
+            )
+        )
+        chunks = stream.read_sql_chunks(
+            changed_person_locations_query,
+            conn,
+            params={'company_ids': changed_companies.tolist()},
         )
-    )
 
-    person_locations = raw_person_locations.copy()
-    person_locations_sorted = person_locations.sort_values(
-        'last_scraped_at', ascending=False
-    )
-    company_locations = person_locations_sorted.drop_duplicates(
-        'company_id', keep='first'
-    )
+    # stream data, keeping only the latest founder location per company so far
+    company_locations = None
+    n_pulled = 0
+    for raw_person_locations in chunks:
+        n_pulled += len(raw_person_locations)
+        if company_locations is not None:
+            raw_person_locations = pd.concat(
+                [company_locations, raw_person_locations], ignore_index=True
+            )
+        person_locations_sorted = raw_person_locations.sort_values(
+            'last_scraped_at', ascending=False
+        )
+        company_locations = person_locations_sorted.drop_duplicates(
+            'company_id', keep='first'
+        )
+    print('[{}] Done pulling data. Pulled: {}'.format(datetime.now(), n_pulled))
+    if company_locations is None:
+        # nothing was read, but the changed companies still need deleting and
+        # the high-water marks moving
+        company_locations = pd.DataFrame(columns=company_location_cols)
 
     # write to db
     print('[{}] Writing to db'.format(datetime.now()))
-    company_locations.to_sql(
-        'company_locations', conn, if_exists='replace', index=False, schema='score_v2'
+    if marks is None:
+        write_res = bulk.swap_to_sql(
+            company_locations,
+            'company_locations',
+            conn,
+            schema='score_v2',
+            dtype=company_location_dtypes,
+            indexes=[['company_id'], ['spc_geo'], ['role_id']],
+        )
+    else:
+        # changed companies without a located founder any more are dropped
+        write_res = bulk.upsert_to_sql(
+            company_locations,
+            'company_locations',
+            conn,
+            key='company_id',
+            schema='score_v2',
+            delete_keys=changed_companies,
+        )
+
+    # only move the high-water marks forward once the locations are written
+    for source, stage in watermark_stages.items():
+        if pd.notna(new_marks[source]):
+            watermarks.set_watermark(conn, stage, new_marks[source].to_pydatetime())
+    print('[{}] Done writing to db, rows: {}'.format(datetime.now(), write_res))
+
+    return write_res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Infer company locations.')
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='re-locate every company instead of those whose founders changed',
     )
-    print('[{}] Done writing to db'.format(datetime.now()))
+    args = parser.parse_args()
+
+    run(cnx.Cnx, full=args.full)
@@ -1,6 +1,7 @@
+import argparse
 import pandas as pd
-from context import cnx
-from tqdm import tqdm
+from context import cnx, bulk, stream, watermarks
+from datetime import datetime
 import sqlalchemy
 
 
@@ -32,6 +33,47 @@ roleQuery = '''
         r.city as role_city
     from v1.persons p
     left join v1.roles r on r.person_id = p.person_id
+    order by p.person_id, r.role_id
+    '''
+
+# same as above, for persons whose person row or any role was scraped since the
+# last run
+changedRoleQuery = '''
+    with changed_persons as (
+        select person_id from v1.persons where last_scraped_at >= %(persons)s
+        union
+        select person_id from v1.roles where last_scraped_at >= %(roles)s
+    )
+    select
+        p.person_id as person_id,
+        p.full_name as full_name,
+        p.country_code_alpha3 as person_country_code_alpha3,
+        p.city as person_city,
+        r.role_id as role_id,
+        r.role_start as role_start,
+        r.country_code_alpha3 as role_country_code_alpha3,
+        r.city as role_city
+    from v1.persons p
+    join changed_persons cp on cp.person_id = p.person_id
+    left join v1.roles r on r.person_id = p.person_id
+    order by p.person_id, r.role_id
+    '''
+
+latestScrapeQuery = '''
+    select
+        (select max(last_scraped_at) from v1.persons) as persons,
+        (select max(last_scraped_at) from v1.roles) as roles
+    '''
+
+existingLocationsQuery = '''
+    select
+        person_id,
+        inferred_country_code_alpha3,
+        inferred_city,
+        spc_geo,
+        location_changed_at
+    from score_v2.person_locations
+    where person_id = any(%(person_ids)s)
     '''
 
 locationDbCols = [
@@ -43,6 +85,15 @@ locationDbCols = [
     'spc_geo_metadata',
 ]
 
+# a person has moved if any of these changed. company_locations uses
+# location_changed_at to refresh only the companies of moved founders
+locationChangeCols = ['inferred_country_code_alpha3', 'inferred_city', 'spc_geo']
+
+watermarkStages = {
+    'persons': 'person_locations.persons',
+    'roles': 'person_locations.roles',
+}
+
 
 def inferPersonGeo(group: pd.DataFrame) -> pd.Series:
     group = group.sort_values(by='role_start', ascending=False)
@@ -106,28 +157,202 @@ def inferPersonGeo(group: pd.DataFrame) -> pd.Series:
     return pd.Series(inferredLocation)
 
 
-if __name__ == '__main__':
+def hasCountry(countries: pd.Series) -> pd.Series:
+    return countries.notna() & (countries != '')
+
+
+def roleMetadata(roleIds: pd.Series) -> list:
+    return [
+        None if pd.isna(roleId) else {'source': 'role', 'source_id': int(roleId)}
+        for roleId in roleIds
+    ]
+
+
+def inferPersonGeos(roleData: pd.DataFrame) -> pd.DataFrame:
+    # Vectorised inferPersonGeo for every person in roleData, with the same
+    # output as roleData.groupby(['person_id', 'full_name'], as_index=False)
+    # .apply(inferPersonGeo)
+
+    # groupby drops persons without a name
+    roles = roleData[roleData['full_name'].notna()]
+    # each person's roles latest first, as in inferPersonGeo. Stable, so ties
+    # keep their order in roleData like the per-group sort does
+    roles = roles.sort_values(
+        ['person_id', 'role_start'], ascending=[True, False], kind='mergesort'
+    )
+    persons = roles.drop_duplicates('person_id').reset_index(drop=True)
+    personIds = persons['person_id']
+
+    # Try to infer first from person, otherwise from their latest role with a
+    # location
+    fromPerson = hasCountry(persons['person_country_code_alpha3'])
+    firstLocatedRole = (
+        roles[hasCountry(roles['role_country_code_alpha3'])]
+        .drop_duplicates('person_id')
+        .set_index('person_id')
+        .reindex(personIds)
+        .reset_index(drop=True)
+    )
+    inferred = pd.DataFrame(
+        {
+            'person_id': personIds,
+            'full_name': persons['full_name'],
+            'inferred_country_code_alpha3': persons[
+                'person_country_code_alpha3'
+            ].where(fromPerson, firstLocatedRole['role_country_code_alpha3']),
+            'inferred_city': persons['person_city'].where(
+                fromPerson, firstLocatedRole['role_city']
+            ),
+        },
+        dtype=object,
+    )
+    inferred['location_metadata'] = [
+        {'source': 'person', 'source_id': int(personId)} if isPerson else metadata
+        for personId, isPerson, metadata in zip(
+            personIds, fromPerson, roleMetadata(firstLocatedRole['role_id'])
+        )
+    ]
+
+    # Try to assign to SPC geo based on the inferred location, otherwise based on
+    # their latest role in one of the geos
+    inferredGeo = inferred['inferred_country_code_alpha3'].map(spcGeoMapping)
+    fromInferred = inferredGeo.notna()
+    roleGeos = roles['role_country_code_alpha3'].map(spcGeoMapping)
+    firstGeoRole = (
+        roles.assign(spc_geo=roleGeos)[roleGeos.notna()]
+        .drop_duplicates('person_id')
+        .set_index('person_id')
+        .reindex(personIds)
+        .reset_index(drop=True)
+    )
+    inferred['spc_geo'] = inferredGeo.where(fromInferred, firstGeoRole['spc_geo'])
+    inferred['spc_geo_metadata'] = [
+        locationMetadata if isInferred else metadata
+        for isInferred, locationMetadata, metadata in zip(
+            fromInferred,
+            inferred['location_metadata'],
+            roleMetadata(firstGeoRole['role_id']),
+        )
+    ]
+    return inferred.astype(object).where(inferred.notna(), None)
+
+
+def person_chunks(role_chunks):
+    # roles are streamed ordered by person, so only the last person in a chunk
+    # can continue into the next one. Hold their rows back until it's complete.
+    carry = None
+    for roleData in role_chunks:
+        if carry is not None:
+            roleData = pd.concat([carry, roleData], ignore_index=True)
+        if roleData.empty:
+            continue
+        lastPerson = roleData['person_id'].iloc[-1]
+        isLastPerson = roleData['person_id'] == lastPerson
+        carry = roleData[isLastPerson]
+        if (~isLastPerson).any():
+            yield roleData[~isLastPerson]
+    if carry is not None and len(carry):
+        yield carry
+
+
+def stampLocationChanges(locations, existing, now):
+    merged = locations.merge(
+        existing, on='person_id', how='left', suffixes=('', '_old')
+    )
+    # persons without a row yet count as moved
+    moved = merged['location_changed_at'].isna()
+    for col in locationChangeCols:
+        new, old = merged[col], merged[col + '_old']
+        moved |= ~((new == old) | (new.isna() & old.isna()))
+    locations = locations.copy()
+    locations['location_changed_at'] = (
+        merged['location_changed_at'].where(~moved, now).values
+    )
+    return locations
+
+
+def run(conn, full=False):
     print('Starting script!')
-    # Create the connection
-    conn = cnx.Cnx
-
-    tqdm.pandas()
-    print('Getting role data...')
-    roleData = pd.read_sql(roleQuery, conn)
-    grouped = roleData.groupby(['person_id', 'full_name'], as_index=False)
-    print('Running geo inference...')
-    inferredDf = grouped.progress_apply(inferPersonGeo)
-    locationsToWrite = inferredDf[locationDbCols]
+    now = datetime.now()
+
+    marks = None
+    existingCols = bulk.table_types(conn, 'person_locations', schema='score_v2') or {}
+    if not full and 'location_changed_at' in existingCols:
+        marks = {
+            source: watermarks.get_watermark(conn, stage)
+            for source, stage in watermarkStages.items()
+        }
+        if any(mark is None for mark in marks.values()):
+            marks = None
+    newMarks = pd.read_sql_query(latestScrapeQuery, conn).iloc[0]
+
+    if marks is None:
+        print('Inferring locations for all persons...')
+        roleChunks = stream.read_sql_chunks(roleQuery, conn)
+    else:
+        print(
+            'Inferring locations for persons scraped since {}...'.format(
+                marks['persons']
+            )
+        )
+        roleChunks = stream.read_sql_chunks(changedRoleQuery, conn, params=marks)
+
+    print('Streaming role data and running geo inference...')
+
+    def inferred_chunks():
+        for roleData in person_chunks(roleChunks):
+            locationsToWrite = inferPersonGeos(roleData)[locationDbCols]
+            if marks is None:
+                locationsToWrite['location_changed_at'] = now
+            else:
+                existing = pd.read_sql_query(
+                    existingLocationsQuery,
+                    conn,
+                    params={'person_ids': locationsToWrite['person_id'].tolist()},
+                )
+                locationsToWrite = stampLocationChanges(
+                    locationsToWrite, existing, now
+                )
+            yield locationsToWrite
+
     print('Writing to database...')
-    locationsToWrite.to_sql(
-        'person_locations',
-        conn,
-        if_exists='replace',
-        index=False,
-        dtype={
-            'location_metadata': sqlalchemy.dialects.postgresql.JSONB,
-            'spc_geo_metadata': sqlalchemy.dialects.postgresql.JSONB,
-        },
-        schema='score_v2',
+    if marks is None:
+        write_res = bulk.swap_to_sql(
+            inferred_chunks(),
+            'person_locations',
+            conn,
+            dtype={
+                'location_metadata': sqlalchemy.dialects.postgresql.JSONB,
+                'spc_geo_metadata': sqlalchemy.dialects.postgresql.JSONB,
+            },
+            schema='score_v2',
+            indexes=[['person_id'], ['spc_geo']],
+        )
+    else:
+        write_res = bulk.upsert_to_sql(
+            inferred_chunks(),
+            'person_locations',
+            conn,
+            key='person_id',
+            schema='score_v2',
+        )
+
+    # only move the high-water marks forward once the locations are written
+    for source, stage in watermarkStages.items():
+        if pd.notna(newMarks[source]):
+            watermarks.set_watermark(conn, stage, newMarks[source].to_pydatetime())
+    print('Done! Rows: {}'.format(write_res))
+
+    return write_res
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Infer person locations.')
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='re-infer every person instead of the persons scraped since the last run',
     )
-    print('Done!')
+    args = parser.parse_args()
+
+    run(cnx.Cnx, full=args.full)
@@ -0,0 +1,66 @@
+import argparse
+import sys
+import pandas as pd
+from context import cnx, stream
+from datetime import datetime
+from tqdm import tqdm
+
+from person_locations import (
+    inferPersonGeo,
+    inferPersonGeos,
+    locationDbCols,
+    person_chunks,
+    roleQuery,
+)
+
+# Checks that the vectorised inferPersonGeos gives the same locations as the
+# per-person inferPersonGeo, on the live roles data.
+
+
+def mismatches(expected: pd.DataFrame, actual: pd.DataFrame) -> pd.DataFrame:
+    merged = expected.merge(
+        actual, on='person_id', how='outer', suffixes=('', '_vectorised')
+    )
+    differs = pd.Series(False, index=merged.index)
+    for col in locationDbCols:
+        if col == 'person_id':
+            continue
+        a, b = merged[col], merged[col + '_vectorised']
+        same = (a.isna() & b.isna()) | (a.notna() & b.notna() & (a == b))
+        differs |= ~same
+    return merged[differs]
+
+
+def run(conn, limit=None):
+    print('[{}] Checking person geo inference parity'.format(datetime.now()))
+    tqdm.pandas()
+    n_persons, n_mismatches = 0, 0
+    for roleData in person_chunks(stream.read_sql_chunks(roleQuery, conn)):
+        expected = roleData.groupby(
+            ['person_id', 'full_name'], as_index=False
+        ).progress_apply(inferPersonGeo)[locationDbCols]
+        actual = inferPersonGeos(roleData)[locationDbCols]
+
+        chunk_mismatches = mismatches(expected, actual)
+        if len(chunk_mismatches):
+            print(chunk_mismatches.head(10).to_string())
+        n_persons += len(expected)
+        n_mismatches += len(chunk_mismatches)
+        print(
+            '[{}] Checked: {}, mismatches: {}'.format(
+                datetime.now(), n_persons, n_mismatches
+            )
+        )
+        if limit is not None and n_persons >= limit:
+            break
+    return n_mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare inferPersonGeos with inferPersonGeo.'
+    )
+    parser.add_argument('--limit', type=int, help='stop after this many persons')
+    args = parser.parse_args()
+
+    sys.exit(1 if run(cnx.Cnx, limit=args.limit) else 0)
@@ -1,7 +1,6 @@
 import pandas as pd
 from datetime import datetime
-from context import cnx
-import numpy as np
+from context import cnx, bulk, scores
 from sqlalchemy.orm import sessionmaker
 
 SPC_GEO = 'ANZ'
@@ -53,6 +52,44 @@ role_scores_query = '''
     SPC_GEO
 )
 
+# same as above, for when the education and role scores are handed over in memory
+education_scores_handoff_query = '''
+    select
+        p.person_id
+        , e.education_id
+        , e.degree_name
+        , s."name" as school_name
+    from persons p
+        left join educations e on e.person_id = p.person_id
+        left join schools s on s.school_id = e.school_id
+    where p.person_id in (
+        select distinct person_id
+        from score_v2.person_locations
+        where spc_geo = '{}'
+        )
+'''.format(
+    SPC_GEO
+)
+
+role_scores_handoff_query = '''
+    select
+        p.person_id
+        , r.role_id
+        , r.role_title
+        , c."name" as company_name
+        , c.company_id
+    from persons p
+        left join roles r on r.person_id = p.person_id
+        left join companies c on c.company_id = r.company_id
+    where p.person_id in (
+        select distinct person_id
+        from score_v2.person_locations
+        where spc_geo = '{}'
+        )
+'''.format(
+    SPC_GEO
+)
+
 delete_person_score_query = '''
     DO
     $$
@@ -71,20 +108,40 @@ delete_person_score_query = '''
     SPC_GEO
 )
 
-if __name__ == '__main__':
+
+def run(
+    conn,
+    role_scores=None,
+    education_scores=None,
+    person_roles=None,
+    person_educations=None,
+):
     print('[{}] Starting person_score_{}.py'.format(datetime.now(), SPC_GEO.lower()))
-    conn = cnx.Cnx
 
     # pull data
     print('[{}] Pulling role scores'.format(datetime.now()))
-    raw_role_scores = pd.read_sql_query(role_scores_query, conn)
+    if role_scores is None:
+        raw_role_scores = pd.read_sql_query(role_scores_query, conn)
+    else:
+        if person_roles is None:
+            person_roles = pd.read_sql_query(role_scores_handoff_query, conn)
+        raw_role_scores = person_roles.merge(role_scores, on='role_id', how='left')
     print(
         '[{}] Done pulling role scores. Pulled: {}'.format(
             datetime.now(), len(raw_role_scores)
         )
     )
     print('[{}] Pulling education scores'.format(datetime.now()))
-    raw_education_scores = pd.read_sql_query(education_scores_query, conn)
+    if education_scores is None:
+        raw_education_scores = pd.read_sql_query(education_scores_query, conn)
+    else:
+        if person_educations is None:
+            person_educations = pd.read_sql_query(
+                education_scores_handoff_query, conn
+            )
+        raw_education_scores = person_educations.merge(
+            education_scores, on='education_id', how='left'
+        )
     print(
         '[{}] Done pulling education scores. Pulled: {}'.format(
             datetime.now(), len(raw_education_scores)
@@ -97,15 +154,12 @@ if __name__ == '__main__':
     education_scores = raw_education_scores.copy()
 
     education_scores_dropped = education_scores.dropna(subset=['education_score'])
-    education_stores_filled = education_scores_dropped.replace(
-        [None, '', np.nan], 'N/A'
+    education_stores_filled = education_scores_dropped.rename(
+        columns={'education_score': 'score'}
     )
-    education_stores_filled['description'] = (
-        education_stores_filled['degree_name']
-        + ' @ '
-        + education_stores_filled['school_name']
+    education_stores_filled['description'] = scores.describe(
+        education_stores_filled['degree_name'], education_stores_filled['school_name']
     )
-    education_stores_filled.rename(columns={'education_score': 'score'}, inplace=True)
 
     # if person has more than one role in the same company, then keep the highest score only
     role_scores_sorted = role_scores.sort_values(
@@ -115,11 +169,10 @@ if __name__ == '__main__':
         subset=['person_id', 'company_id'], keep='first'
     )
     role_scores_dropped = role_scores_deduped.dropna(subset=['role_score'])
-    role_scores_filled = role_scores_dropped.replace([None, '', np.nan], 'N/A')
-    role_scores_filled['description'] = (
-        role_scores_filled['role_title'] + ' @ ' + role_scores_filled['company_name']
+    role_scores_filled = role_scores_dropped.rename(columns={'role_score': 'score'})
+    role_scores_filled['description'] = scores.describe(
+        role_scores_filled['role_title'], role_scores_filled['company_name']
     )
-    role_scores_filled.rename(columns={'role_score': 'score'}, inplace=True)
 
     all_scores = pd.concat(
         [
@@ -133,16 +186,7 @@ if __name__ == '__main__':
     # Group and generate person scores
     print('[{}] Generating person scores'.format(datetime.now()))
 
-    person_scores = (
-        all_scores.groupby('person_id')
-        .agg({'score': 'sum', 'description': lambda x: list(x)})
-        .reset_index()
-    )
-
-    # make description column into a string
-    person_scores['description'] = person_scores['description'].apply(
-        lambda x: '; '.join(x)
-    )
+    person_scores = scores.sum_scores(all_scores, '; ')
 
     # Join back with all geo persons
     all_persons = pd.read_sql_query(person_ids_query, conn)
@@ -166,7 +210,17 @@ if __name__ == '__main__':
     print('[{}] Writing to db'.format(datetime.now()))
     all_persons_filled['generated_at'] = datetime.now()
     all_persons_filled['spc_geo'] = SPC_GEO
-    all_persons_filled.to_sql(
-        'person_scores', conn, if_exists='append', schema='score_v2', index=False
+    bulk.copy_to_sql(
+        all_persons_filled,
+        'person_scores',
+        conn,
+        if_exists='append',
+        schema='score_v2',
     )
     print('[{}] Done writing to db'.format(datetime.now()))
+
+    return all_persons_filled
+
+
+if __name__ == '__main__':
+    run(cnx.Cnx)
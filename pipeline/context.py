@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# the stages run in-process resolve their own context imports to this module, so
+# it exposes everything those stages import
+import db.cnx as cnx
+import db.bulk as bulk
+import db.stream as stream
+import db.watermarks as watermarks
+import flags.matcher as matcher
+import scoring.scores as scores
+import scoring.tiers as tiers
+import stealth_founders.crm_index as crm_index
+import scoring.notes as notes
+import traffic.metrics as metrics
+import db.snapshot as snapshot
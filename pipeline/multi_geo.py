@@ -0,0 +1,290 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+from context import cnx
+from sqlalchemy import inspect
+
+import snapshot_inputs
+from stages import SPC_GEOS, geo_stage, run_geo_outputs
+
+# The geo stages all pull the same roles / educations joins, filtered by
+# score_v2.person_locations.spc_geo. These pull them once for every geo, with
+# the geo attached so they can be partitioned in memory.
+geo_persons_query = '''
+    select distinct person_id, spc_geo
+    from score_v2.person_locations
+    where spc_geo in ({})
+'''
+
+roles_query = '''
+    select
+         gp.spc_geo
+        , r.role_title
+        , r.linkedin_role_description
+        , r.role_start
+        , r.role_end
+        , r.role_id
+        , f.is_founder
+        , f.is_csuite
+        , f.is_stealth
+        , f.is_irrelevant_role
+        , f.seniority
+        , c."name" as company_name
+    from roles r
+    join ({}) gp on gp.person_id = r.person_id
+    left join score_v2.role_flags f on f.role_id = r.role_id
+    left join companies c on c.company_id = r.company_id
+'''
+
+roles_handoff_query = '''
+    select
+         gp.spc_geo
+        , r.role_title
+        , r.linkedin_role_description
+        , r.role_start
+        , r.role_end
+        , r.role_id
+        , c."name" as company_name
+    from roles r
+    join ({}) gp on gp.person_id = r.person_id
+    left join companies c on c.company_id = r.company_id
+'''
+
+educations_query = '''
+    select
+         gp.spc_geo
+        , e.degree_name
+        , e.education_id
+        , ef.is_phd
+        , ef.is_masters
+        , ef.is_irrelevant
+        , s."name" as school_name
+    from educations e
+    join ({}) gp on gp.person_id = e.person_id
+    left join score_v2.education_flags ef on ef.education_id = e.education_id
+    left join schools s on s.school_id = e.school_id
+'''
+
+educations_handoff_query = '''
+    select
+         gp.spc_geo
+        , e.degree_name
+        , e.education_id
+        , s."name" as school_name
+    from educations e
+    join ({}) gp on gp.person_id = e.person_id
+    left join schools s on s.school_id = e.school_id
+'''
+
+person_roles_query = '''
+    select
+        gp.spc_geo
+        , p.person_id
+        , r.role_id
+        , r.role_title
+        , c."name" as company_name
+        , c.company_id
+    from persons p
+        join ({}) gp on gp.person_id = p.person_id
+        left join roles r on r.person_id = p.person_id
+        left join companies c on c.company_id = r.company_id
+'''
+
+person_educations_query = '''
+    select
+        gp.spc_geo
+        , p.person_id
+        , e.education_id
+        , e.degree_name
+        , s."name" as school_name
+    from persons p
+        join ({}) gp on gp.person_id = p.person_id
+        left join educations e on e.person_id = p.person_id
+        left join schools s on s.school_id = e.school_id
+'''
+
+
+# score_v2 tables the geo workers append to. If any is missing (first run),
+# the first geo runs in the parent so the workers don't race on creating it.
+score_tables = [
+    'traffic_flags',
+    'company_sweetspot_flags',
+    'role_scores',
+    'education_scores',
+    'person_scores',
+]
+
+
+def output_tables(experiment_name):
+    if experiment_name == 'prod':
+        return ['haystack_scores', 'company_upload_tracker']
+    elif experiment_name == 'test':
+        return ['haystack_scores_test']
+    return ['haystack_scores_experiment']
+
+
+def tables_exist(conn, tables):
+    inspector = inspect(conn)
+    return all(inspector.has_table(table, schema='score_v2') for table in tables)
+
+
+def partition_by_geo(df, spc_geos):
+    partitions = {spc_geo: df.iloc[0:0] for spc_geo in spc_geos}
+    for spc_geo, part in df.groupby('spc_geo', sort=False):
+        partitions[spc_geo] = part
+    return {
+        spc_geo: part.drop(columns='spc_geo').reset_index(drop=True)
+        for spc_geo, part in partitions.items()
+    }
+
+
+def pull_db_inputs(conn, geo_persons, role_flags_df=None, education_flags_df=None):
+    print('[{}] Pulling shared roles'.format(datetime.now()))
+    if role_flags_df is None:
+        roles = pd.read_sql_query(roles_query.format(geo_persons), conn)
+    else:
+        roles = pd.read_sql_query(
+            roles_handoff_query.format(geo_persons), conn
+        ).merge(role_flags_df, on='role_id', how='left')
+
+    print('[{}] Pulling shared educations'.format(datetime.now()))
+    if education_flags_df is None:
+        educations = pd.read_sql_query(educations_query.format(geo_persons), conn)
+    else:
+        educations = pd.read_sql_query(
+            educations_handoff_query.format(geo_persons), conn
+        ).merge(education_flags_df, on='education_id', how='left')
+
+    print('[{}] Pulling shared person roles and educations'.format(datetime.now()))
+    person_roles = pd.read_sql_query(person_roles_query.format(geo_persons), conn)
+    person_educations = pd.read_sql_query(
+        person_educations_query.format(geo_persons), conn
+    )
+    return {
+        'raw_roles': roles,
+        'raw_educations': educations,
+        'person_roles': person_roles,
+        'person_educations': person_educations,
+    }
+
+
+def pull_shared_inputs(
+    conn, spc_geos, role_flags_df=None, education_flags_df=None, use_snapshot=False
+):
+    # the geos' inputs, by geo. From the snapshots they include the founder roles
+    # at each geo's companies, for the hs_score stages.
+    geo_persons = geo_persons_query.format(
+        ', '.join("'{}'".format(spc_geo) for spc_geo in spc_geos)
+    )
+    if use_snapshot:
+        inputs = snapshot_inputs.pull(
+            conn, geo_persons, spc_geos, role_flags_df, education_flags_df
+        )
+    else:
+        inputs = pull_db_inputs(conn, geo_persons, role_flags_df, education_flags_df)
+    print(
+        '[{}] Done pulling shared inputs. Roles: {}, educations: {}'.format(
+            datetime.now(), len(inputs['raw_roles']), len(inputs['raw_educations'])
+        )
+    )
+
+    partitions = {
+        name: partition_by_geo(df, spc_geos) for name, df in inputs.items()
+    }
+    return {
+        spc_geo: {name: partitions[name][spc_geo] for name in partitions}
+        for spc_geo in spc_geos
+    }
+
+
+def init_worker():
+    # forked workers must not reuse the parent's pooled connections
+    cnx.Cnx.dispose(close=False)
+
+
+def score_geo(spc_geo, inputs):
+    # runs in a worker process, on that process' own connections
+    conn = cnx.Cnx
+    geo_stage('traffic_flags', spc_geo).run(conn)
+    geo_stage('company_sweetspot_flags', spc_geo).run(conn)
+    role_scores = geo_stage('role_score', spc_geo).run(
+        conn, raw_roles=inputs['raw_roles']
+    )
+    education_scores = geo_stage('education_score', spc_geo).run(
+        conn, raw_educations=inputs['raw_educations']
+    )
+    return geo_stage('person_score', spc_geo).run(
+        conn,
+        role_scores=role_scores,
+        education_scores=education_scores,
+        person_roles=inputs['person_roles'],
+        person_educations=inputs['person_educations'],
+    )
+
+
+def output_geo(
+    spc_geo, experiment_name, person_scores, all_geos_scored, founder_roles
+):
+    run_geo_outputs(
+        cnx.Cnx,
+        spc_geo,
+        experiment_name,
+        person_scores,
+        all_geos_scored,
+        founder_roles=founder_roles,
+    )
+
+
+def map_geos(pool, fn, spc_geos, *args, serial_first=False):
+    results = []
+    if serial_first:
+        results.append(fn(spc_geos[0], *[arg[0] for arg in args]))
+        spc_geos, args = spc_geos[1:], [arg[1:] for arg in args]
+    return results + list(pool.map(fn, spc_geos, *args))
+
+
+def run(
+    conn,
+    experiment_name,
+    spc_geos,
+    role_flags_df=None,
+    education_flags_df=None,
+    use_snapshot=False,
+):
+    shared_inputs = pull_shared_inputs(
+        conn, spc_geos, role_flags_df, education_flags_df, use_snapshot=use_snapshot
+    )
+    founder_roles = [
+        shared_inputs[spc_geo].pop('founder_roles', None) for spc_geo in spc_geos
+    ]
+    score_tables_exist = tables_exist(conn, score_tables)
+    output_tables_exist = tables_exist(conn, output_tables(experiment_name))
+
+    with ProcessPoolExecutor(
+        max_workers=len(spc_geos), initializer=init_worker
+    ) as pool:
+        print('[{}] Scoring {} in parallel'.format(datetime.now(), spc_geos))
+        person_scores = pd.concat(
+            map_geos(
+                pool,
+                score_geo,
+                spc_geos,
+                [shared_inputs[spc_geo] for spc_geo in spc_geos],
+                serial_first=not score_tables_exist,
+            ),
+            ignore_index=True,
+        )
+
+        print('[{}] Generating outputs in parallel'.format(datetime.now()))
+        all_geos_scored = set(spc_geos) == set(SPC_GEOS)
+        map_geos(
+            pool,
+            output_geo,
+            spc_geos,
+            [experiment_name] * len(spc_geos),
+            [person_scores] * len(spc_geos),
+            [all_geos_scored] * len(spc_geos),
+            founder_roles,
+            serial_first=not output_tables_exist,
+        )
@@ -0,0 +1,129 @@
+import argparse
+from datetime import datetime
+
+import pandas as pd
+from context import cnx, snapshot
+
+import multi_geo
+from stages import SPC_GEOS, run_geo_outputs, run_geo_scores, run_prereq
+
+
+def run(
+    conn,
+    experiment_name,
+    spc_geos,
+    skip_prereq=False,
+    multi_geo_mode=False,
+    full=False,
+    in_db_flags=False,
+    use_snapshot=False,
+):
+    if use_snapshot:
+        # the flag stages and the geo scoring read the same snapshots, so they
+        # are all refreshed once up front
+        snapshot.refresh_all(conn, full=full)
+
+    role_flags_df, education_flags_df = None, None
+    if not skip_prereq:
+        role_flags_df, education_flags_df = run_prereq(
+            conn,
+            full=full,
+            in_db_flags=in_db_flags,
+            use_snapshot=use_snapshot,
+            refresh_snapshot=False,
+        )
+
+    if multi_geo_mode:
+        multi_geo.run(
+            conn,
+            experiment_name,
+            spc_geos,
+            role_flags_df,
+            education_flags_df,
+            use_snapshot=use_snapshot,
+        )
+        return
+
+    shared_inputs = {}
+    if use_snapshot:
+        shared_inputs = multi_geo.pull_shared_inputs(
+            conn, spc_geos, role_flags_df, education_flags_df, use_snapshot=True
+        )
+    person_scores = pd.concat(
+        [
+            run_geo_scores(
+                conn,
+                spc_geo,
+                role_flags_df,
+                education_flags_df,
+                inputs=shared_inputs.get(spc_geo),
+            )
+            for spc_geo in spc_geos
+        ],
+        ignore_index=True,
+    )
+
+    all_geos_scored = set(spc_geos) == set(SPC_GEOS)
+    for spc_geo in spc_geos:
+        run_geo_outputs(
+            conn,
+            spc_geo,
+            experiment_name,
+            person_scores,
+            all_geos_scored,
+            founder_roles=shared_inputs.get(spc_geo, {}).get('founder_roles'),
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run the prereq and geo stages in a single process.'
+    )
+    parser.add_argument('experiment_name')
+    parser.add_argument(
+        '--geo',
+        dest='spc_geos',
+        action='append',
+        choices=SPC_GEOS,
+        help='geo to score, can be repeated (default: all geos)',
+    )
+    parser.add_argument(
+        '--skip-prereq',
+        action='store_true',
+        help='reuse the score_v2 locations and flags from the last prereq run',
+    )
+    parser.add_argument(
+        '--multi-geo',
+        action='store_true',
+        help='pull the shared geo inputs once and score the geos in parallel',
+    )
+    parser.add_argument(
+        '--full',
+        action='store_true',
+        help='rebuild the incremental prereq tables from scratch',
+    )
+    parser.add_argument(
+        '--in-db-flags',
+        action='store_true',
+        help='compute the role, education and company flags in Postgres',
+    )
+    parser.add_argument(
+        '--snapshot',
+        action='store_true',
+        help='refresh the local Parquet snapshots of the source tables, and flag and '
+        'score from them',
+    )
+    args = parser.parse_args()
+
+    print('[{}] Starting run_pipeline.py'.format(datetime.now()))
+    run(
+        cnx.Cnx,
+        args.experiment_name,
+        args.spc_geos or SPC_GEOS,
+        skip_prereq=args.skip_prereq,
+        multi_geo_mode=args.multi_geo,
+        full=args.full,
+        in_db_flags=args.in_db_flags,
+        use_snapshot=args.snapshot,
+    )
+    print('[{}] Done!'.format(datetime.now()))
@@ -0,0 +1,119 @@
+from datetime import datetime
+
+import pandas as pd
+from context import snapshot
+
+# multi_geo's shared inputs, joined in memory from the source table snapshots
+# instead of in Postgres. Only the geos' persons and companies, and the flags if
+# they weren't handed over, are read from score_v2.
+role_flags_query = '''
+    select
+        role_id
+        , is_founder
+        , is_csuite
+        , is_stealth
+        , is_irrelevant_role
+        , seniority
+    from score_v2.role_flags
+'''
+
+education_flags_query = '''
+    select
+        education_id
+        , is_phd
+        , is_masters
+        , is_irrelevant
+    from score_v2.education_flags
+'''
+
+geo_companies_query = '''
+    select distinct company_id, spc_geo
+    from score_v2.company_locations
+    where spc_geo in ({})
+'''
+
+
+def names(table, key, name):
+    return snapshot.read(table, columns=[key, 'name']).rename(columns={'name': name})
+
+
+def pull(conn, geo_persons, spc_geos, role_flags_df=None, education_flags_df=None):
+    # the frames multi_geo's queries pull, and the founder roles at each geo's
+    # companies the hs_score stages would query, all with the geo attached
+    geo_person_ids = pd.read_sql_query(geo_persons, conn)
+    geo_companies = pd.read_sql_query(
+        geo_companies_query.format(
+            ', '.join("'{}'".format(spc_geo) for spc_geo in spc_geos)
+        ),
+        conn,
+    )
+    if role_flags_df is None:
+        role_flags_df = pd.read_sql_query(role_flags_query, conn)
+    if education_flags_df is None:
+        education_flags_df = pd.read_sql_query(education_flags_query, conn)
+
+    print('[{}] Reading the source snapshots'.format(datetime.now()))
+    persons = snapshot.read(
+        'persons', columns=['person_id', 'linkedin_url', 'last_scraped_at', 'full_name']
+    )
+    roles = snapshot.read(
+        'roles',
+        columns=[
+            'role_id',
+            'person_id',
+            'company_id',
+            'role_title',
+            'linkedin_role_description',
+            'role_start',
+            'role_end',
+        ],
+    )
+    educations = snapshot.read(
+        'educations', columns=['education_id', 'person_id', 'school_id', 'degree_name']
+    )
+    company_names = names('companies', 'company_id', 'company_name')
+    school_names = names('schools', 'school_id', 'school_name')
+
+    geo_roles = roles.merge(geo_person_ids, on='person_id')
+    geo_educations = educations.merge(geo_person_ids, on='person_id')
+    raw_roles = geo_roles.merge(company_names, on='company_id', how='left').merge(
+        role_flags_df, on='role_id', how='left'
+    )
+    raw_educations = geo_educations.merge(
+        school_names, on='school_id', how='left'
+    ).merge(education_flags_df, on='education_id', how='left')
+
+    # every person of the geos, with or without roles and educations
+    geo_persons_df = persons[['person_id']].merge(geo_person_ids, on='person_id')
+    person_roles = geo_persons_df.merge(
+        roles[['person_id', 'role_id', 'role_title', 'company_id']],
+        on='person_id',
+        how='left',
+    ).merge(company_names, on='company_id', how='left')
+    # the query takes company_id from companies, so it's null without a company
+    person_roles['company_id'] = person_roles['company_id'].where(
+        person_roles['company_id'].isin(company_names['company_id'])
+    )
+    person_educations = geo_persons_df.merge(
+        educations[['person_id', 'education_id', 'degree_name', 'school_id']],
+        on='person_id',
+        how='left',
+    ).merge(school_names, on='school_id', how='left')
+
+    founder_role_ids = role_flags_df.loc[role_flags_df['is_founder'] == True, 'role_id']
+    founder_roles = (
+        roles.loc[
+            roles['role_id'].isin(founder_role_ids),
+            ['person_id', 'company_id'],
+        ]
+        .merge(geo_companies, on='company_id')
+        .merge(persons, on='person_id', how='left')
+    )
+
+    return {
+        'raw_roles': raw_roles.drop(columns=['person_id', 'company_id']),
+        'raw_educations': raw_educations.drop(columns=['person_id', 'school_id']),
+        'person_roles': person_roles,
+        'person_educations': person_educations.drop(columns='school_id'),
+        'founder_roles': founder_roles,
+    }
@@ -0,0 +1,99 @@
+import importlib
+from datetime import datetime
+
+from context import cnx
+
+import flags.company_flags as company_flags
+import flags.education_flags as education_flags
+import flags.person_flags as person_flags
+import flags.role_flags as role_flags
+import infer_locations.company_locations as company_locations
+import infer_locations.person_locations as person_locations
+import sw_url_list.get_sw_url_list as get_sw_url_list
+
+SPC_GEOS = ['ANZ', 'ISR', 'SEA']
+
+# per-geo stage modules, formatted with the lower-cased geo
+geo_stage_modules = {
+    'traffic_flags': 'traffic_flags.traffic_flags_{}',
+    'company_sweetspot_flags': 'company_sweetspot_flags.company_sweetspot_flags_{}',
+    'role_score': 'role_score.role_score_{}',
+    'education_score': 'education_score.education_score_{}',
+    'person_score': 'person_score.person_score_{}',
+    'hs_score': 'haystack_score.hs_score_{}',
+    'hs_uploads': 'haystack_score.hs_uploads_{}',
+    'stealth': 'stealth_founders.stealth_{}',
+}
+
+
+def geo_stage(stage, spc_geo):
+    return importlib.import_module(geo_stage_modules[stage].format(spc_geo.lower()))
+
+
+def run_prereq(
+    conn, full=False, in_db_flags=False, use_snapshot=False, refresh_snapshot=True
+):
+    print('[{}] Running prereq stages'.format(datetime.now()))
+    person_locations.run(conn, full=full)
+    company_locations.run(conn, full=full)
+    education_flags_df = education_flags.run(
+        conn,
+        full=full,
+        in_db=in_db_flags,
+        use_snapshot=use_snapshot,
+        refresh_snapshot=refresh_snapshot,
+    )
+    role_flags_df = role_flags.run(
+        conn,
+        full=full,
+        in_db=in_db_flags,
+        use_snapshot=use_snapshot,
+        refresh_snapshot=refresh_snapshot,
+    )
+    person_flags.run(conn, education_flags=education_flags_df)
+    company_flags.run(conn, in_db=in_db_flags)
+    get_sw_url_list.run(conn)
+    print('[{}] Done running prereq stages'.format(datetime.now()))
+    return role_flags_df, education_flags_df
+
+
+def run_geo_scores(
+    conn, spc_geo, role_flags_df=None, education_flags_df=None, inputs=None
+):
+    # inputs are the geo's shared inputs from multi_geo.pull_shared_inputs, which
+    # the stages would query otherwise
+    print('[{}] Scoring {}'.format(datetime.now(), spc_geo))
+    inputs = inputs or {}
+    geo_stage('traffic_flags', spc_geo).run(conn)
+    geo_stage('company_sweetspot_flags', spc_geo).run(conn)
+    role_scores = geo_stage('role_score', spc_geo).run(
+        conn, role_flags=role_flags_df, raw_roles=inputs.get('raw_roles')
+    )
+    education_scores = geo_stage('education_score', spc_geo).run(
+        conn,
+        education_flags=education_flags_df,
+        raw_educations=inputs.get('raw_educations'),
+    )
+    return geo_stage('person_score', spc_geo).run(
+        conn,
+        role_scores=role_scores,
+        education_scores=education_scores,
+        person_roles=inputs.get('person_roles'),
+        person_educations=inputs.get('person_educations'),
+    )
+
+
+def run_geo_outputs(
+    conn, spc_geo, experiment_name, person_scores, all_geos_scored, founder_roles=None
+):
+    print('[{}] Generating {} outputs'.format(datetime.now(), spc_geo))
+    # hs_score also picks up founders located in other geos, so the in-memory
+    # person scores are only complete when every geo was scored in this run
+    geo_stage('hs_score', spc_geo).run(
+        conn,
+        experiment_name,
+        person_scores=person_scores if all_geos_scored else None,
+        founder_roles=founder_roles,
+    )
+    geo_stage('hs_uploads', spc_geo).run(conn, experiment_name)
+    geo_stage('stealth', spc_geo).run(conn, person_scores=person_scores)
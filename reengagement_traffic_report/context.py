@@ -4,3 +4,6 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import db.cnx as cnx
+import traffic.curves as curves
+import traffic.metrics as metrics
+import traffic.charts as charts
@@ -0,0 +1,36 @@
+import os
+
+import pandas as pd
+from dotenv import load_dotenv
+from context import charts
+
+
+# Load environment variables
+load_dotenv()
+HS_SCORE_V2_DIR = os.getenv("HS_SCORE_V2_DIR")
+
+
+if __name__ == "__main__":
+    # Read the series and fits written by gen_reengagement_traffic_metrics.py
+    current_date = pd.to_datetime("today").strftime("%Y%m%d")
+    visits = pd.read_csv(
+        HS_SCORE_V2_DIR
+        + "_reengagement_traffic_report/metrics/reengagement_visits_{}.csv".format(
+            current_date
+        ),
+        parse_dates=["visit_date"],
+    )
+    fits = pd.read_csv(
+        HS_SCORE_V2_DIR
+        + "_reengagement_traffic_report/metrics/reengagement_fits_{}.csv".format(
+            current_date
+        ),
+        index_col="domain",
+    )
+
+    print("Plotting charts...")
+    # only the charts whose series or fit changed since the last run are drawn
+    drawn = charts.render_charts(
+        visits, fits, HS_SCORE_V2_DIR + "_reengagement_traffic_report/charts/"
+    )
+    print("Done plotting charts, {} of {} redrawn.".format(drawn, len(fits)))
@@ -1,15 +1,9 @@
 import os
 
-import matplotlib.pyplot as plt
-import numpy as np
 import pandas as pd
-import seaborn as sns
 import sqlalchemy
 from dotenv import load_dotenv
-from scipy.optimize import curve_fit
-from scipy.stats import linregress
-from tqdm import tqdm
-from context import cnx
+from context import cnx, charts, curves, metrics
 
 
 # Load environment variables
@@ -51,94 +45,16 @@ if __name__ == "__main__":
     grouped = df_sorted.groupby("domain")
     print("Domains to calculate metrics for: {}".format(len(grouped)))
 
-    # Function representing the exponential curve
     print("Calculating exponential and linear curve fits for each domain...")
 
-    def exponential_curve(x, a, b, c):
-        return a * np.exp(-b * x) + c
-
     ### Calculate linear and exponential curve fits for each domain
-    results_exp = {}
-    results_lin = {}
-
-    for domain, group in tqdm(grouped):
-        x = np.arange(len(group))  # x-values for the curve fit
-        y = group["visit_count"].values  # y-values for the curve fit
-
-        try:
-            # Perform curve fitting
-            popt, pcov = curve_fit(exponential_curve, x, y)
-
-            # Get the coefficients and covariance matrix
-            a, b, c = popt
-            covariance_matrix = pcov
-
-            # Calculate the goodness of fit (R-squared)
-            residuals = y - exponential_curve(x, a, b, c)
-            ss_residuals = np.sum(residuals**2)
-            ss_total = np.sum((y - np.mean(y)) ** 2)
-            r_squared = 1 - (ss_residuals / ss_total)
-
-            # Store the results in the dictionary
-            results_exp[domain] = {
-                "coefficient_a": a,
-                "coefficient_b": b,
-                "coefficient_c": c,
-                "covariance_matrix": covariance_matrix,
-                "r_squared": r_squared,
-            }
-        except RuntimeError:
-            # Set coefficients and fit result to 0 for domains with RuntimeError
-            results_exp[domain] = {
-                "coefficient_a": 0,
-                "coefficient_b": 0,
-                "coefficient_c": 0,
-                "covariance_matrix": np.zeros((3, 3)),
-                "r_squared": 0,
-            }
-
-    for domain, group in tqdm(grouped):
-        x = np.arange(len(group))  # x-values for the linear regression
-        y = group["visit_count"].values  # y-values for the linear regression
-
-        try:
-            # Perform linear regression
-            slope, intercept, r_value, p_value, std_err = linregress(x, y)
-
-            # Store the results in the dictionary
-            results_lin[domain] = {
-                "slope": slope,
-                "intercept": intercept,
-                "r_value": r_value,
-                "p_value": p_value,
-                "std_err": std_err,
-            }
-        except Exception:
-            # Set coefficients and fit result to 0 for domains with errors
-            results_lin[domain] = {
-                "slope": 0,
-                "intercept": 0,
-                "r_value": 0,
-                "p_value": 0,
-                "std_err": 0,
-            }
-
-    # make a dataframe combinding both results dictionaries
-    results_df_exp = pd.DataFrame.from_dict(results_exp, orient="index")
-    results_df_lin = pd.DataFrame.from_dict(results_lin, orient="index")
+    # the exponential fits run in parallel, with their fit time and status
+    results_df_exp = curves.fit_exponentials(
+        {domain: group["visit_count"].values for domain, group in grouped}
+    )
+    # and the linear trends of all domains in one batch, over a domain x month matrix
+    results_df_lin = curves.fit_linear_trends(metrics.visit_matrix(df_sorted))
     results_df = pd.concat([results_df_exp, results_df_lin], axis=1)
-    results_df.columns = [
-        "coefficient_a",
-        "coefficient_b",
-        "coefficient_c",
-        "covariance_matrix",
-        "r_squared",
-        "slope",
-        "intercept",
-        "r_value",
-        "p_value",
-        "std_err",
-    ]
 
     # Create 'exp_curve' column, TRUE (if goodness > 0.3 AND if it is a growing curve), FALSE otherwise
     results_df["exp_curve"] = (results_df["r_squared"] > 0.3) & (
@@ -150,80 +66,42 @@ if __name__ == "__main__":
 
     print("Done calculating curve fits.")
 
-    print("Plotting charts...")
-
-    # For every domain, generate and save traffic chart with both exponential and linear curves
-    for domain, group in tqdm(grouped):
-        # Get the coefficients
-        a, b, c = results_df.loc[
-            domain, ["coefficient_a", "coefficient_b", "coefficient_c"]
-        ]
-
-        # Generate the curves
-        x = np.arange(len(group))
-        y_lin = (
-            results_df.loc[domain, "slope"] * x + results_df.loc[domain, "intercept"]
-        )
-        y_exp = exponential_curve(x, a, b, c)
-
-        # Plot the data and the curves as dashed lines
-        sns.set_style("whitegrid")
-
-        sns.lineplot(x=x, y=y_exp, color="red", alpha=0.5)
-        sns.lineplot(x=x, y=y_lin, color="purple", alpha=0.5)
-
-        sns.lineplot(x=x, y=group["visit_count"].values, color="blue")
-
-        # Add a title
-        plt.title(domain)
-
-        # Set x ticks to be the first day of every month
-        plt.xticks(
-            x, group["visit_date"].dt.strftime("%b '%y"), rotation=60, fontsize=8
-        )
-
-        # Add x and y labels
-        plt.xlabel("Date")
-        plt.ylabel("Visit Count")
-
-        # Save the plot
-        plt.savefig(
-            HS_SCORE_V2_DIR
-            + "_reengagement_traffic_report/charts/{}.png".format(domain)
-        )
-        plt.clf()
-        plt.close()
-
-    print("Done plotting charts.")
+    # the series and fits the chart stage (gen_reengagement_traffic_charts.py) draws
+    current_date = pd.to_datetime("today").strftime("%Y%m%d")
+    df_sorted[["domain", "visit_date", "visit_count"]].to_csv(
+        HS_SCORE_V2_DIR
+        + "_reengagement_traffic_report/metrics/reengagement_visits_{}.csv".format(
+            current_date
+        ),
+        index=False,
+    )
+    results_df[charts.FIT_COLS].to_csv(
+        HS_SCORE_V2_DIR
+        + "_reengagement_traffic_report/metrics/reengagement_fits_{}.csv".format(
+            current_date
+        ),
+        index_label="domain",
+    )
 
     print("Making growth flags...")
     # Calculate growth flags
-    grouped_df = (
-        traffic.groupby("domain")
-        .agg(
-            last_24_months_total=("visit_count", "sum"),
-            last_24_months_mean=("visit_count", "mean"),
-            last_3_months_mean=("visit_count", lambda x: x.tail(3).mean()),
-            mom_perc_growth=(
-                "visit_count",
-                lambda x: (x.iloc[-1] / x.iloc[-2] - 1) * 100,
-            ),
-            qoq_perc_growth=(
-                "visit_count",
-                lambda x: (x.iloc[-1] / x.iloc[-4] - 1) * 100,
-            ),
-            yoy_perc_growth=(
-                "visit_count",
-                lambda x: (x.iloc[-1] / x.iloc[-13] - 1) * 100,
-            ),
-        )
-        .reset_index()
-    )
+    # over a month-aligned domain x month matrix, NaN where a domain has no history
+    # to compare with
+    grouped_df = metrics.growth_metrics(metrics.dense_visits(traffic)).reset_index()
 
     # Combine metrics with the results_df
     all_calcs = pd.merge(
         grouped_df.copy(),
-        results_df[["r_squared", "exp_curve", "p_value", "lin_curve"]],
+        results_df[
+            [
+                "r_squared",
+                "exp_curve",
+                "fit_status",
+                "fit_seconds",
+                "p_value",
+                "lin_curve",
+            ]
+        ],
         left_on="domain",
         right_index=True,
     )
@@ -235,11 +113,7 @@ if __name__ == "__main__":
 
     # create bucketed column
     # last_3_months_mean_bucket = pd.cut(all_calcs['last_3_months_mean'], bins=[0, b1, b2, b3, np.inf], labels=['na', 'low', 'med', 'high'])
-    last_3_months_mean_bucket = pd.cut(
-        all_calcs["last_3_months_mean"],
-        bins=[0, 100, 200, 500, np.inf],
-        labels=["na", "low", "med", "high"],
-    )
+    last_3_months_mean_bucket = metrics.mean_buckets(all_calcs["last_3_months_mean"])
 
     # add bucketed column to dataframe
     all_calcs["last_3_months_mean_bucket"] = last_3_months_mean_bucket
@@ -290,7 +164,6 @@ if __name__ == "__main__":
 
     print("Writing to csv...")
     # write to csv
-    current_date = pd.to_datetime("today").strftime("%Y%m%d")
     final_df.to_csv(
         HS_SCORE_V2_DIR
         + "_reengagement_traffic_report/metrics/reengagement_metrics_{}.csv".format(
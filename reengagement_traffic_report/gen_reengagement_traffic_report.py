@@ -1,3 +1,4 @@
+import json
 import math
 import os
 from datetime import datetime
@@ -5,6 +6,7 @@ from datetime import datetime
 import pandas as pd
 from dotenv import load_dotenv
 from jinja2 import Environment, FileSystemLoader
+from context import charts
 
 load_dotenv()
 HS_SCORE_V2_DIR = os.getenv("HS_SCORE_V2_DIR")
@@ -36,10 +38,33 @@ traffic_metrics = traffic_metrics.sort_values(
     by=["exp_curve", "lin_curve"], ascending=False
 )
 
+# Read the series and fits written alongside the metrics, for the charts the page
+# draws itself
+visits = pd.read_csv(
+    HS_SCORE_V2_DIR
+    + "_reengagement_traffic_report/metrics/reengagement_visits_{}.csv".format(
+        current_date
+    ),
+    parse_dates=["visit_date"],
+)
+fits = pd.read_csv(
+    HS_SCORE_V2_DIR
+    + "_reengagement_traffic_report/metrics/reengagement_fits_{}.csv".format(
+        current_date
+    ),
+    index_col="domain",
+)
+fits = fits[fits.index.isin(traffic_metrics["domain"])]
+
+# one compact JSON payload, with "</" escaped so it can't close its script tag
+chart_data = json.dumps(
+    charts.chart_data(visits, fits), separators=(",", ":"), allow_nan=False
+).replace("</", "<\\/")
+
 date = datetime.now().strftime("%d %b %Y")
 
 # Render the template with the data
-rendered_html = template.render(date=date, data=traffic_metrics)
+rendered_html = template.render(date=date, data=traffic_metrics, chart_data=chart_data)
 
 # Save the rendered HTML to a file
 with open(
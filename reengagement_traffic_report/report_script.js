@@ -103,4 +103,133 @@ function filterTable() {
             row.style.display = "none";
         }
     }
-}
\ No newline at end of file
+}
+
+// Charts are drawn from the JSON payload in #chart-data, the first time each one
+// is shown and scrolled into view
+var chartData = JSON.parse(document.getElementById("chart-data").textContent);
+
+var chartObserver = new IntersectionObserver(function(entries, observer) {
+    for (const entry of entries) {
+        if (entry.isIntersecting) {
+            drawChart(entry.target);
+            observer.unobserve(entry.target);
+        }
+    }
+}, { rootMargin: "200px" });
+
+var chartCanvases = document.getElementsByClassName("chart");
+for (var i = 0; i < chartCanvases.length; i++) {
+    chartObserver.observe(chartCanvases[i]);
+}
+
+function exponentialCurve(x, a, b, c) {
+    return a * Math.exp(-b * x) + c;
+}
+
+function isPlottable(value) {
+    return value !== null && isFinite(value);
+}
+
+function drawChart(canvas) {
+    var series = chartData.domains[canvas.getAttribute("data-domain")];
+    if (!series) {
+        return;
+    }
+    var fit = series.f;
+    var x = series.v.map(function(_, i) { return i; });
+    // the fitted curves, then the visits over them
+    var exponential = x.map(function(i) {
+        return exponentialCurve(i, fit[0], fit[1], fit[2]);
+    });
+    var linear = x.map(function(i) {
+        return fit[3] * i + fit[4];
+    });
+    var lines = [
+        { color: "rgba(255, 0, 0, 0.5)", y: exponential },
+        { color: "rgba(128, 0, 128, 0.5)", y: linear },
+        { color: "blue", y: series.v },
+    ];
+
+    var left = 70, right = 20, top = 30, bottom = 70;
+    var width = canvas.width - left - right;
+    var height = canvas.height - top - bottom;
+    var values = exponential.concat(linear, series.v).filter(isPlottable);
+    var yMin = Math.min.apply(null, values);
+    var yMax = Math.max.apply(null, values);
+    if (!values.length) {
+        yMin = 0;
+        yMax = 1;
+    } else if (yMin === yMax) {
+        yMin -= 1;
+        yMax += 1;
+    }
+    function px(i) {
+        return left + (x.length > 1 ? i / (x.length - 1) : 0.5) * width;
+    }
+    function py(y) {
+        return top + (1 - (y - yMin) / (yMax - yMin)) * height;
+    }
+
+    var ctx = canvas.getContext("2d");
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+    ctx.font = "10px sans-serif";
+    ctx.fillStyle = "black";
+    ctx.lineWidth = 1;
+
+    // horizontal grid lines with the visit counts
+    ctx.strokeStyle = "#e5e5e5";
+    ctx.textAlign = "right";
+    ctx.textBaseline = "middle";
+    for (var tick = 0; tick <= 4; tick++) {
+        var value = yMin + tick * (yMax - yMin) / 4;
+        ctx.beginPath();
+        ctx.moveTo(left, py(value));
+        ctx.lineTo(left + width, py(value));
+        ctx.stroke();
+        ctx.fillText(Math.round(value).toLocaleString(), left - 6, py(value));
+    }
+
+    // a month label under each point
+    for (var i = 0; i < x.length; i++) {
+        ctx.save();
+        ctx.translate(px(i), top + height + 8);
+        ctx.rotate(-Math.PI / 3);
+        ctx.fillText(chartData.months[series.m[i]], 0, 0);
+        ctx.restore();
+    }
+
+    ctx.lineWidth = 1.5;
+    for (const line of lines) {
+        ctx.strokeStyle = line.color;
+        ctx.beginPath();
+        var drawing = false;
+        for (var j = 0; j < x.length; j++) {
+            if (!isPlottable(line.y[j])) {
+                drawing = false;
+                continue;
+            }
+            if (drawing) {
+                ctx.lineTo(px(j), py(line.y[j]));
+            } else {
+                ctx.moveTo(px(j), py(line.y[j]));
+            }
+            drawing = true;
+        }
+        ctx.stroke();
+    }
+
+    // title and axis labels
+    ctx.textAlign = "center";
+    ctx.textBaseline = "top";
+    ctx.font = "12px sans-serif";
+    ctx.fillText(canvas.getAttribute("data-domain"), left + width / 2, 8);
+    ctx.textBaseline = "bottom";
+    ctx.fillText("Date", left + width / 2, canvas.height - 4);
+    ctx.save();
+    ctx.translate(12, top + height / 2);
+    ctx.rotate(-Math.PI / 2);
+    ctx.textBaseline = "top";
+    ctx.fillText("Visit Count", 0, 0);
+    ctx.restore();
+}
@@ -1,6 +1,6 @@
 import pandas as pd
 from datetime import datetime
-from context import cnx
+from context import cnx, bulk, scores, tiers
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
@@ -35,6 +35,26 @@ roles_query = """
     SPC_GEO
 )
 
+# same as above, for when the role flags are handed over in memory
+roles_handoff_query = """
+    select
+         r.role_title
+        , r.linkedin_role_description
+        , r.role_start
+        , r.role_end
+        , r.role_id
+        , c."name" as company_name
+    from roles r
+    left join companies c on c.company_id = r.company_id
+    where r.person_id in (
+        select distinct person_id
+        from score_v2.person_locations
+        where spc_geo = '{}'
+        )
+""".format(
+    SPC_GEO
+)
+
 delete_role_scores_query = """
     DO
     $$
@@ -54,29 +74,21 @@ delete_role_scores_query = """
 )
 
 
-def calc_role_score(row):
-    role_score = 0
-    # calculate tenure of role
-    if row["tenure"] < 365:
-        return 0
-
-    if row["is_tier_company"] and row["seniority"] != "junior":
-        role_score += 1
-
-    if row["seniority"] in ["exec", "senior"]:
-        role_score *= 2
-
-    return role_score
-
-
-if __name__ == "__main__":
+def run(conn, role_flags=None, raw_roles=None):
     print("[{}] Starting role_score_{}.py".format(datetime.now(), SPC_GEO.lower()))
-    conn = cnx.Cnx
 
-    # pull roles with flags and company names / domains
-    print("[{}] Pulling roles".format(datetime.now()))
-    raw_roles = pd.read_sql_query(roles_query, conn)
-    print("[{}] Done pulling roles. Pulled: {}".format(datetime.now(), len(raw_roles)))
+    # pull roles with flags and company names / domains, unless already pulled
+    if raw_roles is None:
+        print("[{}] Pulling roles".format(datetime.now()))
+        if role_flags is None:
+            raw_roles = pd.read_sql_query(roles_query, conn)
+        else:
+            raw_roles = pd.read_sql_query(roles_handoff_query, conn).merge(
+                role_flags, on="role_id", how="left"
+            )
+        print(
+            "[{}] Done pulling roles. Pulled: {}".format(datetime.now(), len(raw_roles))
+        )
     roles = raw_roles.copy()
 
     print("[{}] Cleaning data".format(datetime.now()))
@@ -86,13 +98,12 @@ if __name__ == "__main__":
     roles["role_end"].fillna(datetime.now(), inplace=True)
     roles["tenure"] = (roles["role_end"] - roles["role_start"]).dt.days
 
-    # check if company_name is in tier list
-    company_df = pd.read_csv(COMPANY_LIST_PATH)
-    company_list = company_df["company_name"].str.lower().tolist()
-    roles["is_tier_company"] = roles["company_name"].str.lower().isin(company_list)
+    # check if company_name is in tier list, allowing for variants of the name
+    company_index = tiers.load_index(COMPANY_LIST_PATH, "company_name")
+    roles["is_tier_company"] = tiers.is_tier(roles["company_name"], company_index)
 
     print("[{}] Calculating role score".format(datetime.now()))
-    roles["role_score"] = roles.apply(calc_role_score, axis=1)
+    roles["role_score"] = scores.calc_role_scores(roles)
     to_write = roles[["role_id", "role_score"]]
 
     # write to db
@@ -110,7 +121,13 @@ if __name__ == "__main__":
     print("[{}] Writing to db".format(datetime.now()))
     to_write["generated_at"] = datetime.now()
     to_write["spc_geo"] = SPC_GEO
-    write_res = to_write.to_sql(
-        "role_scores", conn, if_exists="append", index=False, schema="score_v2"
+    write_res = bulk.copy_to_sql(
+        to_write, "role_scores", conn, if_exists="append", schema="score_v2"
     )
     print("[{}] Done writing to db".format(datetime.now()))
+
+    return roles[["role_id", "role_score"]]
+
+
+if __name__ == "__main__":
+    run(cnx.Cnx)
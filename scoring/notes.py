@@ -0,0 +1,180 @@
+import numpy as np
+import pandas as pd
+
+import scoring.scores as scores
+
+# Renders the Affinity notes of a whole frame at once. Each note is put together
+# from whole columns of text with numpy's elementwise string concatenation, and
+# the lines of each company's founders are joined with one add.reduceat over the
+# exploded founder lists.
+#
+# Haystack scores keep their breakdown rather than a note, with the founders as
+# jsonb, and the note is only rendered for the companies that are uploaded.
+
+# each founder in haystack_scores.founders, a jsonb list per company
+FOUNDER_FIELDS = ['person_id', 'full_name', 'description', 'linkedin_url']
+
+# a stealth description is cut to this many characters
+DESCRIPTION_LENGTH = 200
+
+
+def strings(values):
+    # str of each value, as format would give. astype(str) would leave missing
+    # values missing under pandas' string dtype, where format gives None or nan.
+    return np.array([str(value) for value in values], dtype=object)
+
+
+def fixed(values):
+    # each value to two decimal places, as {:.2f}
+    return np.char.mod('%.2f', values.to_numpy(dtype=float)).astype(object)
+
+
+def concat(*parts):
+    # elementwise concatenation of columns and plain strings
+    joined = parts[0]
+    for part in parts[1:]:
+        joined = joined + part
+    return joined
+
+
+def when(mask, values, otherwise=''):
+    return np.where(mask, values, otherwise).astype(object)
+
+
+def or_null(values):
+    # missing values as None, stored as JSON null. The per-row notes printed a
+    # NaN name or url as "nan"; it's now left out, as None always was.
+    return values.astype(object).where(values.notna(), None)
+
+
+def founder_records(founders):
+    # company_id -> the list of its founders stored in haystack_scores.founders,
+    # in the order they're in in founders
+    founders = founders[founders['company_id'].notna()].sort_values(
+        'company_id', kind='mergesort'
+    )
+    records = [
+        dict(zip(FOUNDER_FIELDS, values))
+        for values in zip(*(or_null(founders[field]) for field in FOUNDER_FIELDS))
+    ]
+    company_ids, starts = np.unique(founders['company_id'], return_index=True)
+    ends = np.append(starts[1:], len(records))
+    return pd.Series(
+        [records[start:end] for start, end in zip(starts, ends)],
+        index=company_ids,
+        dtype=object,
+    )
+
+
+def founder_lines(founders):
+    # each company's founder summaries and linkedin urls. A company without
+    # founders gets one empty founder.
+    founders = pd.Series(
+        [
+            value if isinstance(value, list) and len(value) > 0 else [{}]
+            for value in founders
+        ],
+        dtype=object,
+    )
+    lengths = founders.str.len().to_numpy()
+    fields = pd.DataFrame(list(founders.explode()), columns=FOUNDER_FIELDS)
+
+    names, summaries, urls = (
+        or_null(fields[field]) for field in ['full_name', 'description', 'linkedin_url']
+    )
+    summary_pieces = concat(
+        when(scores.truthy(names), concat('\n  ', strings(names))),
+        when(scores.truthy(summaries), concat(': ', strings(summaries), ' ')),
+    )
+    url_pieces = when(scores.truthy(urls), concat('\n  ', strings(urls)))
+
+    starts = np.cumsum(lengths) - lengths
+    return (
+        np.add.reduceat(summary_pieces, starts),
+        np.add.reduceat(url_pieces, starts),
+    )
+
+
+def hs_notes(companies, date_generated):
+    # the note of each scored company, from its founders (founder_records) and
+    # score breakdown. date_generated is a string or a column of them.
+    if companies.empty:
+        return pd.Series([], index=companies.index, dtype=object)
+    founder_summaries, linkedin_urls = founder_lines(companies['founders'])
+    traffic_priority = companies['is_traffic_priority']
+    notes = concat(
+        'Founder Summaries: ',
+        founder_summaries,
+        '\n\nFounder LinkedIn URLs: ',
+        linkedin_urls,
+        '\n\n------\n\nHaystack Score: ',
+        fixed(companies['hs_score_v2']),
+        '\nHaystack Breakdown:\n    Mean Founder Score: ',
+        fixed(companies['founder_score_mean']),
+        '\n    Is Sweetspot Company: ',
+        strings(companies['is_sweetspot_company']),
+        '\n    Is Traffic Priority: ',
+        when(traffic_priority.notna(), strings(traffic_priority), 'No data'),
+        '\n\nHaystack Company ID: ',
+        strings(companies['company_id']),
+        '\nDate Generated: ',
+        np.asarray(date_generated, dtype=object),
+        '\n',
+    )
+    return pd.Series(notes, index=companies.index, dtype=object)
+
+
+def or_none(values):
+    # missing values of text columns read as "None". A float column's NaNs are
+    # written as they are.
+    if values.dtype.kind == 'f':
+        return strings(values)
+    return when(values.isna(), 'None', strings(values))
+
+
+def truncated(values):
+    # descriptions cut to DESCRIPTION_LENGTH characters, with "None" for empty
+    # ones
+    is_empty = values.isna() | ~scores.truthy(values)
+    text = values.where(~is_empty, '').astype(str)
+    is_long = text.str.len() > DESCRIPTION_LENGTH
+    return when(
+        is_empty,
+        'None',
+        when(
+            is_long,
+            concat(strings(text.str.slice(0, DESCRIPTION_LENGTH)), '...'),
+            strings(text),
+        ),
+    )
+
+
+def stealth_notes(stealth, date_generated):
+    # the note of each stealth founder
+    if stealth.empty:
+        return pd.Series([], index=stealth.index, dtype=object)
+    role_start = stealth['role_start']
+    notes = concat(
+        'Haystack Summary: ',
+        or_none(stealth['description']),
+        '\nStealth Start Date: ',
+        when(
+            role_start.notna(),
+            strings(pd.to_datetime(role_start).dt.strftime('%b %Y')),
+            'None',
+        ),
+        '\nStealth Role Description: ',
+        truncated(stealth['linkedin_role_description']),
+        '\nLinkedIn Description: ',
+        truncated(stealth['linkedin_summary']),
+        '\nLinkedIn URL: ',
+        or_none(stealth['linkedin_url']),
+        '\n\n------\n\nFounder Score: ',
+        fixed(stealth['score']),
+        '\nHaystack Person ID: ',
+        strings(stealth['person_id']),
+        '\nDate Generated: ',
+        date_generated,
+        '\n',
+    )
+    return pd.Series(notes, index=stealth.index, dtype=object)
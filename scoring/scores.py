@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+
+# Column-wise scoring rules, shared by every geo's score stages. A heuristic
+# changed here changes the scores of every geo, not just the one being tuned.
+
+
+def truthy(values: pd.Series) -> np.ndarray:
+    # python truthiness, as the rules were applied row by row: None is false but
+    # NaN (a flag missing after a merge) is true
+    return values.to_numpy().astype(bool)
+
+
+def calc_role_scores(roles: pd.DataFrame) -> np.ndarray:
+    # roles held for under a year don't score
+    is_tenured = ~(roles['tenure'] < 365).to_numpy()
+    is_tier = truthy(roles['is_tier_company']) & (roles['seniority'] != 'junior')
+    is_senior = roles['seniority'].isin(['exec', 'senior'])
+
+    role_scores = np.where(is_tier, 1, 0)
+    role_scores = np.where(is_senior, role_scores * 2, role_scores)
+    return np.where(is_tenured, role_scores, 0)
+
+
+def calc_education_scores(educations: pd.DataFrame) -> np.ndarray:
+    is_postgrad = truthy(educations['is_phd']) | truthy(educations['is_masters'])
+
+    education_scores = np.where(truthy(educations['is_tier_school']), 1, 0)
+    education_scores = np.where(is_postgrad, education_scores * 2, education_scores)
+    return np.where(truthy(educations['is_irrelevant']), 0, education_scores)
+
+
+def or_na(values: pd.Series) -> pd.Series:
+    # None, NaN and empty text read as N/A
+    return values.where(values.notna() & (values != ''), 'N/A')
+
+
+def describe(what: pd.Series, where: pd.Series) -> pd.Series:
+    return or_na(what) + ' @ ' + or_na(where)
+
+
+def sum_scores(scores: pd.DataFrame, separator: str) -> pd.DataFrame:
+    # each person's total score and their descriptions joined in order, the same
+    # as groupby('person_id').agg({'score': 'sum', 'description': list}) and a
+    # join, but with one add.reduceat over the rows sorted by person
+    scores = scores.sort_values('person_id', kind='mergesort')
+    person_ids = scores['person_id'].to_numpy()
+    if not len(person_ids):
+        return pd.DataFrame(
+            {
+                'person_id': person_ids,
+                'score': scores['score'].to_numpy(),
+                'description': [],
+            }
+        )
+    is_first = np.ones(len(person_ids), dtype=bool)
+    is_first[1:] = person_ids[1:] != person_ids[:-1]
+    starts = np.flatnonzero(is_first)
+
+    descriptions = scores['description'].to_numpy(dtype=object)
+    pieces = np.where(is_first, descriptions, separator + descriptions)
+    return pd.DataFrame(
+        {
+            'person_id': person_ids[starts],
+            'score': np.add.reduceat(scores['score'].to_numpy(), starts),
+            'description': np.add.reduceat(pieces, starts),
+        }
+    )
@@ -0,0 +1,182 @@
+import os
+import re
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Fuzzy matching of company / school names against a tier list. The list is
+# indexed once by the trigrams of its normalised names, and every distinct name
+# being matched is scored against the whole list in one sparse count, instead of
+# comparing each name with each list entry.
+
+# grams are the distinct trigram codes of the list names, sorted, and the names
+# each one appears in are gram_names[gram_starts[i] : gram_starts[i + 1]]
+Index = namedtuple(
+    'Index', ['names', 'exact', 'grams', 'gram_starts', 'gram_names', 'sizes']
+)
+
+# names at or above this score are taken to be on the list
+MATCH_THRESHOLD = 0.85
+
+# legal entity words that are dropped from either end of a name, so "Atlassian
+# Pty Ltd" and "PT Bukalapak" match "Atlassian" and "Bukalapak"
+LEGAL_WORDS = {
+    'ag',
+    'bhd',
+    'bv',
+    'co',
+    'corp',
+    'corporation',
+    'gmbh',
+    'inc',
+    'incorporated',
+    'limited',
+    'llc',
+    'ltd',
+    'plc',
+    'pt',
+    'pte',
+    'pty',
+    'sdn',
+    'tbk',
+}
+
+NOT_WORD = re.compile(r'[^0-9a-z]+')
+
+# distinct names scored per block, which bounds the size of the count matrix
+BLOCK_SIZE = 10000
+
+# (path, column, modified time) -> Index of the lists loaded in this process, so
+# the stages of each geo in a multi-geo run share them
+loaded_indexes = {}
+
+
+def normalise(name):
+    tokens = NOT_WORD.sub(' ', name.lower()).split()
+    start, end = 0, len(tokens)
+    while end - start > 1 and tokens[end - 1] in LEGAL_WORDS:
+        end -= 1
+    while end - start > 1 and tokens[start] in LEGAL_WORDS:
+        start += 1
+    # names without any letters or digits are compared as they are
+    return ' '.join(tokens[start:end]) or name.lower().strip()
+
+
+def within_group(counts):
+    # 0, 1, .. counts[i] - 1 for each group in turn
+    return np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+
+def key_trigrams(keys):
+    # the distinct trigrams of each key, padded with a space at each end, as
+    # (key, trigram code) pairs. Each code packs the trigram's three characters.
+    padded = [' {} '.format(key) for key in keys]
+    lengths = np.array([len(key) for key in padded], dtype=np.int64)
+    chars = np.frombuffer(''.join(padded).encode('utf-32-le'), dtype=np.uint32)
+    chars = chars.astype(np.int64)
+    n_grams = lengths - 2
+    positions = np.repeat(np.cumsum(lengths) - lengths, n_grams) + within_group(n_grams)
+    codes = (
+        (chars[positions] << 42) | (chars[positions + 1] << 21) | chars[positions + 2]
+    )
+    rows = np.repeat(np.arange(len(keys)), n_grams)
+    # the trigrams renumbered over the characters actually used, small enough to
+    # combine with the key in one sortable number
+    _, ranks = np.unique(chars, return_inverse=True)
+    n_chars = ranks.max() + 1 if len(ranks) else 1
+    local_codes = ranks[positions]
+    for offset in (1, 2):
+        local_codes = local_codes * n_chars + ranks[positions + offset]
+    _, first = np.unique(rows * n_chars**3 + local_codes, return_index=True)
+    return rows[first], codes[first]
+
+
+def build_index(names):
+    names = list(pd.unique(pd.Series(names).dropna()))
+    keys = [normalise(name) for name in names]
+    rows, codes = key_trigrams(keys)
+    grams, gram_ids = np.unique(codes, return_inverse=True)
+    order = np.argsort(gram_ids, kind='stable')
+    return Index(
+        names,
+        # the first of any names that normalise the same
+        {key: i for i, key in reversed(list(enumerate(keys)))},
+        grams,
+        np.searchsorted(gram_ids[order], np.arange(len(grams) + 1)),
+        rows[order],
+        np.bincount(rows, minlength=len(names)),
+    )
+
+
+def load_index(path, column):
+    key = (os.path.abspath(path), column, os.path.getmtime(path))
+    if key not in loaded_indexes:
+        loaded_indexes[key] = build_index(pd.read_csv(path)[column])
+    return loaded_indexes[key]
+
+
+def score_keys(keys, index):
+    # the best dice similarity of each key's trigrams to a list name's, and which
+    # list name it was
+    scores = np.zeros(len(keys))
+    best = np.full(len(keys), -1, dtype=np.int64)
+    n_names = len(index.names)
+    if not n_names or not len(keys):
+        return scores, best
+
+    for block_start in range(0, len(keys), BLOCK_SIZE):
+        block = keys[block_start : block_start + BLOCK_SIZE]
+        rows, codes = key_trigrams(block)
+        sizes = np.bincount(rows, minlength=len(block))
+        grams = np.minimum(np.searchsorted(index.grams, codes), len(index.grams) - 1)
+        is_known = index.grams[grams] == codes
+        rows, grams = rows[is_known], grams[is_known]
+
+        # every list name sharing each trigram, counted per (key, name)
+        n_postings = index.gram_starts[grams + 1] - index.gram_starts[grams]
+        posting_names = index.gram_names[
+            np.repeat(index.gram_starts[grams], n_postings) + within_group(n_postings)
+        ]
+        shared = np.bincount(
+            np.repeat(rows, n_postings) * n_names + posting_names,
+            minlength=len(block) * n_names,
+        ).reshape(len(block), n_names)
+
+        dice = 2 * shared / (sizes[:, None] + index.sizes[None, :])
+        block_best = dice.argmax(axis=1)
+        block_scores = dice[np.arange(len(block)), block_best]
+        scores[block_start : block_start + len(block)] = block_scores
+        best[block_start : block_start + len(block)] = np.where(
+            block_scores > 0, block_best, -1
+        )
+    return scores, best
+
+
+def match_scores(values, index):
+    # the closest tier list name to each value and its score, from 0 to 1. A name
+    # equal to a list name once normalised scores 1, null values score NaN
+    codes, uniques = pd.factorize(values.to_numpy(dtype=object))
+    keys = [normalise(value) for value in uniques]
+    exact = np.array([index.exact.get(key, -1) for key in keys], dtype=np.int64)
+
+    scores = np.where(exact >= 0, 1.0, 0.0)
+    best = exact.copy()
+    fuzzy = np.flatnonzero(exact < 0)
+    scores[fuzzy], best[fuzzy] = score_keys([keys[i] for i in fuzzy], index)
+
+    is_null = codes == -1
+    matched_names = np.full(len(codes), -1, dtype=np.int64)
+    matched_names[~is_null] = best[codes[~is_null]]
+    matched_scores = np.full(len(codes), np.nan)
+    matched_scores[~is_null] = scores[codes[~is_null]]
+    # -1, no match, picks the trailing None
+    names = np.array(index.names + [None], dtype=object)
+    return pd.DataFrame(
+        {'tier_name': names[matched_names], 'tier_score': matched_scores},
+        index=values.index,
+    )
+
+
+def is_tier(values, index, threshold=MATCH_THRESHOLD):
+    return match_scores(values, index)['tier_score'] >= threshold
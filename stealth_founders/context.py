@@ -4,3 +4,5 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 import db.cnx as cnx
+import stealth_founders.crm_index as crm_index
+import scoring.notes as notes
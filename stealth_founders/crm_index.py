@@ -0,0 +1,98 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+# Substring lookups of names in the CRM. The normalised CRM names are joined into
+# one text with a suffix array over it: the start of every suffix, in sorted
+# order. The CRM names containing a candidate are the suffixes starting with it,
+# a single range of the array found by binary search, comparing the text at each
+# start on the fly. The index is a few int arrays the length of the text, however
+# long a CRM name is.
+
+Index = namedtuple('Index', ['names', 'text', 'suffixes', 'starts'])
+
+# ends each name in the text, and never appears in a normalised name, so no match
+# runs on into the next name
+SEPARATOR = '\x00'
+
+
+def normalise(name):
+    # all symbols and whitespace stripped, and lower-cased
+    return ''.join(e for e in name if e.isalnum()).lower()
+
+
+def suffix_array(text):
+    # the starts of text's suffixes in sorted order, by prefix doubling: ranked by
+    # their first character, then by their first 2k characters from the ranks of
+    # their two k character halves, until every rank is distinct
+    n = len(text)
+    chars = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    rank = np.unique(chars, return_inverse=True)[1].astype(np.int64)
+    order = np.arange(n, dtype=np.int64)
+    k = 1
+    while n:
+        # a suffix's rank and the rank k characters on, as one sort key. Shorter
+        # suffixes have no second half and sort first.
+        second = np.zeros(n, dtype=np.int64)
+        second[: max(n - k, 0)] = rank[k:] + 1
+        pairs = rank * (n + 1) + second
+        order = np.argsort(pairs, kind='stable')
+        differs = np.ones(n, dtype=bool)
+        differs[1:] = np.diff(pairs[order]) != 0
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.cumsum(differs) - 1
+        if differs.all():
+            break
+        k *= 2
+    return order
+
+
+def build_index(names):
+    names = list(pd.unique(pd.Series(names).dropna()))
+    keys = [normalise(name) + SEPARATOR for name in names]
+    lengths = np.array([len(key) for key in keys], dtype=np.int64)
+    starts = np.zeros(len(keys), dtype=np.int64)
+    starts[1:] = np.cumsum(lengths)[:-1]
+    text = ''.join(keys)
+    return Index(names, text, suffix_array(text), starts)
+
+
+def suffix_range(key, index):
+    # the run of the suffix array whose suffixes start with key
+    text, suffixes, length = index.text, index.suffixes, len(key)
+    lo, hi = 0, len(suffixes)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = suffixes[mid]
+        if text[start : start + length] < key:
+            lo = mid + 1
+        else:
+            hi = mid
+    first, hi = lo, len(suffixes)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start = suffixes[mid]
+        if text[start : start + length] <= key:
+            lo = mid + 1
+        else:
+            hi = mid
+    return first, lo
+
+
+def find_names(candidates, index):
+    # the CRM names each of the candidates is a substring of, once normalised. An
+    # empty candidate is in every name.
+    found = []
+    for candidate in candidates:
+        key = normalise(candidate)
+        if not key:
+            found.append(list(index.names))
+            continue
+        first, last = suffix_range(key, index)
+        matched = np.unique(
+            np.searchsorted(index.starts, index.suffixes[first:last], side='right')
+            - 1
+        )
+        found.append([index.names[i] for i in matched])
+    return found
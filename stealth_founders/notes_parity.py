@@ -0,0 +1,106 @@
+import sys
+import numpy as np
+import pandas as pd
+from context import cnx, notes
+from datetime import datetime
+
+import stealth_anz
+import stealth_isr
+import stealth_sea
+
+# Checks that notes.stealth_notes renders the same notes as the per-row
+# create_stealth_note_string it replaced, on each geo's stealth founders as the
+# stealth stage pulls them. The old renderer raised on a missing role_start, so
+# those founders aren't compared.
+
+STEALTH_STAGES = [stealth_anz, stealth_isr, stealth_sea]
+
+
+# the renderer as it was in stealth_*, with the date it wrote passed in
+def truncate_linkedin_description(description):
+    if description and (description is not np.nan):
+        if len(description) > 200:
+            return description[:200] + "..."
+        else:
+            return description
+    else:
+        return "None"
+
+
+def create_stealth_note_string(row, date_generated):
+    note = """Haystack Summary: {founder_summary}
+Stealth Start Date: {role_start}
+Stealth Role Description: {role_description}
+LinkedIn Description: {linkedin_summary}
+LinkedIn URL: {linkedin_url}
+
+------
+
+Founder Score: {founder_score:.2f}
+Haystack Person ID: {person_id}
+Date Generated: {date_generated}
+"""
+
+    founder_summary = row["description"] if row["description"] is not np.nan else "None"
+    role_start = (
+        row["role_start"].strftime("%b %Y")
+        if row["role_start"] is not np.nan
+        else "None"
+    )
+    linkedin_summary = truncate_linkedin_description(row["linkedin_summary"])
+    role_description = truncate_linkedin_description(row["linkedin_role_description"])
+    linkedin_url = row["linkedin_url"] if row["linkedin_url"] is not np.nan else "None"
+
+    note = note.format(
+        founder_summary=founder_summary,
+        role_start=role_start,
+        linkedin_summary=linkedin_summary,
+        role_description=role_description,
+        linkedin_url=linkedin_url,
+        founder_score=row["score"],
+        person_id=row["person_id"],
+        date_generated=date_generated,
+    )
+
+    return note
+
+
+def report(name, frame, expected, actual):
+    differs = np.flatnonzero(expected.to_numpy() != actual.to_numpy())
+    for i in differs[:3]:
+        print("[{}] {} mismatch:\n{}".format(datetime.now(), name, frame.iloc[i]))
+        print("--- old ---\n{}--- new ---\n{}".format(expected.iloc[i], actual.iloc[i]))
+    print(
+        "[{}] Checked {}: {}, mismatches: {}".format(
+            datetime.now(), name, len(frame), len(differs)
+        )
+    )
+    return len(differs)
+
+
+def run(conn):
+    print("[{}] Checking stealth note rendering parity".format(datetime.now()))
+    n_mismatches = 0
+    for stage in STEALTH_STAGES:
+        stealth = pd.read_sql_query(stage.hs_stealth_query, conn)
+        stealth = stealth[stealth["role_start"].notna()]
+        date_generated = stage.CURRENT_DATE_WITH_DASH_STRING
+        expected = pd.Series(
+            [
+                create_stealth_note_string(row, date_generated)
+                for _, row in stealth.iterrows()
+            ],
+            index=stealth.index,
+            dtype=object,
+        )
+        n_mismatches += report(
+            "{} stealth notes".format(stage.SPC_GEO),
+            stealth,
+            expected,
+            notes.stealth_notes(stealth, date_generated),
+        )
+    return n_mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(1 if run(cnx.Cnx) else 0)
@@ -1,7 +1,6 @@
 import pandas as pd
 from datetime import datetime, timedelta
-from context import cnx
-import numpy as np
+from context import cnx, crm_index, notes
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
@@ -49,6 +48,30 @@ hs_stealth_query = """
     WEEK_START_DATE_WITH_DASH_STRING, SPC_GEO
 )
 
+# same as above, for when the person scores are handed over in memory
+stealth_roles_query = """
+    select 
+        p.linkedin_url
+        , p.full_name
+        , r.role_start
+        , p.linkedin_summary
+        , r.linkedin_role_description
+        , r.last_scraped_at
+        , r.person_id
+    from roles r
+        left join persons p on p.person_id = r.person_id
+        where r.is_stealth_role = TRUE
+        and r.role_end is NULL
+        and r.last_scraped_at > '{}'
+        and r.person_id in (
+            select distinct person_id
+            from score_v2.person_locations
+            where spc_geo = '{}'
+        )
+    """.format(
+    WEEK_START_DATE_WITH_DASH_STRING, SPC_GEO
+)
+
 crm_name_query = """
     select 
         "name" as organisation_name 
@@ -60,54 +83,6 @@ crm_name_query = """
 
 
 # helper functions
-def truncate_linkedin_description(description):
-    if description and (description is not np.nan):
-        if len(description) > 200:
-            return description[:200] + "..."
-        else:
-            return description
-    else:
-        return "None"
-
-
-def create_stealth_note_string(row):
-    note = """Haystack Summary: {founder_summary}
-Stealth Start Date: {role_start}
-Stealth Role Description: {role_description}
-LinkedIn Description: {linkedin_summary}
-LinkedIn URL: {linkedin_url}
-
-------
-
-Founder Score: {founder_score:.2f}
-Haystack Person ID: {person_id}
-Date Generated: {date_generated}
-"""
-
-    founder_summary = row["description"] if row["description"] is not np.nan else "None"
-    role_start = (
-        row["role_start"].strftime("%b %Y")
-        if row["role_start"] is not np.nan
-        else "None"
-    )
-    linkedin_summary = truncate_linkedin_description(row["linkedin_summary"])
-    role_description = truncate_linkedin_description(row["linkedin_role_description"])
-    linkedin_url = row["linkedin_url"] if row["linkedin_url"] is not np.nan else "None"
-
-    note = note.format(
-        founder_summary=founder_summary,
-        role_start=role_start,
-        linkedin_summary=linkedin_summary,
-        role_description=role_description,
-        linkedin_url=linkedin_url,
-        founder_score=row["score"],
-        person_id=row["person_id"],
-        date_generated=CURRENT_DATE_WITH_DASH_STRING,
-    )
-
-    return note
-
-
 def create_name(row):
     if row["full_name"]:
         # strip all symbols and whitespace from full name
@@ -118,7 +93,7 @@ def create_name(row):
 
 
 # SCRIPT
-if __name__ == "__main__":
+def run(conn, person_scores=None):
     print("[{}] Running stealth_{}.py...".format(datetime.now(), SPC_GEO.lower()))
     print("[{}] Current date: {}".format(datetime.now(), CURRENT_DATE_STRING))
     print(
@@ -127,11 +102,17 @@ if __name__ == "__main__":
         )
     )
 
-    conn = cnx.Cnx
-
     # pull sea stealth founders
     print("[{}] Getting data...".format(datetime.now()))
-    raw_stealth = pd.read_sql_query(hs_stealth_query, conn)
+    if person_scores is None:
+        raw_stealth = pd.read_sql_query(hs_stealth_query, conn)
+    else:
+        scored = person_scores[
+            (person_scores["score"] > 0) & (person_scores["spc_geo"] == SPC_GEO)
+        ]
+        raw_stealth = pd.read_sql_query(stealth_roles_query, conn).merge(
+            scored[["person_id", "description", "score", "spc_geo"]], on="person_id"
+        )
     print("[{}] Done pulling data. Rows: {}".format(datetime.now(), len(raw_stealth)))
 
     # generate notes
@@ -141,9 +122,9 @@ if __name__ == "__main__":
     # if there are no rows, return early
     if len(stealth) == 0:
         print("[{}] No rows to process. Exiting.".format(datetime.now()))
-        exit()
+        return
 
-    stealth["notes"] = stealth.apply(create_stealth_note_string, axis=1)
+    stealth["notes"] = notes.stealth_notes(stealth, CURRENT_DATE_WITH_DASH_STRING)
     print("[{}] Done generating notes.".format(datetime.now()))
 
     # format for affinity upload
@@ -162,25 +143,22 @@ if __name__ == "__main__":
 
     # exclude stealth companies that are already in the CRM
     print("[{}] Excluding stealth companies already in CRM...".format(datetime.now()))
-    # strip all symbols, whitespace, and lowercase from crm names
+    # index the normalised crm names (all symbols and whitespace stripped, and
+    # lowercased) by their suffixes
     crm_names = pd.read_sql_query(crm_name_query, conn)
-    crm_names["organisation_name"] = crm_names["organisation_name"].apply(
-        lambda x: "".join(e for e in x if e.isalnum()).lower()
-    )
-    crm_name_string = crm_names["organisation_name"].tolist()
-    crm_name_string = "|".join(crm_name_string)
+    crm_names_index = crm_index.build_index(crm_names["organisation_name"])
 
     # check if full_name is a substring of any crm name
     stealth_upload["match_name"] = stealth_upload["match_name"].apply(
-        lambda x: "".join(e for e in x if e.isalnum()).lower()
-    )
-    stealth_upload["to_exclude"] = stealth_upload["match_name"].apply(
-        lambda x: x in crm_name_string
+        crm_index.normalise
     )
+    crm_matches = crm_index.find_names(stealth_upload["match_name"], crm_names_index)
+    stealth_upload["to_exclude"] = [len(matches) > 0 for matches in crm_matches]
+    stealth_upload["crm_matches"] = ["; ".join(matches) for matches in crm_matches]
 
     stealth_upload_final = stealth_upload[~stealth_upload["to_exclude"]]
     stealth_upload_final = stealth_upload_final.drop(
-        ["to_exclude", "match_name"], axis=1
+        ["to_exclude", "match_name", "crm_matches"], axis=1
     )
     stealth_exclusions = stealth_upload[stealth_upload["to_exclude"]]
     excluded_count = len(stealth_exclusions)
@@ -201,3 +179,7 @@ if __name__ == "__main__":
         index=False,
     )
     print("[{}] Done saving as csv.".format(datetime.now()))
+
+
+if __name__ == "__main__":
+    run(cnx.Cnx)
@@ -0,0 +1,165 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import traffic.curves as curves
+
+# Traffic charts of each domain's monthly visits and curve fits, one PNG per
+# domain. A hash of what each chart shows is kept in HASH_FILE next to the charts
+# directory, and only the charts whose hash changed since the last run (or whose
+# PNG is missing) are drawn again, across a process pool on matplotlib's Agg
+# backend.
+
+# fit coefficients each chart draws
+FIT_COLS = ['coefficient_a', 'coefficient_b', 'coefficient_c', 'slope', 'intercept']
+
+# bump to redraw every chart after changing how they're drawn
+CHART_VERSION = 1
+
+HASH_FILE = 'chart_hashes.csv'
+
+# charts sent to a worker at a time
+CHUNKSIZE = 16
+
+
+def chart_path(chart_dir, domain):
+    return os.path.join(chart_dir, '{}.png'.format(domain))
+
+
+def hash_path(chart_dir):
+    return os.path.join(os.path.dirname(os.path.normpath(chart_dir)), HASH_FILE)
+
+
+def chart_hash(labels, visits, fit):
+    key = repr((CHART_VERSION, list(labels), list(visits), list(fit)))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def load_hashes(path):
+    if not os.path.exists(path):
+        return {}
+    hashes = pd.read_csv(path, dtype=str, keep_default_na=False)
+    return dict(zip(hashes['domain'], hashes['hash']))
+
+
+def save_hashes(path, hashes):
+    pd.DataFrame({'domain': list(hashes), 'hash': list(hashes.values())}).to_csv(
+        path, index=False
+    )
+
+
+def render_chart(chart):
+    # chart is (path, domain, month labels, visits, fit coefficients). matplotlib
+    # is only needed to draw, and is switched to Agg before pyplot is loaded.
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    path, domain, labels, visits, (a, b, c, slope, intercept) = chart
+    x = np.arange(len(visits))
+
+    sns.set_style('whitegrid')
+    fig, ax = plt.subplots()
+    sns.lineplot(
+        x=x, y=curves.exponential_curve(x, a, b, c), color='red', alpha=0.5, ax=ax
+    )
+    sns.lineplot(x=x, y=slope * x + intercept, color='purple', alpha=0.5, ax=ax)
+    sns.lineplot(x=x, y=visits, color='blue', ax=ax)
+
+    ax.set_title(domain)
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels, rotation=60, fontsize=8)
+    ax.set_xlabel('Date')
+    ax.set_ylabel('Visit Count')
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+
+def render_charts(visits, fits, chart_dir, workers=None):
+    # draws the charts of the domains in visits (domain, visit_date, visit_count)
+    # whose series or fits (FIT_COLS, indexed by domain) changed, and returns how
+    # many were drawn. workers=1 draws in this process.
+    os.makedirs(chart_dir, exist_ok=True)
+    path = hash_path(chart_dir)
+    hashes = load_hashes(path)
+
+    stale = []
+    visits = visits.sort_values(['domain', 'visit_date'])
+    for domain, group in visits.groupby('domain', sort=False):
+        if domain not in fits.index:
+            continue
+        labels = group['visit_date'].dt.strftime("%b '%y").tolist()
+        counts = group['visit_count'].tolist()
+        fit = [float(value) for value in fits.loc[domain, FIT_COLS]]
+        content_hash = chart_hash(labels, counts, fit)
+        if hashes.get(domain) == content_hash and os.path.exists(
+            chart_path(chart_dir, domain)
+        ):
+            continue
+        stale.append(
+            (
+                (chart_path(chart_dir, domain), domain, labels, counts, fit),
+                content_hash,
+            )
+        )
+
+    charts = [chart for chart, _ in stale]
+    workers = workers or os.cpu_count()
+    if workers == 1 or len(charts) <= 1:
+        for chart in tqdm(charts):
+            render_chart(chart)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(
+                tqdm(
+                    executor.map(render_chart, charts, chunksize=CHUNKSIZE),
+                    total=len(charts),
+                )
+            )
+
+    for (_, domain, _, _, _), content_hash in stale:
+        hashes[domain] = content_hash
+    save_hashes(path, hashes)
+    return len(charts)
+
+
+def finite_or_null(values):
+    # JSON has no NaN or infinity, both are written as null
+    return values.astype(object).where(np.isfinite(values.astype(float)), None)
+
+
+def chart_data(visits, fits):
+    # the series and fit of each domain's chart, for drawing in the browser. The
+    # month labels are listed once, and each domain has the indexes of its months
+    # in "m", its visits in "v" and its FIT_COLS, to 6 significant figures, in "f".
+    visits = visits[visits['domain'].isin(fits.index)].sort_values(
+        ['domain', 'visit_date']
+    )
+    months, month_ids = np.unique(visits['visit_date'].to_numpy(), return_inverse=True)
+    counts = finite_or_null(visits['visit_count']).to_numpy()
+    fit_values = fits[FIT_COLS].to_numpy(dtype=float)
+    fit_values = finite_or_null(
+        pd.DataFrame(
+            np.char.mod('%.6g', fit_values).astype(float),
+            index=fits.index,
+            columns=FIT_COLS,
+        )
+    )
+    domains = {}
+    for domain, rows in visits.groupby('domain', sort=False).indices.items():
+        domains[domain] = {
+            'm': month_ids[rows].tolist(),
+            'v': counts[rows].tolist(),
+            'f': fit_values.loc[domain].tolist(),
+        }
+    return {
+        'months': pd.DatetimeIndex(months).strftime("%b '%y").tolist(),
+        'domains': domains,
+    }
@@ -0,0 +1,162 @@
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+from scipy.optimize import OptimizeWarning, curve_fit
+from tqdm import tqdm
+
+# Curve fits of each domain's monthly visits. The exponential fits are spread
+# over a process pool, each seeded from a straight line through the log of the
+# visits so it starts close to the answer, and given up on after MAXFEV
+# evaluations of the curve. The linear trends of every domain are worked out at
+# once, as column sums over a domain x month matrix of visits.
+
+# evaluations of the curve a fit gets before it's given up on
+MAXFEV = 1000
+# domains sent to a worker at a time
+CHUNKSIZE = 64
+# points needed to fit the three coefficients
+MIN_POINTS = 3
+
+EXPONENTIAL_COLS = [
+    'coefficient_a',
+    'coefficient_b',
+    'coefficient_c',
+    'covariance_matrix',
+    'r_squared',
+    'fit_status',
+    'fit_seconds',
+]
+
+LINEAR_COLS = ['slope', 'intercept', 'r_value', 'p_value', 'std_err']
+
+# keeps r of +-1 from dividing by zero, as in scipy.stats.linregress
+TINY = 1.0e-20
+
+
+def exponential_curve(x, a, b, c):
+    return a * np.exp(-b * x) + c
+
+
+def log_linear_guess(x, y):
+    # a, b and c of the line log(y - c) = log(a) - b * x, with c just under the
+    # lowest value so the log is defined
+    floor = y.min() - max(1.0, 0.01 * (y.max() - y.min()))
+    slope, intercept = np.polyfit(x, np.log(y - floor), 1)
+    return np.exp(intercept), -slope, floor
+
+
+def fit_exponential(y):
+    # the exponential_curve fit of y against 0, 1, 2.., how long it took, and
+    # whether it converged. Fits that don't get zero coefficients.
+    started = time.perf_counter()
+    y = np.asarray(y, dtype=float)
+    x = np.arange(len(y))
+    a, b, c, covariance_matrix = 0, 0, 0, np.zeros((3, 3))
+    r_squared = 0
+    if len(y) < MIN_POINTS or not np.isfinite(y).all():
+        status = 'too_short' if len(y) < MIN_POINTS else 'error'
+    else:
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', OptimizeWarning)
+                with np.errstate(over='ignore', invalid='ignore'):
+                    (a, b, c), covariance_matrix = curve_fit(
+                        exponential_curve,
+                        x,
+                        y,
+                        p0=log_linear_guess(x, y),
+                        maxfev=MAXFEV,
+                    )
+            status = 'converged'
+        except RuntimeError:
+            status = 'maxfev'
+        except ValueError:
+            status = 'error'
+
+    if status == 'converged':
+        # goodness of fit
+        residuals = y - exponential_curve(x, a, b, c)
+        ss_residuals = np.sum(residuals**2)
+        ss_total = np.sum((y - np.mean(y)) ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r_squared = 1 - (ss_residuals / ss_total)
+
+    return {
+        'coefficient_a': a,
+        'coefficient_b': b,
+        'coefficient_c': c,
+        'covariance_matrix': covariance_matrix,
+        'r_squared': r_squared,
+        'fit_status': status,
+        'fit_seconds': time.perf_counter() - started,
+    }
+
+
+def fit_exponentials(series, workers=None):
+    # the fit of each domain's visits, one row per domain. series maps each
+    # domain to its visit counts in month order. workers=1 fits in this process.
+    domains = list(series)
+    values = [series[domain] for domain in domains]
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        fits = [fit_exponential(y) for y in tqdm(values)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            fits = list(
+                tqdm(
+                    executor.map(fit_exponential, values, chunksize=CHUNKSIZE),
+                    total=len(values),
+                )
+            )
+    return pd.DataFrame(fits, index=domains, columns=EXPONENTIAL_COLS)
+
+
+def fit_linear_trends(visits):
+    # scipy.stats.linregress of each domain's visits against 0, 1, 2.., from a
+    # metrics.visit_matrix. Missing months are left out, so a domain's counts are
+    # numbered in order without gaps as a regression over its rows would be.
+    y = visits.to_numpy(dtype=float)
+    present = ~np.isnan(y)
+    x = np.cumsum(present, axis=1) - 1.0
+    n = present.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_mean = np.where(present, x, 0).sum(axis=1) / n
+        y_mean = np.where(present, y, 0).sum(axis=1) / n
+        dx = np.where(present, x - x_mean[:, None], 0)
+        dy = np.where(present, y - y_mean[:, None], 0)
+        ssxm = (dx**2).sum(axis=1) / n
+        ssym = (dy**2).sum(axis=1) / n
+        ssxym = (dx * dy).sum(axis=1) / n
+
+        r = np.clip(ssxym / np.sqrt(ssxm * ssym), -1.0, 1.0)
+        is_flat = (ssxm == 0) | (ssym == 0)
+        r = np.where(is_flat, np.where(ssxym == 0, np.nan, 0.0), r)
+        slope = ssxym / ssxm
+        intercept = y_mean - slope * x_mean
+
+        df = n - 2.0
+        t = r * np.sqrt(df / ((1.0 - r + TINY) * (1.0 + r + TINY)))
+        p_value = 2 * stats.t.sf(np.abs(t), np.where(df > 0, df, np.nan))
+        std_err = np.sqrt((1 - r**2) * ssym / ssxm / df)
+
+    # a line through two points fits them exactly
+    is_pair = n == 2
+    p_value = np.where(is_pair, np.where(ssym == 0, 1.0, 0.0), p_value)
+    std_err = np.where(is_pair, 0.0, std_err)
+    return pd.DataFrame(
+        {
+            'slope': slope,
+            'intercept': intercept,
+            'r_value': r,
+            'p_value': p_value,
+            'std_err': std_err,
+        },
+        index=visits.index,
+        columns=LINEAR_COLS,
+    )
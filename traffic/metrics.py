@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# Window and growth metrics of each domain's monthly visits, worked out over a
+# dense domain x month matrix with a column for every month. Growth over k months
+# compares each month with the column k to its left, so a domain without a count
+# for either month, or with no visits to grow from, gets NaN rather than whatever
+# row happened to be k back.
+
+# months compared by each growth metric
+GROWTH_MONTHS = {'mom_perc_growth': 1, 'qoq_perc_growth': 3, 'yoy_perc_growth': 12}
+
+# months averaged for last_3_months_mean
+RECENT_MONTHS = 3
+
+# last_3_months_mean buckets, and the ones traffic_flags ranks domains in
+MEAN_BUCKET_BINS = [0, 100, 200, 500, np.inf]
+MEAN_BUCKET_LABELS = ['na', 'low', 'med', 'high']
+RANKED_BUCKETS = ['low', 'med', 'high']
+
+
+def visit_matrix(traffic):
+    # domain x month visit counts, in month order, NaN where a domain has no
+    # count for the month
+    return (
+        traffic.groupby(['domain', 'visit_date'])['visit_count']
+        .sum(min_count=1)
+        .unstack()
+    )
+
+
+def dense_visits(traffic):
+    # visit_matrix with a column for every month from the first to the
+    # latest, NaN where a domain has no count for it
+    visits = visit_matrix(traffic)
+    if visits.empty:
+        return visits
+    visits.columns = pd.to_datetime(visits.columns).to_period('M')
+    return visits.reindex(
+        columns=pd.period_range(visits.columns.min(), visits.columns.max(), freq='M')
+    )
+
+
+def shifted(values, months):
+    # each month's value from `months` earlier, NaN before the first month
+    earlier = np.full(values.shape, np.nan)
+    if months < values.shape[1]:
+        earlier[:, months:] = values[:, :-months]
+    return earlier
+
+
+def growth(visits, months):
+    # percent growth of each month's visits over the visits `months` before it
+    values = visits.to_numpy(dtype=float)
+    earlier = shifted(values, months)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.where(earlier > 0, (values / earlier - 1) * 100, np.nan)
+    return pd.DataFrame(growth, index=visits.index, columns=visits.columns)
+
+
+def growth_metrics(visits):
+    # one row per domain of a dense_visits matrix. Windows and growth end at the
+    # latest month of the matrix.
+    metrics = pd.DataFrame(
+        {
+            'last_24_months_total': visits.sum(axis=1),
+            'last_24_months_mean': visits.mean(axis=1),
+            'last_3_months_mean': visits.iloc[:, -RECENT_MONTHS:].mean(axis=1),
+        },
+        index=visits.index,
+    )
+    for column, months in GROWTH_MONTHS.items():
+        metrics[column] = growth(visits.iloc[:, -months - 1 :], months).iloc[:, -1]
+    return metrics
+
+
+def mean_buckets(values):
+    return pd.cut(values, bins=MEAN_BUCKET_BINS, labels=MEAN_BUCKET_LABELS)
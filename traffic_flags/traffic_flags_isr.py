@@ -1,6 +1,6 @@
 import pandas as pd
 from datetime import datetime
-from context import cnx
+from context import cnx, bulk, metrics
 from sqlalchemy.orm import sessionmaker
 
 SPC_GEO = 'ISR'
@@ -13,7 +13,7 @@ select
     	left join companies c on t."domain" = c.primary_url
     	left join score_v2.company_locations cl on cl.company_id = c.company_id
     where last_3_months_mean > 2500
-	and last_3_months_mean_bucket in ('low', 'med','high')
+	and last_3_months_mean_bucket in %(buckets)s
     and cl.spc_geo = '{}'
 '''.format(
     SPC_GEO
@@ -37,14 +37,16 @@ delete_traffic_query = '''
     SPC_GEO
 )
 
-if __name__ == '__main__':
+
+def run(conn):
     print('[{}] Starting traffic_flags_{}.py'.format(datetime.now(), SPC_GEO.lower()))
-    conn = cnx.Cnx
     session = sessionmaker(bind=conn)()
 
     # pull data
     print('[{}] Pulling traffic...'.format(datetime.now()))
-    raw_traffic = pd.read_sql(traffic_query, conn)
+    raw_traffic = pd.read_sql(
+        traffic_query, conn, params={'buckets': tuple(metrics.RANKED_BUCKETS)}
+    )
     print('[{}] Done pulling traffic.'.format(datetime.now()))
 
     # group by last_3_months_mean_bucket, and get the top r-squared for each bucket
@@ -74,7 +76,11 @@ if __name__ == '__main__':
     to_write = traffic[['company_id', 'is_traffic_priority']]
     to_write['generated_at'] = datetime.now()
     to_write['spc_geo'] = SPC_GEO
-    to_write.to_sql(
-        'traffic_flags', conn, if_exists='append', index=False, schema='score_v2'
+    bulk.copy_to_sql(
+        to_write, 'traffic_flags', conn, if_exists='append', schema='score_v2'
     )
     print('[{}] Done writing to db'.format(datetime.now()))
+
+
+if __name__ == '__main__':
+    run(cnx.Cnx)